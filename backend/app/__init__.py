@@ -1,16 +1,32 @@
 from flask import Flask
 from flask_cors import CORS
 from .config import Config
-from .sql import db
+from .sql import check_server_version, db, engine_options
 
 
-def create_app():
+def create_app(background=True):
+    """
+    创建 Flask 应用。background 为 True 时启动后台服务：在后台加载情绪分析模型
+    （应用无需等待模型即可开始服务），启动 Config.JOB_WORKERS 个任务工作线程和关注列表调度器；
+    命令行工具等不需要这些服务的场景可传入 False。
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
+    app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options())
 
     # 初始化 SQLAlchemy
     db.init_app(app)
 
+    # 创建结构固定的数据表（如情绪分析结果表），已存在的表不会重复创建
+    from . import models
+
+    with app.app_context():
+        with db.engine.connect() as conn:
+            check_server_version(conn)
+        db.create_all()
+        with db.engine.begin() as conn:
+            models.apply_schema_migrations(conn)
+
     # 启用 CORS，允许所有来源跨域访问
     CORS(app)
 
@@ -19,4 +35,25 @@ def create_app():
 
     app.register_blueprint(main_bp)
 
+    if background:
+        start_background_services(app)
+
     return app
+
+
+def start_background_services(app):
+    """
+    启动后台服务：加载并预热情绪分析模型、启动任务工作线程、关注列表调度器和指标快照写入线程，返回任务工作线程列表。
+    线程不会随 fork 复制到子进程，预派生服务器需在每个工作进程 fork 后调用。
+    """
+    from .jobs import start_workers
+    from .metrics import start_snapshot_writer
+    from .pipeline import start_model_warmup
+    from .tasks import TASK_HANDLERS
+    from .watchlist import start_watch_scheduler
+
+    start_model_warmup()
+    workers = start_workers(app, Config.JOB_WORKERS, TASK_HANDLERS)
+    start_watch_scheduler(app)
+    start_snapshot_writer()
+    return workers
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+
+from .config import Config
+
+# 可选的推理后端，由 Config.INFER_BACKEND 在启动时选择
+BACKENDS = ("pytorch", "onnx", "onnx-int8")
+
+# BERT 位置编码支持的最大 token 数
+BERT_MAX_POSITIONS = 512
+
+# 决定 PyTorch 模型内容的文件，参与共享权重文件的模型指纹
+MODEL_FILES = ("pytorch_model.bin", "config.json", "configuration.json")
+
+
+def result_revision(backend=None):
+    """
+    返回写入情绪分析结果表时使用的模型版本标识。
+    PyTorch 后端沿用 Config.MODEL_REVISION；ONNX 后端（尤其是 int8 量化）的置信度与之存在细微差异，
+    因此附加后端名称，使不同后端的结果互不复用。
+    """
+    backend = backend or Config.INFER_BACKEND
+    if backend == "pytorch":
+        return Config.MODEL_REVISION
+    return f"{Config.MODEL_REVISION}+{backend}"
+
+
+def max_token_length(backend=None):
+    """
+    返回推理后端实际处理的最大 token 数（含 [CLS] 与 [SEP]），用于按 token 预算组批。
+    ONNX 后端分词时截断到导出长度 Config.INFER_MAX_SEQ_LENGTH；PyTorch 后端按完整输入计，
+    输入文本已截断到 Config.INFER_MAX_TEXT_LENGTH 个字符（中文基本一字一词），不超过 BERT 的位置上限。
+    """
+    backend = backend or Config.INFER_BACKEND
+    if backend == "pytorch":
+        return min(Config.INFER_MAX_TEXT_LENGTH + 2, BERT_MAX_POSITIONS)
+    return Config.INFER_MAX_SEQ_LENGTH
+
+
+def model_fingerprint(model_dir):
+    """
+    返回模型指纹：由 Config.MODEL_REVISION、模型目录及其中模型文件的大小和修改时间计算，
+    模型文件或版本变化后指纹随之变化，用于判断导出的共享权重文件是否过期。
+    """
+    digest = hashlib.sha1(Config.MODEL_REVISION.encode("utf-8"))
+    digest.update(os.path.abspath(model_dir).encode("utf-8"))
+    for name in MODEL_FILES:
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _replace_file(path, write):
+    # 写入临时文件后原子替换，多进程同时写入也是安全的
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def onnx_model_path(backend):
+    """
+    返回 ONNX 后端对应的模型文件路径。
+    """
+    if backend == "onnx-int8":
+        return os.path.join(Config.ONNX_MODEL_DIR, "model.int8.onnx")
+    return os.path.join(Config.ONNX_MODEL_DIR, "model.onnx")
+
+
+class PytorchBackend:
+    """
+    ModelScope 的 PyTorch 文本分类 pipeline。
+    """
+
+    def __init__(self, model_dir):
+        from modelscope.pipelines import pipeline
+        from modelscope.utils.constant import Tasks
+
+        if Config.INFER_THREADS > 0:
+            import torch
+
+            torch.set_num_threads(Config.INFER_THREADS)
+
+        self.pipeline = pipeline(
+            Tasks.text_classification,
+            model_revision=Config.MODEL_REVISION,
+            model=model_dir,
+        )
+
+    def __call__(self, texts):
+        return self.pipeline(input=texts, batch_size=len(texts))
+
+    def map_weights(self, path, fingerprint):
+        """
+        将模型参数替换为内存映射的只读权重文件，多个进程映射同一文件时共享物理内存页。
+        导出时在 {path}.json 中记录模型指纹（见 model_fingerprint），文件不存在或指纹不一致
+        （模型文件或 MODEL_REVISION 已更新）时由当前进程重新导出，不会继续使用旧模型的权重。
+        """
+        import torch
+
+        model = self.pipeline.model
+        meta_path = f"{path}.json"
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                exported = json.load(f).get("fingerprint")
+        except (OSError, ValueError):
+            exported = None
+        if exported != fingerprint or not os.path.exists(path):
+            _replace_file(path, lambda tmp: torch.save(model.state_dict(), tmp))
+
+            def write_meta(tmp):
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"fingerprint": fingerprint}, f)
+
+            _replace_file(meta_path, write_meta)
+
+        state = torch.load(path, mmap=True, weights_only=True)
+        model.load_state_dict(state, assign=True)
+        model.eval()
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime 推理后端，模型由 export_onnx.py 从 PyTorch 模型导出。
+    分词使用 model_dir 下 vocab.txt 构建的快速分词器，每批只填充到批内最长文本，
+    输出与 PyTorch pipeline 相同格式的 {"labels": [...], "scores": [...]} 列表。
+    """
+
+    def __init__(self, model_dir, model_path):
+        import onnxruntime
+        from transformers import BertTokenizerFast
+
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"未找到 ONNX 模型 {model_path}，请先运行 export_onnx.py 导出"
+            )
+
+        self.tokenizer = BertTokenizerFast(os.path.join(model_dir, "vocab.txt"))
+        with open(os.path.join(model_dir, "config.json"), encoding="utf-8") as f:
+            id2label = json.load(f)["id2label"]
+        self.labels = [id2label[str(i)] for i in range(len(id2label))]
+
+        options = onnxruntime.SessionOptions()
+        if Config.INFER_THREADS > 0:
+            options.intra_op_num_threads = Config.INFER_THREADS
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        self.session = onnxruntime.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+
+    def __call__(self, texts):
+        import numpy as np
+
+        encoded = self.tokenizer(
+            list(texts),
+            padding="longest",
+            truncation=True,
+            max_length=Config.INFER_MAX_SEQ_LENGTH,
+            return_tensors="np",
+        )
+        feeds = {
+            name: value.astype(np.int64)
+            for name, value in encoded.items()
+            if name in self.input_names
+        }
+        logits = self.session.run(None, feeds)[0]
+
+        # softmax 得到各情绪的置信度
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs = exp / exp.sum(axis=1, keepdims=True)
+        return [{"labels": list(self.labels), "scores": row.tolist()} for row in probs]
+
+
+def load_backend(backend, model_dir):
+    """
+    按名称加载推理后端，返回可调用对象：输入文本列表，输出等长的 {"labels", "scores"} 列表。
+    """
+    if backend == "pytorch":
+        return PytorchBackend(model_dir)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxBackend(model_dir, onnx_model_path(backend))
+    raise ValueError(f"未知的推理后端 {backend}，可选值为 {', '.join(BACKENDS)}")
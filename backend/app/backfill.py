@@ -0,0 +1,95 @@
+import time
+from collections import deque
+
+from .config import Config
+from .inference_cache import inference_cache
+from .models import Comment, Video
+from .pipeline import (
+    RESULT_REVISION,
+    AnalysisCheckpoint,
+    lookup_predictions,
+    save_predictions,
+    truncate_text,
+)
+from .sql import db
+
+
+def backfill_video_sentiment(video_id, pool, start_seq=None, chunk_size=None):
+    """
+    生成器：使用多进程推理池分析视频的全部评论，需在应用上下文中调用。
+    评论按 seq 顺序每 chunk_size 条切分为一个区间，各区间分发给不同的工作进程并行推理，
+    结果按区间顺序依次写回结果表并推进 last_analyzed_seq（见 AnalysisCheckpoint），保证检查点之前没有遗漏。
+    start_seq 为空时从视频的 last_analyzed_seq 之后继续。
+    待推理的评论先经推理缓存去重和查询，只有未命中的文本才交给推理池。
+    每完成一个区间 yield 一次累计进度 {"analyzed", "inferred", "cached", "last_seq", "rate"}。
+    """
+    chunk_size = chunk_size or Config.INFER_POOL_CHUNK_SIZE
+    video = db.session.get(Video, str(video_id))
+    if video is None:
+        return
+    if start_seq is None:
+        start_seq = video.last_analyzed_seq + 1
+
+    query = (
+        Comment.query.filter(Comment.video_id == video_id, Comment.seq >= start_seq)
+        .order_by(Comment.seq)
+        .yield_per(chunk_size)
+    )
+
+    progress = {
+        "analyzed": 0,
+        "inferred": 0,
+        "cached": 0,
+        "last_seq": start_seq - 1,
+        "rate": 0.0,
+    }
+    checkpoint = AnalysisCheckpoint(video_id, start_seq)
+    started = time.monotonic()
+    # 在途区间：(评论列表, 哈希, 已存储结果, 待推理下标, 待推理文本, 缓存结果, 未命中文本, Future)，
+    # 保持提交顺序
+    in_flight = deque()
+
+    def finish(chunk):
+        comment_objs, hashes, stored, pending, texts, cached, missing, future = chunk
+        inferred = future.result() if future is not None else []
+        analyzed = inference_cache.fill(
+            texts, cached, missing, inferred, RESULT_REVISION
+        )
+        labels = save_predictions(
+            video_id, comment_objs, hashes, stored, pending, analyzed
+        )
+        checkpoint.update(comment_objs, labels)
+        progress["analyzed"] += len(comment_objs)
+        progress["inferred"] += len(missing)
+        progress["cached"] += len(pending) - len(missing)
+        progress["last_seq"] = comment_objs[-1].seq
+        progress["rate"] = progress["analyzed"] / max(time.monotonic() - started, 1e-6)
+        return dict(progress)
+
+    def dispatch(comment_objs):
+        hashes, stored, pending = lookup_predictions(comment_objs)
+        texts = [truncate_text(comment_objs[index].text) for index in pending]
+        cached, missing = inference_cache.lookup(texts, RESULT_REVISION)
+        future = pool.submit(missing) if missing else None
+        in_flight.append(
+            (comment_objs, hashes, stored, pending, texts, cached, missing, future)
+        )
+
+    try:
+        comment_objs = []
+        for comment in query:
+            comment_objs.append(comment)
+            if len(comment_objs) == chunk_size:
+                dispatch(comment_objs)
+                comment_objs = []
+                # 每个工作进程最多排队两个区间，控制内存占用
+                while len(in_flight) >= pool.workers * 2:
+                    yield finish(in_flight.popleft())
+        if comment_objs:
+            dispatch(comment_objs)
+        while in_flight:
+            yield finish(in_flight.popleft())
+    finally:
+        for *_, future in in_flight:
+            if future is not None:
+                future.cancel()
@@ -0,0 +1,118 @@
+from datetime import datetime, timezone
+from sqlalchemy import and_, func, select
+
+from .models import Comment, SentimentResult
+from .pipeline import RESULT_REVISION
+from .sql import db
+
+# 每页默认与最多返回的评论数
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+
+def parse_time(value):
+    """
+    解析时间参数：Unix 时间戳（秒）或 ISO 8601 字符串，不带时区的按 UTC 处理。
+    格式错误或时间戳超出可表示的范围时抛出 ValueError。
+    """
+    try:
+        timestamp = float(value)
+    except ValueError:
+        timestamp = None
+    if timestamp is not None:
+        # 超大的时间戳抛出 OverflowError，部分平台上超出范围时抛出 OSError
+        try:
+            return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+        except (ValueError, OverflowError, OSError) as e:
+            raise ValueError(f"时间戳超出范围：{value}") from e
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def search_comments(
+    video_id,
+    emotion=None,
+    since=None,
+    until=None,
+    min_replies=None,
+    keyword=None,
+    after=0,
+    limit=DEFAULT_LIMIT,
+):
+    """
+    按条件查询视频的评论，按 seq 升序以键集方式分页，每页最多 limit 条。
+      - emotion：当前模型版本给出的情绪标签
+      - since / until：发布时间范围 [since, until)
+      - min_replies：一级评论回复数下限
+      - keyword：包含的关键词（不区分大小写），两个字符及以上的关键词先经字符二元组 GIN 索引筛选
+      - after：上一页返回的 next_cursor，只返回 seq 大于它的评论
+    返回 ({"comments": [...], "next_cursor": 下一页游标或 None}, status_code)。
+    """
+    if not video_id:
+        return {"error": "缺少 video_id 参数"}, 400
+    limit = min(max(limit or DEFAULT_LIMIT, 1), MAX_LIMIT)
+
+    result = SentimentResult
+    label_join = and_(
+        result.cid == Comment.cid, result.model_revision == RESULT_REVISION
+    )
+    query = select(
+        Comment.seq,
+        Comment.cid,
+        Comment.parent_cid,
+        Comment.text,
+        Comment.create_time,
+        Comment.reply_comment_total,
+        result.label,
+    ).where(Comment.video_id == str(video_id), Comment.seq > after)
+    if emotion:
+        # 从结果表的 (video_id, model_revision, label, seq) 索引按序号读取该情绪的评论，
+        # 再按主键回表，开销与匹配的评论数成正比，而不是逐条探查整个视频
+        query = (
+            query.join(result, and_(label_join, result.video_id == Comment.video_id))
+            .where(
+                result.video_id == str(video_id),
+                result.label == emotion,
+                result.seq > after,
+            )
+            .order_by(result.seq)
+        )
+    else:
+        query = query.outerjoin(result, label_join).order_by(Comment.seq)
+    if since is not None:
+        query = query.where(Comment.create_time >= since)
+    if until is not None:
+        query = query.where(Comment.create_time < until)
+    if min_replies:
+        query = query.where(Comment.reply_comment_total >= min_replies)
+    if keyword:
+        if len(keyword) >= 2:
+            # 关键词的每个二元组都必须出现在评论中，再用子串匹配精确确认
+            query = query.where(
+                func.comment_bigrams(Comment.text).op("@>")(
+                    func.comment_bigrams(keyword)
+                )
+            )
+        query = query.where(func.strpos(func.lower(Comment.text), keyword.lower()) > 0)
+
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    comments = [
+        {
+            "seq": row.seq,
+            "cid": row.cid,
+            "parent_cid": row.parent_cid,
+            "text": row.text,
+            "create_time": row.create_time.isoformat(),
+            "reply_comment_total": row.reply_comment_total,
+            "predicted_emotion": row.label,
+        }
+        for row in rows
+    ]
+    return {
+        "comments": comments,
+        "next_cursor": rows[-1].seq if has_more else None,
+    }, 200
@@ -1,19 +1,23 @@
-import requests
 import json
-import time
-import concurrent.futures
-from datetime import datetime, timezone
-from flask import current_app, request
-from sqlalchemy import inspect
-
-from .models import create_model
+from flask import request
+from sqlalchemy import and_, case, or_, select
+from . import metrics
+from .crawler import (
+    UpstreamRequestError,
+    UpstreamResponseError,
+    fetch_video_comments,
+    iter_reply_pages,
+)
+from .database import ensure_video, video_exists
+from .ingest import parse_comment_items, upsert_comments
+from .models import Comment, CrawlCheckpoint
 from .sql import db
-from .config import Config
+from .streaming import client_disconnected
 
 
 def fetch_and_store_comments(video_id):
     """
-    根据 video_id 分批次抓取评论，并将其存入以 video_id 命名的表中（仅存储一级评论）。
+    根据 video_id 分批次抓取评论，并将其存入评论表中（仅存储一级评论）。
     使用接口返回的 reply_comment_total 字段来记录每条评论的回复数量。
     如果数据库中已存在相同 cid 的记录，则更新该记录。
     """
@@ -25,226 +29,158 @@ def fetch_and_store_comments(video_id):
     except ValueError:
         pass
 
-    CommentModel = create_model(video_id)
-
-    with db.engine.begin() as conn:
-        CommentModel.__table__.create(bind=conn, checkfirst=True)
+    ensure_video(video_id)
 
     stored_comments = 0
+    updated_comments = 0
     cursor = 0
-    external_url = f"{Config.DOUYIN_API_BASE_URI}/fetch_video_comments"
 
     while True:
-        params = {
-            "aweme_id": str(video_id),
-            "cursor": cursor,
-        }
-
         try:
-            ext_response = requests.get(external_url, params=params)
-            ext_response.raise_for_status()
-        except requests.RequestException as e:
-            return {"error": "获取评论数据失败", "details": str(e)}, 500
-
-        resp_json = ext_response.json()
-        if (
-            resp_json.get("code") != 200
-            or resp_json.get("data", {}).get("status_code") != 0
-        ):
-            return {"error": "外部接口返回错误", "data": resp_json}, 500
-
-        comments_list = resp_json.get("data", {}).get("comments", [])
-        new_cursor = resp_json.get("data", {}).get("cursor")
-        has_more = resp_json.get("data", {}).get("has_more", 0)
+            comments_list, new_cursor, has_more = fetch_video_comments(video_id, cursor)
+        except UpstreamRequestError as e:
+            return {"error": "获取评论数据失败", "details": e.details}, 500
+        except UpstreamResponseError as e:
+            return {"error": "外部接口返回错误", "data": e.data}, 500
+
         if not comments_list:
             break
 
-        insert_data = []
-        for item in comments_list:
-            cid = item.get("cid")
-            text = item.get("text")
-            create_time = item.get("create_time")
-            if cid and text and create_time:
-                dt = datetime.fromtimestamp(create_time, tz=timezone.utc)
-                reply_total = item.get("reply_comment_total", 0)
-                insert_data.append(
-                    {
-                        "cid": cid,
-                        "text": text,
-                        "create_time": dt,
-                        "reply_comment_total": reply_total,
-                    }
-                )
-
-        if insert_data:
-            cids_to_check = [d["cid"] for d in insert_data]
-            existing_rows = CommentModel.query.filter(
-                CommentModel.cid.in_(cids_to_check)
-            ).all()
-            existing_cids = {row.cid for row in existing_rows}
-            # 更新已有记录
-            update_data = [d for d in insert_data if d["cid"] in existing_cids]
-            if update_data:
-                try:
-                    db.session.bulk_update_mappings(CommentModel, update_data)
-                    db.session.commit()
-                except Exception as e:
-                    db.session.rollback()
-                    return {"error": "更新评论数据失败", "details": str(e)}, 500
-            # 插入新记录
-            final_data = [d for d in insert_data if d["cid"] not in existing_cids]
-            if final_data:
-                try:
-                    db.session.bulk_insert_mappings(CommentModel, final_data)
-                    db.session.commit()
-                    stored_comments += len(final_data)
-                except Exception as e:
-                    db.session.rollback()
-                    return {"error": "存储评论数据失败", "details": str(e)}, 500
-
-        # 根据 has_more 判断是否继续抓取
+        rows = parse_comment_items(comments_list)
+        try:
+            inserted, updated = upsert_comments(video_id, rows)
+        except Exception as e:
+            return {"error": "存储评论数据失败", "details": str(e)}, 500
+        stored_comments += inserted
+        updated_comments += updated
+
+        # 根据 has_more 判断是否继续抓取，请求节奏由抓取引擎的速率预算控制
         if has_more == 1:
             cursor = new_cursor
         else:
             break
 
-        time.sleep(3)
-
     if stored_comments == 0:
-        return {"message": "没有存入新评论"}, 200
+        return {
+            "message": "没有存入新评论",
+            "stored": 0,
+            "updated": updated_comments,
+        }, 200
     else:
-        return {"message": f"成功存储 {stored_comments} 条评论"}, 200
+        return {
+            "message": f"成功存储 {stored_comments} 条评论",
+            "stored": stored_comments,
+            "updated": updated_comments,
+        }, 200
 
 
-def fetch_replies_for_comment(video_id, first_comment_cid):
+def reply_crawl_targets(video_id):
     """
-    辅助函数：获取某个一级评论的所有二级评论，并存入数据库（不再存储评论级别）。
-    对于二级评论，reply_comment_total 默认设为 0。
+    返回需要抓取回复的一级评论列表，每项包含 cid、reply_comment_total 和起始游标 cursor。
+    上次抓取中断的一级评论从断点继续；已抓取完毕且回复数与当时相同的一级评论直接跳过，
+    回复数有变化的从头重新抓取。
     """
-    CommentModel = create_model(video_id)
-    cursor = 0
-    total_replies = 0
-    external_url = f"{Config.DOUYIN_API_BASE_URI}/fetch_video_comment_replies"
-
-    while True:
-        params = {
-            "item_id": str(video_id),
-            "comment_id": first_comment_cid,
-            "cursor": cursor,
-        }
-        try:
-            ext_response = requests.get(external_url, params=params)
-            ext_response.raise_for_status()
-        except requests.RequestException as e:
-            print(f"获取评论 {first_comment_cid} 回复时出错：{e}")
-            break
-
-        resp_json = ext_response.json()
-        if (
-            resp_json.get("code") != 200
-            or resp_json.get("data", {}).get("status_code") != 0
-        ):
-            print(f"评论 {first_comment_cid} 回复接口返回错误：{resp_json}")
-            break
-
-        replies_list = resp_json.get("data", {}).get("comments", [])
-        new_cursor = resp_json.get("data", {}).get("cursor")
-        has_more = resp_json.get("data", {}).get("has_more", 0)
-        if not replies_list:
-            break
-
-        insert_data = []
-        for item in replies_list:
-            cid = item.get("cid")
-            text = item.get("text")
-            create_time = item.get("create_time")
-            if cid and text and create_time:
-                dt = datetime.fromtimestamp(create_time, tz=timezone.utc)
-                # 对于二级评论，不存储级别，reply_comment_total 默认为 0
-                insert_data.append(
-                    {
-                        "cid": cid,
-                        "text": text,
-                        "create_time": dt,
-                        "reply_comment_total": 0,
-                    }
-                )
-
-        if insert_data:
-            cids_to_check = [d["cid"] for d in insert_data]
-            existing_rows = CommentModel.query.filter(
-                CommentModel.cid.in_(cids_to_check)
-            ).all()
-            existing_cids = {row.cid for row in existing_rows}
-            # 更新已有的二级评论（如果需要更新信息）
-            update_data = [d for d in insert_data if d["cid"] in existing_cids]
-            if update_data:
-                try:
-                    db.session.bulk_update_mappings(CommentModel, update_data)
-                    db.session.commit()
-                except Exception as e:
-                    db.session.rollback()
-                    print(f"更新评论 {first_comment_cid} 回复时出错：{e}")
-            # 插入新记录
-            final_data = [d for d in insert_data if d["cid"] not in existing_cids]
-            if final_data:
-                try:
-                    db.session.bulk_insert_mappings(CommentModel, final_data)
-                    db.session.commit()
-                    total_replies += len(final_data)
-                except Exception as e:
-                    db.session.rollback()
-                    print(f"存储评论 {first_comment_cid} 回复时出错：{e}")
-
-        if has_more == 1:
-            cursor = new_cursor
-        else:
-            break
-
-        time.sleep(3)
-    return total_replies
+    checkpoint = CrawlCheckpoint
+    query = (
+        select(
+            Comment.cid,
+            Comment.reply_comment_total,
+            case((checkpoint.has_more, checkpoint.cursor), else_=0).label("cursor"),
+        )
+        .outerjoin(
+            checkpoint,
+            and_(
+                checkpoint.video_id == Comment.video_id,
+                checkpoint.parent_cid == Comment.cid,
+            ),
+        )
+        .where(
+            Comment.video_id == str(video_id),
+            Comment.parent_cid.is_(None),
+            Comment.reply_comment_total > 0,
+            or_(
+                checkpoint.video_id.is_(None),
+                checkpoint.has_more,
+                checkpoint.reply_total.is_distinct_from(Comment.reply_comment_total),
+            ),
+        )
+        .order_by(Comment.seq)
+    )
+    return db.session.execute(query).all()
 
 
-def fetch_replies_with_context(video_id, comment_cid, app):
+def store_comment_replies(video_id, targets):
     """
-    包装函数：在应用上下文中执行获取回复的操作。
+    并发抓取多条一级评论的二级评论并存入数据库（记录其所属的一级评论），需在应用上下文中调用。
+    targets 为 reply_crawl_targets 的结果，每条一级评论从其起始游标开始翻页，
+    每页回复与该一级评论的抓取断点在同一事务内写入，中断后再次抓取时从断点继续。
+    对于二级评论，reply_comment_total 默认设为 0。
+    生成器：每处理完一条一级评论 yield 一次累计进度 {"processed", "stored", "updated"}，
+    关闭生成器会取消尚未完成的抓取。
     """
-    with app.app_context():
-        return fetch_replies_for_comment(video_id, comment_cid)
+    reply_totals = {target.cid: target.reply_comment_total for target in targets}
+    cursors = {target.cid: target.cursor for target in targets}
+    processed = 0
+    total_replies = 0
+    updated_replies = 0
+    for page in iter_reply_pages(video_id, list(cursors), cursors):
+        checkpoint = None
+        if page.error is not None:
+            # 保留上一页写入的断点，下次从该处继续
+            print(f"获取评论 {page.parent_cid} 回复时出错：{page.error}")
+            metrics.reply_thread_errors.inc(stage="fetch")
+        else:
+            checkpoint = {
+                "parent_cid": page.parent_cid,
+                "cursor": page.cursor,
+                "has_more": not page.done,
+                "reply_total": reply_totals[page.parent_cid] if page.done else None,
+            }
+
+        rows = parse_comment_items(page.comments, parent_cid=page.parent_cid)
+        try:
+            inserted, updated = upsert_comments(video_id, rows, checkpoint)
+        except Exception as e:
+            print(f"存储评论 {page.parent_cid} 回复时出错：{e}")
+            metrics.reply_thread_errors.inc(stage="store")
+            inserted, updated = 0, 0
+        total_replies += inserted
+        updated_replies += updated
+
+        if page.done:
+            processed += 1
+            yield {
+                "processed": processed,
+                "stored": total_replies,
+                "updated": updated_replies,
+            }
 
 
 def fetch_and_store_comments_replies(video_id):
     """
     根据视频ID获取该视频所有一级评论的二级评论，并将二级评论存入数据库。
     该函数首先查询数据库中 reply_comment_total 大于 0 的评论，
-    只有这些评论才会触发获取回复的操作。
+    只有这些评论才会触发获取回复的操作，已完整抓取且回复数未变化的评论会被跳过。
     """
     if not video_id:
         return {"error": "缺少视频ID参数"}, 400
 
-    CommentModel = create_model(video_id)
-    inspector = inspect(db.engine)
-    if CommentModel.__tablename__ not in inspector.get_table_names():
+    if not video_exists(video_id):
         return {"message": "该视频尚未获取任何评论"}, 200
 
-    first_level_comments = CommentModel.query.filter(
-        CommentModel.reply_comment_total > 0
-    ).all()
-    if not first_level_comments:
-        return {"message": "该视频尚未获取任何有回复的评论"}, 200
+    targets = reply_crawl_targets(video_id)
+    if not targets:
+        return {"message": "该视频没有需要获取回复的评论"}, 200
 
-    total_replies = 0
-    app = current_app._get_current_object()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-        futures = []
-        for comment in first_level_comments:
-            futures.append(
-                executor.submit(fetch_replies_with_context, video_id, comment.cid, app)
-            )
-        for future in concurrent.futures.as_completed(futures):
-            total_replies += future.result()
+    progress = {"stored": 0, "updated": 0}
+    for progress in store_comment_replies(video_id, targets):
+        pass
 
-    return {"message": f"成功存储 {total_replies} 条二级评论"}, 200
+    return {
+        "message": f"成功存储 {progress['stored']} 条二级评论",
+        "stored": progress["stored"],
+        "updated": progress["updated"],
+    }, 200
 
 
 #############################################
@@ -267,105 +203,61 @@ def generate_fetch_comments(video_id):
     except ValueError:
         pass
 
-    CommentModel = create_model(video_id)
-    with db.engine.begin() as conn:
-        CommentModel.__table__.create(bind=conn, checkfirst=True)
+    ensure_video(video_id)
 
     fetched_total = 0
     stored_total = 0
+    updated_total = 0
     cursor = 0
-    external_url = f"{Config.DOUYIN_API_BASE_URI}/fetch_video_comments"
 
     while True:
-        params = {
-            "aweme_id": str(video_id),
-            "cursor": cursor,
-        }
         try:
-            ext_response = requests.get(external_url, params=params)
-            ext_response.raise_for_status()
-        except requests.RequestException as e:
-            yield json.dumps({"error": "获取评论数据失败", "details": str(e)})
+            comments_list, new_cursor, has_more = fetch_video_comments(video_id, cursor)
+        except UpstreamRequestError as e:
+            yield json.dumps({"error": "获取评论数据失败", "details": e.details})
             return
-
-        resp_json = ext_response.json()
-        if (
-            resp_json.get("code") != 200
-            or resp_json.get("data", {}).get("status_code") != 0
-        ):
-            yield json.dumps({"error": "外部接口返回错误", "data": resp_json})
+        except UpstreamResponseError as e:
+            yield json.dumps({"error": "外部接口返回错误", "data": e.data})
             return
 
-        comments_list = resp_json.get("data", {}).get("comments", [])
-        new_cursor = resp_json.get("data", {}).get("cursor")
-        has_more = resp_json.get("data", {}).get("has_more", 0)
         if not comments_list:
             # 无新数据时返回最终进度
-            yield json.dumps({"fetched": fetched_total, "stored": stored_total})
+            yield json.dumps(
+                {
+                    "fetched": fetched_total,
+                    "stored": stored_total,
+                    "updated": updated_total,
+                }
+            )
             break
 
         fetched_total += len(comments_list)
-        insert_data = []
-        for item in comments_list:
-            cid = item.get("cid")
-            text = item.get("text")
-            create_time = item.get("create_time")
-            if cid and text and create_time:
-                dt = datetime.fromtimestamp(create_time, tz=timezone.utc)
-                reply_total = item.get("reply_comment_total", 0)
-                insert_data.append(
-                    {
-                        "cid": cid,
-                        "text": text,
-                        "create_time": dt,
-                        "reply_comment_total": reply_total,
-                    }
-                )
-
-        if insert_data:
-            cids_to_check = [d["cid"] for d in insert_data]
-            existing_rows = CommentModel.query.filter(
-                CommentModel.cid.in_(cids_to_check)
-            ).all()
-            existing_cids = {row.cid for row in existing_rows}
-            # 更新已有记录
-            update_data = [d for d in insert_data if d["cid"] in existing_cids]
-            if update_data:
-                try:
-                    db.session.bulk_update_mappings(CommentModel, update_data)
-                    db.session.commit()
-                except Exception as e:
-                    db.session.rollback()
-                    yield json.dumps({"error": "更新评论数据失败", "details": str(e)})
-                    return
-            # 插入新记录
-            final_data = [d for d in insert_data if d["cid"] not in existing_cids]
-            if final_data:
-                try:
-                    db.session.bulk_insert_mappings(CommentModel, final_data)
-                    db.session.commit()
-                    stored_total += len(final_data)
-                except Exception as e:
-                    db.session.rollback()
-                    yield json.dumps({"error": "存储评论数据失败", "details": str(e)})
-                    return
-
-        # 定期返回进度（仅返回抓取的评论数量和存入数据库的新评论数量）
-        yield json.dumps({"fetched": fetched_total, "stored": stored_total})
+        rows = parse_comment_items(comments_list)
+        try:
+            inserted, updated = upsert_comments(video_id, rows)
+        except Exception as e:
+            yield json.dumps({"error": "存储评论数据失败", "details": str(e)})
+            return
+        stored_total += inserted
+        updated_total += updated
+
+        # 定期返回进度（返回抓取的评论数量、存入数据库的新评论数量和更新的评论数量）
+        yield json.dumps(
+            {"fetched": fetched_total, "stored": stored_total, "updated": updated_total}
+        )
 
         if has_more == 1:
             cursor = new_cursor
         else:
             break
 
-        time.sleep(1)
         # 检查客户端是否断开连接
-        if request.environ.get("wsgi.input") and getattr(
-            request.environ.get("wsgi.input"), "closed", False
-        ):
+        if client_disconnected(request.environ):
             break
 
-    yield json.dumps({"fetched": fetched_total, "stored": stored_total})
+    yield json.dumps(
+        {"fetched": fetched_total, "stored": stored_total, "updated": updated_total}
+    )
 
 
 def generate_fetch_comments_replies(video_id):
@@ -378,45 +270,40 @@ def generate_fetch_comments_replies(video_id):
         yield json.dumps({"error": "缺少视频ID参数"})
         return
 
-    CommentModel = create_model(video_id)
-    inspector = inspect(db.engine)
-    if CommentModel.__tablename__ not in inspector.get_table_names():
+    if not video_exists(video_id):
         yield json.dumps(
             {"fetched": 0, "stored": 0, "message": "该视频尚未获取任何评论"}
         )
         return
 
-    first_level_comments = CommentModel.query.filter(
-        CommentModel.reply_comment_total > 0
-    ).all()
-    if not first_level_comments:
+    targets = reply_crawl_targets(video_id)
+    if not targets:
         yield json.dumps(
-            {"fetched": 0, "stored": 0, "message": "该视频尚未获取任何有回复的评论"}
+            {"fetched": 0, "stored": 0, "message": "该视频没有需要获取回复的评论"}
         )
         return
 
-    total_replies = 0
-    processed_comments = 0
-    app = current_app._get_current_object()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-        futures = {
-            executor.submit(
-                fetch_replies_with_context, video_id, comment.cid, app
-            ): comment.cid
-            for comment in first_level_comments
-        }
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                replies_count = future.result()
-            except Exception:
-                replies_count = 0
-            total_replies += replies_count
-            processed_comments += 1
-            yield json.dumps({"fetched": processed_comments, "stored": total_replies})
+    progress = {"processed": 0, "stored": 0, "updated": 0}
+    replies = store_comment_replies(video_id, targets)
+    try:
+        for progress in replies:
+            yield json.dumps(
+                {
+                    "fetched": progress["processed"],
+                    "stored": progress["stored"],
+                    "updated": progress["updated"],
+                }
+            )
             # 检查客户端是否断开连接
-            if request.environ.get("wsgi.input") and getattr(
-                request.environ.get("wsgi.input"), "closed", False
-            ):
+            if client_disconnected(request.environ):
                 break
-
-    yield json.dumps({"fetched": processed_comments, "stored": total_replies})
+    finally:
+        replies.close()
+
+    yield json.dumps(
+        {
+            "fetched": progress["processed"],
+            "stored": progress["stored"],
+            "updated": progress["updated"],
+        }
+    )
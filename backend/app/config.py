@@ -2,3 +2,101 @@ class Config:
     SQLALCHEMY_DATABASE_URI = "postgresql://postgres@postgres/database"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     DOUYIN_API_BASE_URI = "http://douyin_api:80/api/douyin/web"
+    # 情绪分析模型版本，与文本哈希一起决定已存储的情绪分析结果是否过期
+    MODEL_REVISION = "v1.0.0"
+    # 评论表的哈希分区数量，仅在首次建表时生效
+    COMMENTS_PARTITIONS = 16
+    # 单批评论达到该行数时改用 COPY 导入临时表的写入路径
+    INGEST_COPY_THRESHOLD = 500
+    # 抓取引擎：同时在途的上游请求数、每秒请求数预算、单次请求超时（秒）
+    CRAWL_CONCURRENCY = 8
+    CRAWL_RATE_LIMIT = 5
+    CRAWL_TIMEOUT = 10
+    # 抓取一级评论时最多领先写库的预取页数
+    CRAWL_PREFETCH_PAGES = 8
+    # 增量同步：连续遇到该数量的已存储且不晚于高水位的一级评论后停止翻页
+    SYNC_STOP_AFTER_KNOWN = 100
+    # 推理调度器：每个微批次的最大文本数、凑批的最长等待时间（毫秒）
+    INFER_MAX_BATCH_SIZE = 64
+    INFER_MAX_WAIT_MS = 10
+    # 按长度分桶后每个子批次的 token 预算（条数 × 最长文本长度）
+    INFER_TOKEN_BUDGET = 4096
+    # 推理前评论文本截断的最大字符数
+    INFER_MAX_TEXT_LENGTH = 256
+    # 推理后端：pytorch（ModelScope pipeline）、onnx 或 onnx-int8（动态量化），启动时选定
+    INFER_BACKEND = "pytorch"
+    # 模型文件目录，以及 export_onnx.py 导出的 ONNX 模型目录
+    MODEL_DIR = "/app/bert"
+    ONNX_MODEL_DIR = "/app/bert/onnx"
+    # ONNX 后端分词后的最大 token 数
+    INFER_MAX_SEQ_LENGTH = 128
+    # 推理使用的 CPU 线程数，0 表示使用框架默认值
+    INFER_THREADS = 0
+    # 批量回填使用的多进程推理池：工作进程数 × 每个进程的推理线程数，一般取物理核数
+    INFER_POOL_WORKERS = 4
+    INFER_POOL_THREADS = 4
+    # 回填时每个工作进程一次处理的评论数（按 seq 连续切分）
+    INFER_POOL_CHUNK_SIZE = 512
+    # 推理池各进程内存映射共享的 PyTorch 权重文件，不存在或与当前模型不一致时自动重新导出
+    INFER_POOL_WEIGHTS_PATH = "/app/bert/pool_weights.pt"
+    # 后台分析视频任务每次读取、推理并写回的评论数，每完成一段推进一次分析进度
+    ANALYZE_CHUNK_SIZE = 256
+    # 情绪统计按自然小时/日分桶时使用的时区，以及缓存的统计结果数量上限
+    STATS_TIMEZONE = "Asia/Shanghai"
+    STATS_CACHE_SIZE = 256
+    # 跨视频推理缓存：内存 LRU 的条目上限，以及参与缓存的规范化文本最大长度（重复评论基本都是短文本）
+    INFER_CACHE_SIZE = 50000
+    INFER_CACHE_MAX_TEXT_LENGTH = 64
+    # 生产环境 gunicorn 的工作进程数、每个进程的请求线程数，以及工作进程无响应的超时与平滑重启等待时间（秒）
+    # 流式接口在请求线程中运行，不影响工作进程的心跳，长时间的 NDJSON 响应不会被超时中断
+    SERVER_WORKERS = 2
+    SERVER_THREADS = 16
+    SERVER_TIMEOUT = 120
+    SERVER_GRACEFUL_TIMEOUT = 60
+    # /metrics 多进程汇总：各进程写入指标快照的目录（None 表示只输出本进程的指标，gunicorn 配置会自动设置）
+    # 以及后台写入快照的间隔（秒），间隔内其他工作进程的新增计数在下一次写入后才可见
+    METRICS_DIR = None
+    METRICS_FLUSH_INTERVAL = 5
+    # 后台任务队列：每个服务进程内启动的工作线程数（0 表示只由 worker.py 执行任务）
+    JOB_WORKERS = 4
+    # 各类任务在所有工作进程中同时运行的数量上限
+    JOB_CONCURRENCY = {
+        "fetch_comments": 2,
+        "sync_comments": 2,
+        "fetch_comments_replies": 1,
+        "analyze_video": 1,
+    }
+    # 任务租约时长与心跳间隔（秒），租约过期的任务会被其他工作线程重新认领
+    JOB_LEASE_SECONDS = 60
+    JOB_HEARTBEAT_INTERVAL = 2
+    # 没有可认领任务时的轮询间隔（秒）
+    JOB_POLL_INTERVAL = 1
+    # 任务最多执行次数，失败后按 JOB_RETRY_BACKOFF 秒起指数退避重试
+    JOB_MAX_ATTEMPTS = 3
+    JOB_RETRY_BACKOFF = 10
+    # 关注列表自动同步：调度周期（秒），以及两次同步之间的最短、最长间隔（秒）
+    WATCH_TICK_SECONDS = 30
+    WATCH_MIN_INTERVAL = 300
+    WATCH_MAX_INTERVAL = 86400
+    # 每次同步期望抓到的新评论数，同步间隔 = 该值 / 估计的新评论速度
+    WATCH_TARGET_NEW_COMMENTS = 100
+    # 新评论速度（条/小时）指数滑动平均的平滑系数，越大越看重最近一次同步
+    WATCH_VELOCITY_ALPHA = 0.5
+    # 自动同步每小时最多使用的上游请求（页）数，以及上游每页的评论数
+    WATCH_REQUEST_BUDGET = 600
+    WATCH_PAGE_SIZE = 20
+    # 流式响应：合并输出的分块大小（字节）与最长间隔（毫秒），以及 gzip / zstd 压缩级别
+    STREAM_CHUNK_BYTES = 32768
+    STREAM_FLUSH_MS = 200
+    STREAM_GZIP_LEVEL = 6
+    STREAM_ZSTD_LEVEL = 3
+    # 流式接口每处理该数量的批次写入一次视频的分析进度，流结束或中断时写入剩余进度
+    STREAM_CHECKPOINT_BATCHES = 10
+    # 流式接口等待推理期间检查客户端是否断开连接的间隔（毫秒）
+    STREAM_DISCONNECT_CHECK_MS = 100
+    # 视频信息缓存：新鲜期（秒），过期后在该时长内仍先返回旧数据并在后台刷新，以及内存缓存条目上限
+    VIDEO_INFO_TTL = 600
+    VIDEO_INFO_STALE_TTL = 86400
+    VIDEO_INFO_CACHE_SIZE = 1024
+    # /video_info_batch 单次请求的视频数量上限
+    VIDEO_INFO_BATCH_MAX = 50
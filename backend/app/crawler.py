@@ -0,0 +1,345 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+
+import aiohttp
+
+from . import metrics
+from .config import Config
+
+
+class UpstreamError(Exception):
+    """
+    请求抖音接口失败的基类。
+    """
+
+
+class UpstreamRequestError(UpstreamError):
+    """
+    网络错误、超时或 HTTP 状态码异常，details 为错误描述。
+    """
+
+    def __init__(self, details):
+        super().__init__(details)
+        self.details = details
+
+
+class UpstreamResponseError(UpstreamError):
+    """
+    接口返回的 code 或 status_code 表示失败，data 为原始响应内容。
+    """
+
+    def __init__(self, data):
+        super().__init__("外部接口返回错误")
+        self.data = data
+
+
+@dataclass
+class ReplyPage:
+    """
+    并发抓取二级评论时产出的一页结果，cursor 为请求下一页所用的游标。
+    done 表示该一级评论的回复已抓取完毕（包括出错提前结束的情况）。
+    """
+
+    parent_cid: str
+    comments: list = field(default_factory=list)
+    cursor: int = 0
+    done: bool = False
+    error: Exception = None
+
+
+@dataclass
+class CommentPage:
+    """
+    后台预取的一页一级评论，cursor 为请求下一页所用的游标。
+    """
+
+    comments: list
+    cursor: int
+    has_more: int
+
+
+class RateLimiter:
+    """
+    令牌桶限速器：平均每秒最多 rate 个请求，允许最多 burst 个请求的突发。
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CrawlEngine:
+    """
+    基于 asyncio 的抓取引擎。
+    事件循环运行在独立的后台线程中，所有上游请求共用一个保持长连接的 aiohttp 连接池，
+    并受统一的并发数（Config.CRAWL_CONCURRENCY）和速率预算（Config.CRAWL_RATE_LIMIT）约束。
+    同步代码通过 run() 提交协程并等待结果。
+    """
+
+    def __init__(self):
+        self.loop = None
+        self._start_lock = threading.Lock()
+
+    def run(self, coro):
+        """
+        在引擎的事件循环中执行协程，阻塞等待并返回其结果。
+        """
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def submit(self, coro):
+        """
+        在引擎的事件循环中执行协程，不等待结果，返回 concurrent.futures.Future。
+        """
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self.loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="crawl-engine", daemon=True
+            ).start()
+            asyncio.run_coroutine_threadsafe(self._open(), loop).result()
+            self.loop = loop
+
+    async def _open(self):
+        self.semaphore = asyncio.Semaphore(Config.CRAWL_CONCURRENCY)
+        self.limiter = RateLimiter(Config.CRAWL_RATE_LIMIT, Config.CRAWL_CONCURRENCY)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=Config.CRAWL_CONCURRENCY, keepalive_timeout=60
+            ),
+            timeout=aiohttp.ClientTimeout(total=Config.CRAWL_TIMEOUT),
+        )
+
+    async def get_json(self, endpoint, params, check_status=True):
+        """
+        请求抖音接口并校验返回码，成功时返回响应中的 data 字段。
+        check_status 为 False 时只校验外层的 code，不要求 data 中带有 status_code。
+        """
+        url = f"{Config.DOUYIN_API_BASE_URI}/{endpoint}"
+        params = {key: str(value) for key, value in params.items()}
+        await self.limiter.acquire()
+        async with self.semaphore:
+            started = time.perf_counter()
+            status = "error"
+            try:
+                async with self.session.get(url, params=params) as response:
+                    status = response.status
+                    response.raise_for_status()
+                    resp_json = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not isinstance(e, aiohttp.ClientResponseError):
+                    status = type(e).__name__
+                metrics.upstream_requests.inc(endpoint=endpoint, status=status)
+                raise UpstreamRequestError(str(e) or type(e).__name__) from e
+            finally:
+                metrics.upstream_latency.observe(
+                    time.perf_counter() - started, endpoint=endpoint
+                )
+
+        if resp_json.get("code") != 200 or (
+            check_status and resp_json.get("data", {}).get("status_code") != 0
+        ):
+            metrics.upstream_requests.inc(endpoint=endpoint, status="api_error")
+            raise UpstreamResponseError(resp_json)
+        metrics.upstream_requests.inc(endpoint=endpoint, status=status)
+        return resp_json.get("data", {})
+
+    async def comments_page(self, video_id, cursor):
+        data = await self.get_json(
+            "fetch_video_comments", {"aweme_id": video_id, "cursor": cursor}
+        )
+        metrics.upstream_page_size.observe(
+            len(data.get("comments") or []), endpoint="fetch_video_comments"
+        )
+        return data.get("comments") or [], data.get("cursor"), data.get("has_more", 0)
+
+    async def replies_page(self, video_id, comment_cid, cursor):
+        data = await self.get_json(
+            "fetch_video_comment_replies",
+            {"item_id": video_id, "comment_id": comment_cid, "cursor": cursor},
+        )
+        metrics.upstream_page_size.observe(
+            len(data.get("comments") or []), endpoint="fetch_video_comment_replies"
+        )
+        return data.get("comments") or [], data.get("cursor"), data.get("has_more", 0)
+
+    async def video_detail(self, video_id):
+        data = await self.get_json(
+            "fetch_one_video", {"aweme_id": video_id}, check_status=False
+        )
+        return data.get("aweme_detail") or {}
+
+    async def video_details(self, video_ids):
+        """
+        并发获取多个视频的详情，返回与 video_ids 对应的列表，失败的位置为异常对象。
+        """
+        return await asyncio.gather(
+            *(self.video_detail(video_id) for video_id in video_ids),
+            return_exceptions=True,
+        )
+
+    async def page_comments(self, video_id, cursor, out):
+        """
+        按游标顺序抓取一级评论，每页放入 out 队列；队列满时暂停抓取。
+        出错时放入异常对象，正常结束时放入 None。
+        """
+        try:
+            while True:
+                comments, new_cursor, has_more = await self.comments_page(
+                    video_id, cursor
+                )
+                await out.put(CommentPage(comments, new_cursor, has_more))
+                if not comments or has_more != 1:
+                    break
+                cursor = new_cursor
+        except Exception as e:
+            await out.put(e)
+            return
+        await out.put(None)
+
+    async def crawl_replies(self, video_id, cursors, out):
+        """
+        并发抓取多条一级评论的回复，cursors 为 {一级评论 cid: 起始游标}，
+        每页结果放入 out 队列，全部完成后放入 None。
+        同一条一级评论的回复按游标顺序翻页，不同一级评论之间并发进行。
+        """
+        pending = iter(cursors.items())
+
+        async def worker():
+            for parent_cid, cursor in pending:
+                await self._crawl_thread(video_id, parent_cid, cursor, out)
+
+        workers = min(Config.CRAWL_CONCURRENCY, len(cursors))
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        await out.put(None)
+
+    async def _crawl_thread(self, video_id, parent_cid, cursor, out):
+        while True:
+            try:
+                replies, new_cursor, has_more = await self.replies_page(
+                    video_id, parent_cid, cursor
+                )
+            except Exception as e:
+                await out.put(ReplyPage(parent_cid, done=True, error=e))
+                return
+
+            done = not replies or has_more != 1
+            await out.put(ReplyPage(parent_cid, replies, new_cursor, done=done))
+            if done:
+                return
+            cursor = new_cursor
+
+
+_engine = CrawlEngine()
+
+
+def fetch_video_comments(video_id, cursor=0):
+    """
+    获取视频一级评论的一页，返回 (评论列表, 下一页游标, has_more)。
+    失败时抛出 UpstreamRequestError 或 UpstreamResponseError。
+    """
+    return _engine.run(_engine.comments_page(video_id, cursor))
+
+
+def fetch_video_comment_replies(video_id, comment_cid, cursor=0):
+    """
+    获取某条一级评论的二级评论的一页，返回 (评论列表, 下一页游标, has_more)。
+    失败时抛出 UpstreamRequestError 或 UpstreamResponseError。
+    """
+    return _engine.run(_engine.replies_page(video_id, comment_cid, cursor))
+
+
+def fetch_video_details(video_ids):
+    """
+    通过抓取引擎并发获取多个视频的详情（接口返回的 aweme_detail），
+    返回与 video_ids 对应的列表，失败的位置为 UpstreamRequestError 或 UpstreamResponseError。
+    """
+    return _engine.run(_engine.video_details(list(video_ids)))
+
+
+def iter_comment_batches(video_id, cursor=0):
+    """
+    生成器：后台按游标预取一级评论（最多领先 Config.CRAWL_PREFETCH_PAGES 页），
+    每次产出当前已到达的若干页组成的列表 [CommentPage, ...]，便于调用方合并写入。
+    调用方写库期间抓取不会停顿，抓取等待期间调用方也可以继续写入。
+    上游出错时先产出出错前已到达的页，再抛出对应的 UpstreamError；关闭生成器会停止预取。
+    """
+    out = _engine.run(_make_queue(Config.CRAWL_PREFETCH_PAGES))
+    future = _engine.submit(_engine.page_comments(video_id, cursor, out))
+    try:
+        finished = False
+        while not finished:
+            batch = []
+            for item in _engine.run(_drain(out)):
+                if isinstance(item, CommentPage):
+                    batch.append(item)
+                    continue
+                finished = True
+                if batch:
+                    yield batch
+                    batch = []
+                if item is not None:
+                    raise item
+            if batch:
+                yield batch
+    finally:
+        future.cancel()
+
+
+def iter_reply_pages(video_id, parent_cids, cursors=None):
+    """
+    生成器：并发抓取多条一级评论的回复，按到达顺序逐页产出 ReplyPage。
+    cursors 为 {一级评论 cid: 起始游标}，用于从断点继续，未给出的从头抓取。
+    在途请求数与请求速率受引擎统一预算约束；关闭生成器会取消尚未完成的抓取。
+    """
+    cursors = cursors or {}
+    cursors = {parent_cid: cursors.get(parent_cid, 0) for parent_cid in parent_cids}
+    if not cursors:
+        return
+
+    out = _engine.run(_make_queue(Config.CRAWL_CONCURRENCY * 2))
+    future = _engine.submit(_engine.crawl_replies(video_id, cursors, out))
+    try:
+        while True:
+            page = _engine.run(out.get())
+            if page is None:
+                break
+            yield page
+    finally:
+        future.cancel()
+
+
+async def _drain(queue):
+    # 至少等待一项，再取走队列中已到达的其余各项
+    items = [await queue.get()]
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+async def _make_queue(maxsize):
+    # asyncio.Queue 需要在引擎的事件循环中创建
+    return asyncio.Queue(maxsize=maxsize)
@@ -1,25 +1,201 @@
-from sqlalchemy import inspect
+import json
+from sqlalchemy import bindparam, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
 from .sql import db
-from .models import create_model
+from .models import Comment, CrawlCheckpoint, Video
+
+# 将各情绪的增量合并进 videos.emotion_counts，计数归零的情绪会被移除
+_MERGE_EMOTION_COUNTS = text(
+    """
+    UPDATE videos SET emotion_counts = (
+        SELECT COALESCE(jsonb_object_agg(key, total), '{}'::jsonb)
+        FROM (
+            SELECT key, SUM(value) AS total
+            FROM (
+                SELECT key, value::int AS value FROM jsonb_each_text(videos.emotion_counts)
+                UNION ALL
+                SELECT key, value::int FROM jsonb_each_text(CAST(:delta AS jsonb))
+            ) AS parts
+            GROUP BY key
+            HAVING SUM(value) > 0
+        ) AS merged
+    )
+    WHERE video_id = :video_id
+    """
+)
+
+# 根据评论表和结果表重新统计单个视频的摘要
+_REFRESH_SUMMARY = text(
+    """
+    UPDATE videos SET
+        comment_count = stats.comment_count,
+        reply_count = stats.reply_count,
+        emotion_counts = COALESCE(emotions.counts, '{}'::jsonb)
+    FROM (
+        SELECT COUNT(*) AS comment_count, COUNT(parent_cid) AS reply_count
+        FROM comments WHERE video_id = :video_id
+    ) AS stats,
+    (
+        SELECT jsonb_object_agg(label, total) AS counts
+        FROM (
+            SELECT r.label, COUNT(*) AS total
+            FROM comments c JOIN sentiment_results r ON r.cid = c.cid
+            WHERE c.video_id = :video_id AND r.model_revision = :model_revision
+            GROUP BY r.label
+        ) AS per_label
+    ) AS emotions
+    WHERE videos.video_id = :video_id
+    """
+)
+
+
+def ensure_video(video_id):
+    """
+    在视频登记表中登记 video_id（已存在则忽略），抓取评论前调用。
+    """
+    stmt = (
+        insert(Video)
+        .values(video_id=str(video_id))
+        .on_conflict_do_nothing(index_elements=[Video.video_id])
+    )
+    db.session.execute(stmt)
+    db.session.commit()
+
+
+def video_exists(video_id):
+    """
+    判断视频是否已登记（即是否抓取过评论），通过主键查询完成。
+    """
+    return db.session.get(Video, str(video_id)) is not None
+
+
+def get_crawl_checkpoint(video_id, parent_cid=""):
+    """
+    读取视频一级评论（parent_cid 为空字符串）或某条一级评论回复的抓取断点，不存在时返回 None。
+    """
+    return db.session.get(CrawlCheckpoint, (str(video_id), parent_cid))
+
+
+def save_crawl_checkpoint(video_id, cursor, has_more, parent_cid="", reply_total=None):
+    """
+    在当前会话的事务内写入抓取断点，由调用方与本页评论的写入一同提交，
+    保证断点之前的评论都已落库。reply_total 仅在回复抓取完毕时记录；
+    一级评论抓取完毕时同时把高水位推进到已存储一级评论的最晚发布时间。
+    """
+    high_water_mark = None
+    if not parent_cid and not has_more:
+        high_water_mark = (
+            select(func.max(Comment.create_time))
+            .where(Comment.video_id == str(video_id), Comment.parent_cid.is_(None))
+            .scalar_subquery()
+        )
+    stmt = insert(CrawlCheckpoint).values(
+        video_id=str(video_id),
+        parent_cid=parent_cid,
+        cursor=cursor or 0,
+        has_more=bool(has_more),
+        reply_total=reply_total,
+        high_water_mark=high_water_mark,
+    )
+    db.session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[CrawlCheckpoint.video_id, CrawlCheckpoint.parent_cid],
+            set_={
+                "cursor": stmt.excluded.cursor,
+                "has_more": stmt.excluded.has_more,
+                "reply_total": stmt.excluded.reply_total,
+                "high_water_mark": func.coalesce(
+                    stmt.excluded.high_water_mark, CrawlCheckpoint.high_water_mark
+                ),
+                "updated_at": func.now(),
+            },
+        )
+    )
+
+
+def record_emotion_counts(conn, video_id, delta):
+    """
+    在写入情绪分析结果的同一事务内，将各情绪的计数增量 {标签: 增量} 合并进视频摘要。
+    """
+    if not delta:
+        return
+    conn.execute(
+        _MERGE_EMOTION_COUNTS,
+        {"video_id": str(video_id), "delta": json.dumps(dict(delta))},
+    )
+
+
+def advance_analyzed_seq(video_id, start_seq, last_seq):
+    """
+    从 start_seq 开始连续分析到 last_seq 后推进视频的 last_analyzed_seq。
+    仅当 start_seq 之前的评论都已分析过时才推进，保证检查点之前没有遗漏。
+    使用独立连接提交，不影响调用方会话中正在进行的流式查询。
+    """
+    stmt = (
+        update(Video)
+        .where(
+            Video.video_id == str(video_id),
+            Video.last_analyzed_seq >= start_seq - 1,
+            Video.last_analyzed_seq < last_seq,
+        )
+        .values(last_analyzed_seq=last_seq)
+    )
+    with db.engine.begin() as conn:
+        conn.execute(stmt)
+
+
+def refresh_video_summary(conn, video_id, model_revision):
+    """
+    根据已存储的评论和情绪分析结果重新统计视频摘要，用于数据迁移或修复计数。
+    情绪分布只统计 model_revision 版本模型给出的结果。
+    """
+    conn.execute(
+        _REFRESH_SUMMARY,
+        {"video_id": str(video_id), "model_revision": model_revision},
+    )
+
+
+def record_published_at(published):
+    """
+    记录已登记视频的发布时间 {video_id: 发布时间}，未登记的视频忽略。
+    只在调用方会话中执行，随调用方的事务一同提交。
+    """
+    if not published:
+        return
+    table = Video.__table__
+    db.session.execute(
+        update(table)
+        .where(
+            table.c.video_id == bindparam("b_video_id"),
+            table.c.published_at.is_distinct_from(bindparam("b_published_at")),
+        )
+        .values(published_at=bindparam("b_published_at")),
+        [
+            {"b_video_id": str(video_id), "b_published_at": published_at}
+            for video_id, published_at in published.items()
+        ],
+    )
 
 
 def get_all_video():
     """
-    查询数据库中所有以"video_"开头的表名，提取出视频id及对应的评论数量，并返回给前端。
+    读取视频摘要表，返回所有已登记视频的评论数量、同步时间与情绪分析进度。
     """
     try:
-        inspector = inspect(db.engine)
-        table_names = inspector.get_table_names()
-        video_data = []
-        for table in table_names:
-            if table.startswith("video_"):
-                # 提取视频id部分
-                video_id = table[len("video_") :]
-                # 通过动态模型获取评论表
-                CommentModel = create_model(video_id)
-                # 统计表中评论数量
-                count = db.session.query(CommentModel).count()
-                video_data.append({"video_id": video_id, "comment_count": count})
+        videos = db.session.execute(select(Video).order_by(Video.created_at)).scalars()
+        video_data = [
+            {
+                "video_id": video.video_id,
+                "comment_count": video.comment_count,
+                "reply_count": video.reply_count,
+                "last_synced_at": video.last_synced_at.isoformat()
+                if video.last_synced_at
+                else "",
+                "last_analyzed_seq": video.last_analyzed_seq,
+                "emotion_counts": video.emotion_counts,
+            }
+            for video in videos
+        ]
         return {"video_data": video_data}, 200
     except Exception as e:
         return {"error": str(e)}, 500
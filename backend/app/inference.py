@@ -0,0 +1,251 @@
+import threading
+import time
+from collections import deque
+
+from . import metrics
+
+
+class InferenceCancelled(Exception):
+    """
+    调用方在推理完成前取消了请求（如流式接口的客户端已断开连接）。
+    """
+
+
+class _InferenceRequest:
+    """
+    一次 submit 调用对应的请求：保存待推理文本，并在全部结果就绪后通知调用方。
+    """
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.results = [None] * len(texts)
+        self.remaining = len(texts)
+        self.error = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+
+def plan_batches(lengths, token_budget, max_batch_size):
+    """
+    按长度分桶规划推理批次，返回下标列表的列表。
+    长度按 2 的幂分档，同一档内的文本按长度排序后依次装批，
+    每批的填充后 token 数（条数 × 最长文本长度）不超过 token_budget，条数不超过 max_batch_size。
+    这样短评论不会被同批的长评论拉长到相同长度，减少 padding 带来的无效计算。
+    """
+    buckets = {}
+    for index, length in enumerate(lengths):
+        buckets.setdefault(max(length - 1, 0).bit_length(), []).append(index)
+
+    batches = []
+    for _, indexes in sorted(buckets.items()):
+        indexes.sort(key=lambda index: lengths[index])
+        current = []
+        for index in indexes:
+            padded = (len(current) + 1) * lengths[index]
+            if current and (padded > token_budget or len(current) >= max_batch_size):
+                batches.append(current)
+                current = []
+            current.append(index)
+        if current:
+            batches.append(current)
+    return batches
+
+
+class InferenceScheduler:
+    """
+    动态微批推理调度器。
+    所有调用方把待推理文本放入同一个请求队列，后台线程将来自不同调用方的文本合并为微批次
+    （每批不超过 max_batch_size 条，凑批最多等待 max_wait 秒），
+    再按 token 长度分桶拆分为填充开销受 token_budget 约束的子批次调用模型，
+    最后把每条结果按原顺序分发回对应的调用方。单个请求的文本较多时会被拆分到多个批次中，
+    凑批时轮流从各个未完成的请求中取文本，大请求不会独占后续批次，单条文本的请求总能进入下一批。
+    run_batch 接收文本列表，返回与之等长的模型输出列表；length_of 估算单条文本的 token 数。
+    提交时可传入 cancelled 回调，等待期间每 cancel_poll 秒检查一次，请求取消后尚未推理的文本不再送入模型。
+    """
+
+    def __init__(
+        self,
+        run_batch,
+        max_batch_size,
+        max_wait,
+        token_budget,
+        length_of,
+        cancel_poll=0.1,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.token_budget = token_budget
+        self.length_of = length_of
+        self.cancel_poll = cancel_poll
+        self._queue = deque()
+        # 已开始推理但文本尚未全部送入模型的请求，元素为 [请求, 下一条文本的下标]
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        # cancelled_texts：取消时尚未推理、直接丢弃的文本数；
+        # wasted_texts：已送入模型但调用方已取消、结果被丢弃的文本数
+        self._stats = {"cancelled_requests": 0, "cancelled_texts": 0, "wasted_texts": 0}
+
+    def submit(self, texts, cancelled=None):
+        """
+        提交一组文本并阻塞等待推理完成，按输入顺序返回模型输出列表。
+        模型调用出错时抛出同样的异常；cancelled() 返回 True 时取消请求并抛出 InferenceCancelled。
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+
+        request = _InferenceRequest(texts)
+        with self._cond:
+            self._ensure_started()
+            self._queue.append(request)
+            self._cond.notify()
+        if cancelled is None:
+            request.done.wait()
+        else:
+            while not request.done.wait(self.cancel_poll):
+                if cancelled():
+                    self._cancel(request)
+                    raise InferenceCancelled()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _cancel(self, request):
+        with self._cond:
+            request.cancelled = True
+            self._stats["cancelled_requests"] += 1
+            if request in self._queue:
+                self._queue.remove(request)
+                self._stats["cancelled_texts"] += len(request.texts)
+                return
+            for cursor in self._pending:
+                if cursor[0] is request:
+                    self._pending.remove(cursor)
+                    self._stats["cancelled_texts"] += len(request.texts) - cursor[1]
+                    break
+
+    def stats(self):
+        """
+        返回调度器统计：排队请求数、取消的请求数、取消时丢弃的文本数和推理结果被丢弃的文本数。
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._queue) + len(self._pending)
+        return stats
+
+    def _skip_cancelled(self, items):
+        # 去掉已取消请求的文本，计入 cancelled_texts
+        kept = [item for item in items if not item[0].cancelled]
+        if len(kept) < len(items):
+            with self._cond:
+                self._stats["cancelled_texts"] += len(items) - len(kept)
+        return kept
+
+    def queue_depth(self):
+        """
+        返回文本尚未全部送入模型的请求数量（包括排队中和已部分推理的请求）。
+        """
+        with self._cond:
+            return len(self._queue) + len(self._pending)
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="inference-scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch = self._collect()
+                lengths = [
+                    self.length_of(request.texts[index]) for request, index in batch
+                ]
+                for group in plan_batches(
+                    lengths, self.token_budget, self.max_batch_size
+                ):
+                    self._run_group([batch[position] for position in group])
+            except Exception as e:
+                # 调度出错时让本批和未完成请求的调用方收到异常，而不是永远等待；调度线程继续运行
+                metrics.inference_batch_errors.inc()
+                self._fail(batch, e)
+
+    def _fail(self, batch, error):
+        with self._cond:
+            requests = [request for request, _ in batch]
+            requests.extend(request for request, _ in self._pending)
+            self._pending.clear()
+        for request in requests:
+            if request.error is None and not request.done.is_set():
+                request.error = error
+                request.done.set()
+
+    def _run_group(self, items):
+        items = self._skip_cancelled(items)
+        if not items:
+            return
+        texts = [request.texts[index] for request, index in items]
+        metrics.inference_batch_size.observe(len(texts))
+        started = time.perf_counter()
+        try:
+            outputs = self.run_batch(texts)
+        except Exception as e:
+            metrics.inference_batch_errors.inc()
+            for request, _ in items:
+                if request.error is None:
+                    request.error = e
+                    request.done.set()
+            return
+        finally:
+            metrics.inference_batch_latency.observe(time.perf_counter() - started)
+
+        wasted = sum(1 for request, _ in items if request.cancelled)
+        if wasted:
+            with self._cond:
+                self._stats["wasted_texts"] += wasted
+        for (request, index), output in zip(items, outputs):
+            request.results[index] = output
+            request.remaining -= 1
+            if request.remaining == 0 and request.error is None:
+                request.done.set()
+
+    def _collect(self):
+        """
+        凑出一个微批次：至少等到一条文本，之后在 max_wait 截止时间前尽量凑满 max_batch_size。
+        新请求先加入未完成请求的轮转，每轮从每个请求中各取一条文本。
+        """
+        batch = []
+        deadline = None
+        with self._cond:
+            while True:
+                self._pending.extend([request, 0] for request in self._queue)
+                self._queue.clear()
+                self._fill(batch)
+
+                if len(batch) >= self.max_batch_size:
+                    return batch
+                if batch:
+                    if deadline is None:
+                        deadline = time.monotonic() + self.max_wait
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        return batch
+                    self._cond.wait(timeout)
+                else:
+                    self._cond.wait()
+
+    def _fill(self, batch):
+        # 轮流从每个未完成的请求中取一条文本，直到批次装满或没有剩余文本
+        while self._pending and len(batch) < self.max_batch_size:
+            cursor = self._pending.popleft()
+            request, index = cursor
+            if request.cancelled:
+                continue
+            batch.append((request, index))
+            cursor[1] += 1
+            if cursor[1] < len(request.texts):
+                self._pending.append(cursor)
@@ -0,0 +1,218 @@
+import re
+import threading
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from .config import Config
+from .models import InferenceCacheEntry
+from .sentiment_store import pack_scores, text_hash, unpack_scores
+from .sql import db
+
+_WHITESPACE = re.compile(r"\s+")
+
+# 后台线程每次写入 inference_cache 表的最多行数
+WRITE_BATCH_SIZE = 1000
+
+
+def normalize_text(text):
+    """
+    缓存键使用的保守规范化：去掉首尾空白并将连续空白合并为一个空格。
+    BERT 分词会按空白切分并丢弃空白本身，规范化前后的文本分词结果相同，推理结果也相同。
+    """
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class InferenceCache:
+    """
+    位于模型之前的推理结果缓存。
+    同一批次内规范化后相同的文本只推理一次；不超过 Config.INFER_CACHE_MAX_TEXT_LENGTH 的短文本
+    先查内存 LRU（最多 Config.INFER_CACHE_SIZE 条），再查持久化的 inference_cache 表，
+    都未命中时才交给模型，新结果写回两级缓存，供其他视频复用。
+    缓存按模型版本区分，命中率等统计可通过 stats() 查看。
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # 等待后台线程写入 inference_cache 表的新结果
+        self._pending_writes = []
+        self._write_cond = threading.Condition()
+        self._writer = None
+        self._writing = False
+        self._stats = {
+            "requests": 0,
+            "memory_hits": 0,
+            "table_hits": 0,
+            "batch_duplicates": 0,
+            "inferred": 0,
+        }
+
+    def lookup(self, texts, model_revision):
+        """
+        查询一批（已截断的）文本的缓存结果。
+        返回 (结果列表, 需推理的文本列表)：结果列表与 texts 等长，未命中的位置为 None；
+        需推理的文本已按规范化结果去重，推理后连同结果交给 fill() 补全。
+        """
+        keys = [normalize_text(text) for text in texts]
+        results = [None] * len(texts)
+
+        cacheable = {
+            key
+            for key in keys
+            if key and len(key) <= Config.INFER_CACHE_MAX_TEXT_LENGTH
+        }
+        # found: 规范化文本 -> (结果, 来源)
+        found = {}
+        with self._lock:
+            for key in cacheable:
+                entry = self._entries.get((model_revision, key))
+                if entry is not None:
+                    self._entries.move_to_end((model_revision, key))
+                    found[key] = (entry, "memory_hits")
+
+        table_keys = {text_hash(key): key for key in cacheable - found.keys()}
+        if table_keys:
+            rows = db.session.execute(
+                select(
+                    InferenceCacheEntry.text_hash,
+                    InferenceCacheEntry.label,
+                    InferenceCacheEntry.scores,
+                ).where(
+                    InferenceCacheEntry.text_hash.in_(list(table_keys)),
+                    InferenceCacheEntry.model_revision == model_revision,
+                )
+            ).all()
+            for row in rows:
+                key = table_keys[row.text_hash]
+                entry = (row.label, unpack_scores(row.scores))
+                found[key] = (entry, "table_hits")
+                self._remember(model_revision, key, entry)
+
+        counts = dict.fromkeys(self._stats, 0)
+        counts["requests"] = len(texts)
+        missing = {}
+        for index, key in enumerate(keys):
+            if key in found:
+                results[index], source = found[key]
+                counts[source] += 1
+            elif key in missing:
+                counts["batch_duplicates"] += 1
+            else:
+                missing[key] = texts[index]
+                counts["inferred"] += 1
+
+        with self._lock:
+            for name, value in counts.items():
+                self._stats[name] += value
+        return results, list(missing.values())
+
+    def fill(self, texts, results, inferred_texts, inferred, model_revision):
+        """
+        用推理结果补全 lookup() 返回的结果列表，并把可缓存的新结果写入两级缓存。
+        inferred 为模型对 inferred_texts 逐条给出的 (标签, {标签: 置信度})。
+        """
+        by_key = {
+            normalize_text(text): result
+            for text, result in zip(inferred_texts, inferred)
+        }
+        for index, text in enumerate(texts):
+            if results[index] is None:
+                results[index] = by_key[normalize_text(text)]
+
+        values = []
+        for key, (label, confidences) in by_key.items():
+            if label is None or not key:
+                continue
+            if len(key) > Config.INFER_CACHE_MAX_TEXT_LENGTH:
+                continue
+            self._remember(model_revision, key, (label, confidences))
+            values.append(
+                {
+                    "text_hash": text_hash(key),
+                    "model_revision": model_revision,
+                    "label": label,
+                    "scores": pack_scores(confidences),
+                }
+            )
+        if values:
+            self._write_behind(values)
+        return results
+
+    def analyze(self, texts, infer, model_revision):
+        """
+        经缓存推理一批文本：infer 接收去重后的未命中文本列表，返回对应的 (标签, {标签: 置信度}) 列表。
+        """
+        results, missing = self.lookup(texts, model_revision)
+        inferred = infer(missing) if missing else []
+        return self.fill(texts, results, missing, inferred, model_revision)
+
+    def stats(self):
+        """
+        返回缓存统计：请求文本数、内存/数据表命中数、批内重复数、实际推理数、命中率和内存条目数。
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._entries)
+        saved = stats["requests"] - stats["inferred"]
+        stats["hit_rate"] = saved / stats["requests"] if stats["requests"] else 0.0
+        return stats
+
+    def _write_behind(self, values):
+        # 数据表由后台线程写入：调用方此时往往仍持有会话的连接（流式查询或未结束的事务），
+        # 在当前线程再从连接池取一条连接，会在并发请求数接近连接池大小时相互等待直至超时
+        app = current_app._get_current_object()
+        with self._write_cond:
+            self._pending_writes.extend(values)
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(
+                    target=self._write_loop,
+                    args=(app,),
+                    name="inference-cache-writer",
+                    daemon=True,
+                )
+                self._writer.start()
+            self._write_cond.notify_all()
+
+    def flush(self):
+        """
+        等待后台线程把已产生的新结果全部写入 inference_cache 表，命令行工具退出前调用。
+        """
+        with self._write_cond:
+            while self._pending_writes or self._writing:
+                self._write_cond.wait()
+
+    def _write_loop(self, app):
+        with app.app_context():
+            while True:
+                with self._write_cond:
+                    while not self._pending_writes:
+                        self._write_cond.wait()
+                    values = self._pending_writes[:WRITE_BATCH_SIZE]
+                    del self._pending_writes[:WRITE_BATCH_SIZE]
+                    self._writing = True
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(
+                            insert(InferenceCacheEntry)
+                            .values(values)
+                            .on_conflict_do_nothing()
+                        )
+                except Exception as e:
+                    print(f"写入推理缓存失败：{e}")
+                finally:
+                    with self._write_cond:
+                        self._writing = False
+                        self._write_cond.notify_all()
+
+    def _remember(self, model_revision, key, entry):
+        with self._lock:
+            self._entries[(model_revision, key)] = entry
+            self._entries.move_to_end((model_revision, key))
+            while len(self._entries) > Config.INFER_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+
+# 服务进程内共享的推理缓存
+inference_cache = InferenceCache()
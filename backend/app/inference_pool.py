@@ -0,0 +1,100 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from .backends import model_fingerprint
+from .config import Config
+
+# 工作进程中加载的推理后端
+_backend = None
+
+# 传给工作进程的配置项：spawn 启动的进程会重新导入 Config，主进程运行时修改的取值需要显式传递
+WORKER_CONFIG = (
+    "INFER_BACKEND",
+    "MODEL_DIR",
+    "ONNX_MODEL_DIR",
+    "MODEL_REVISION",
+    "INFER_POOL_WEIGHTS_PATH",
+    "INFER_TOKEN_BUDGET",
+    "INFER_MAX_BATCH_SIZE",
+    "INFER_MAX_TEXT_LENGTH",
+    "INFER_MAX_SEQ_LENGTH",
+)
+
+
+def _init_worker(settings, threads, fingerprint, load_lock):
+    """
+    工作进程初始化：套用主进程的推理配置 settings，固定推理线程数后加载模型。
+    PyTorch 后端的参数替换为内存映射的共享权重文件，各进程共用同一份物理内存。
+    加载时每个进程会先构建一份私有的完整模型，替换为共享权重后才释放，
+    因此各进程通过 load_lock 依次加载，启动期间最多只有一份私有模型，内存峰值约为共享权重加一份模型。
+    """
+    global _backend
+    from .backends import load_backend
+
+    for name, value in settings.items():
+        setattr(Config, name, value)
+    Config.INFER_THREADS = threads
+    with load_lock:
+        _backend = load_backend(Config.INFER_BACKEND, Config.MODEL_DIR)
+        if Config.INFER_BACKEND == "pytorch":
+            _backend.map_weights(Config.INFER_POOL_WEIGHTS_PATH, fingerprint)
+
+
+def _infer(texts):
+    """
+    在工作进程中推理一段评论，按长度分桶组批，返回按输入顺序排列的 (标签, {标签: 置信度}) 列表。
+    """
+    from .inference import plan_batches
+    from .pipeline import parse_model_output, token_length, truncate_text
+
+    texts = [truncate_text(text) for text in texts]
+    results = [None] * len(texts)
+    lengths = [token_length(text) for text in texts]
+    for group in plan_batches(
+        lengths, Config.INFER_TOKEN_BUDGET, Config.INFER_MAX_BATCH_SIZE
+    ):
+        outputs = _backend([texts[index] for index in group])
+        for index, output in zip(group, outputs):
+            results[index] = parse_model_output(output)
+    return results
+
+
+class InferencePool:
+    """
+    多进程推理池，用于整段视频的批量回填。
+    共 workers 个以 spawn 方式启动的工作进程，每个进程固定使用 threads 个推理线程，
+    workers × threads 一般取机器的物理核数。各进程依次加载模型，首个进程在共享权重文件缺失或过期时重新导出。
+    调用方按 seq 区间切分评论后提交，
+    submit 返回 Future，按提交顺序取结果即可保证合并顺序。
+    """
+
+    def __init__(self, workers=None, threads=None):
+        self.workers = workers or Config.INFER_POOL_WORKERS
+        self.threads = threads or Config.INFER_POOL_THREADS
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(
+                {name: getattr(Config, name) for name in WORKER_CONFIG},
+                self.threads,
+                model_fingerprint(Config.MODEL_DIR),
+                context.Lock(),
+            ),
+        )
+
+    def submit(self, texts):
+        """
+        提交一段评论文本，返回 Future，结果为按输入顺序排列的 (标签, {标签: 置信度}) 列表。
+        """
+        return self.executor.submit(_infer, list(texts))
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
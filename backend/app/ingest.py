@@ -0,0 +1,251 @@
+import io
+import time
+from datetime import datetime, timezone
+from sqlalchemy import select, text
+
+from . import metrics
+from .config import Config
+from .database import save_crawl_checkpoint
+from .models import Comment
+from .sql import db
+
+# 单条语句完成一批评论的写入：
+#   1. 锁定视频行，同一视频的并发写入按提交顺序串行分配序号；
+#   2. 仅为新评论分配视频内连续的 seq（已存在的评论必然命中冲突分支，其 seq 不会被写入）；
+#   3. INSERT ... ON CONFLICT (video_id, cid) DO UPDATE 写入评论，并区分新增与更新
+#      （分区表无法返回 xmax，新分配的 seq 不可能与已有评论相同，返回的 seq 与分配值一致即为新增）；
+#      内容没有变化的已有评论不会被改写，也不计入更新数；
+#   4. 同步推进 next_seq 并更新视频摘要中的评论数与最近同步时间。
+# {source} 为提供 cid、parent_cid、text、create_time、reply_comment_total、ord 列的数据源。
+_UPSERT_SQL = """
+WITH locked AS (
+    SELECT next_seq FROM videos WHERE video_id = :video_id FOR UPDATE
+),
+page AS (
+    SELECT src.*, NOT EXISTS (
+        SELECT 1 FROM comments c WHERE c.video_id = :video_id AND c.cid = src.cid
+    ) AS is_new
+    FROM {source}
+),
+numbered AS (
+    SELECT page.*,
+        CASE WHEN is_new
+            THEN locked.next_seq + COUNT(*) FILTER (WHERE is_new) OVER (ORDER BY ord) - 1
+            ELSE 0
+        END AS seq
+    FROM page, locked
+),
+written AS (
+    INSERT INTO comments AS c
+        (video_id, cid, seq, parent_cid, text, create_time, reply_comment_total)
+    SELECT :video_id, cid, seq, parent_cid, text, create_time, reply_comment_total
+    FROM numbered
+    ORDER BY ord
+    ON CONFLICT (video_id, cid) DO UPDATE SET
+        text = EXCLUDED.text,
+        create_time = EXCLUDED.create_time,
+        reply_comment_total = EXCLUDED.reply_comment_total,
+        parent_cid = COALESCE(EXCLUDED.parent_cid, c.parent_cid)
+    WHERE c.text IS DISTINCT FROM EXCLUDED.text
+        OR c.create_time IS DISTINCT FROM EXCLUDED.create_time
+        OR c.reply_comment_total IS DISTINCT FROM EXCLUDED.reply_comment_total
+        OR (EXCLUDED.parent_cid IS NOT NULL AND c.parent_cid IS DISTINCT FROM EXCLUDED.parent_cid)
+    RETURNING cid, seq, parent_cid
+),
+stats AS (
+    SELECT
+        COUNT(*) FILTER (WHERE written.seq = numbered.seq) AS inserted,
+        COUNT(*) FILTER (WHERE written.seq <> numbered.seq) AS updated,
+        COUNT(*) FILTER (
+            WHERE written.seq = numbered.seq AND written.parent_cid IS NOT NULL
+        ) AS inserted_replies
+    FROM written JOIN numbered USING (cid)
+),
+summary AS (
+    UPDATE videos SET
+        next_seq = next_seq + (SELECT COUNT(*) FROM page WHERE is_new),
+        comment_count = comment_count + stats.inserted,
+        reply_count = reply_count + stats.inserted_replies,
+        last_synced_at = now()
+    FROM stats
+    WHERE videos.video_id = :video_id
+)
+SELECT inserted, updated FROM stats
+"""
+
+# 小批量：以数组参数传入，随语句一次发送
+_UNNEST_SOURCE = """unnest(
+        CAST(:cids AS varchar[]),
+        CAST(:parent_cids AS varchar[]),
+        CAST(:texts AS text[]),
+        CAST(:create_times AS timestamptz[]),
+        CAST(:reply_totals AS integer[])
+    ) WITH ORDINALITY AS src(cid, parent_cid, text, create_time, reply_comment_total, ord)"""
+
+# 大批量：先 COPY 进事务级临时表，再由同一条语句写入
+_COPY_TABLE = "_ingest_comments"
+_COPY_SOURCE = f"{_COPY_TABLE} AS src"
+_CREATE_COPY_TABLE = f"""
+CREATE TEMP TABLE {_COPY_TABLE} (
+    ord bigint,
+    cid varchar(50),
+    parent_cid varchar(50),
+    text text,
+    create_time timestamptz,
+    reply_comment_total integer
+) ON COMMIT DROP
+"""
+
+_UNNEST_UPSERT = text(_UPSERT_SQL.format(source=_UNNEST_SOURCE))
+_COPY_UPSERT = text(_UPSERT_SQL.format(source=_COPY_SOURCE))
+
+
+def parse_comment_items(items, parent_cid=None):
+    """
+    将接口返回的评论列表整理为待写入的行，丢弃缺少 cid、text 或 create_time 的评论。
+    parent_cid 不为空时表示这是该一级评论的二级评论，reply_comment_total 固定为 0。
+    同一批次内重复的 cid 只保留最后一条。
+    """
+    rows = {}
+    for item in items:
+        cid = item.get("cid")
+        text_ = item.get("text")
+        create_time = item.get("create_time")
+        if cid and text_ and create_time:
+            rows[cid] = {
+                "cid": cid,
+                "parent_cid": parent_cid,
+                "text": text_,
+                "create_time": datetime.fromtimestamp(create_time, tz=timezone.utc),
+                "reply_comment_total": 0
+                if parent_cid
+                else item.get("reply_comment_total", 0),
+            }
+    return list(rows.values())
+
+
+def changed_comment_rows(video_id, rows):
+    """
+    对照已存储的评论筛选一批待写入的行，返回 (需要写入的行, 已存储的 cid 集合)。
+    已存储且 text、create_time、reply_comment_total 都没有变化的行不需要写入。
+    """
+    if not rows:
+        return [], set()
+    stored = {
+        row.cid: row
+        for row in db.session.execute(
+            select(
+                Comment.cid,
+                Comment.text,
+                Comment.create_time,
+                Comment.reply_comment_total,
+            ).where(
+                Comment.video_id == str(video_id),
+                Comment.cid.in_([row["cid"] for row in rows]),
+            )
+        )
+    }
+    changed = []
+    for row in rows:
+        old = stored.get(row["cid"])
+        if (
+            old is None
+            or old.text != row["text"]
+            or old.create_time != row["create_time"]
+            or old.reply_comment_total != row["reply_comment_total"]
+        ):
+            changed.append(row)
+    return changed, set(stored)
+
+
+def upsert_comments(video_id, rows, checkpoint=None):
+    """
+    写入一批评论（rows 为 parse_comment_items 的结果），返回 (新增数, 更新数)。
+    新评论按顺序分配视频内序号，已存在的评论更新其内容，视频摘要在同一事务内更新。
+    行数达到 Config.INGEST_COPY_THRESHOLD 时改用 COPY 导入临时表的快速路径。
+    checkpoint 为 save_crawl_checkpoint 的关键字参数，给出时抓取断点与评论在同一事务内提交。
+    调用前需确保视频已通过 ensure_video 登记；写入失败时回滚并抛出异常。
+    """
+    if not rows and checkpoint is None:
+        return 0, 0
+
+    video_id = str(video_id)
+    started = time.perf_counter()
+    try:
+        if not rows:
+            path = "checkpoint"
+            result = None
+        elif len(rows) >= Config.INGEST_COPY_THRESHOLD:
+            path = "copy"
+            result = _copy_upsert(video_id, rows)
+        else:
+            path = "unnest"
+            result = db.session.execute(
+                _UNNEST_UPSERT,
+                {
+                    "video_id": video_id,
+                    "cids": [row["cid"] for row in rows],
+                    "parent_cids": [row["parent_cid"] for row in rows],
+                    "texts": [row["text"] for row in rows],
+                    "create_times": [row["create_time"] for row in rows],
+                    "reply_totals": [row["reply_comment_total"] for row in rows],
+                },
+            ).one()
+        if checkpoint is not None:
+            save_crawl_checkpoint(video_id, **checkpoint)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        metrics.upsert_latency.observe(time.perf_counter() - started, path=path)
+    if result is None:
+        return 0, 0
+    metrics.upsert_rows.inc(result.inserted, result="inserted")
+    metrics.upsert_rows.inc(result.updated, result="updated")
+    return result.inserted, result.updated
+
+
+def _copy_upsert(video_id, rows):
+    """
+    大批量写入：在当前事务内建立临时表，用 COPY 流式导入后执行同一条写入语句。
+    """
+    db.session.execute(text(_CREATE_COPY_TABLE))
+    buffer = "".join(
+        "\t".join(
+            (
+                str(ord_),
+                _copy_field(row["cid"]),
+                _copy_field(row["parent_cid"]),
+                _copy_field(row["text"]),
+                row["create_time"].isoformat(),
+                str(row["reply_comment_total"]),
+            )
+        )
+        + "\n"
+        for ord_, row in enumerate(rows, start=1)
+    )
+    dbapi_conn = db.session.connection().connection.dbapi_connection
+    with dbapi_conn.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {_COPY_TABLE} "
+            "(ord, cid, parent_cid, text, create_time, reply_comment_total) "
+            "FROM STDIN",
+            io.StringIO(buffer),
+        )
+    return db.session.execute(_COPY_UPSERT, {"video_id": video_id}).one()
+
+
+def _copy_field(value):
+    """
+    按 COPY 文本格式转义字段，None 写为 \\N。
+    """
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
@@ -0,0 +1,346 @@
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from . import metrics
+from .config import Config
+from .models import Job
+from .sql import db
+
+# 处于这些状态的任务视为活动任务，每个视频的同类任务同时只能有一个
+ACTIVE_STATUSES = ("queued", "running")
+
+# 认领前清理租约已过期的任务：已请求取消的直接标记为 cancelled，执行次数用尽的标记为 error
+_REAP_SQL = text(
+    """
+    UPDATE jobs SET
+        status = CASE WHEN cancel_requested THEN 'cancelled' ELSE 'error' END,
+        error = CASE WHEN cancel_requested THEN error ELSE '任务租约过期次数超过上限' END,
+        lease_owner = NULL,
+        finished_at = now()
+    WHERE kind = :kind AND status = 'running' AND lease_expires_at < now()
+        AND (cancel_requested OR attempts >= max_attempts)
+    """
+)
+
+# 认领一个任务：排队到期的任务或租约已过期（持有者失联）的运行中任务
+_CLAIM_SQL = text(
+    """
+    WITH candidate AS (
+        SELECT id FROM jobs
+        WHERE kind = :kind AND (
+            (status = 'queued' AND run_after <= now())
+            OR (status = 'running' AND lease_expires_at < now())
+        )
+        ORDER BY created_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    UPDATE jobs SET
+        status = 'running',
+        lease_owner = :owner,
+        lease_expires_at = now() + make_interval(secs => :lease),
+        attempts = attempts + 1,
+        started_at = COALESCE(started_at, now())
+    FROM candidate
+    WHERE jobs.id = candidate.id
+    RETURNING jobs.id, jobs.kind, jobs.video_id, jobs.progress, jobs.attempts
+    """
+)
+
+# 心跳：续约并写入进度，返回是否已请求取消；租约已被他人接管时不返回行
+_HEARTBEAT_SQL = text(
+    """
+    UPDATE jobs SET
+        lease_expires_at = now() + make_interval(secs => :lease),
+        progress = CAST(:progress AS jsonb)
+    WHERE id = :id AND lease_owner = :owner AND status = 'running'
+    RETURNING cancel_requested
+    """
+)
+
+# 结束任务：status 为 completed / cancelled
+_FINISH_SQL = text(
+    """
+    UPDATE jobs SET
+        status = :status,
+        progress = CAST(:progress AS jsonb),
+        error = NULL,
+        lease_owner = NULL,
+        finished_at = now()
+    WHERE id = :id AND lease_owner = :owner AND status = 'running'
+    """
+)
+
+# 任务出错：未用尽执行次数时按指数退避重新排队，否则标记为 error
+_FAIL_SQL = text(
+    """
+    UPDATE jobs SET
+        status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'error' END,
+        run_after = now() + make_interval(secs => :backoff * power(2, attempts - 1)),
+        finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE now() END,
+        error = :error,
+        progress = CAST(:progress AS jsonb),
+        lease_owner = NULL
+    WHERE id = :id AND lease_owner = :owner AND status = 'running'
+    """
+)
+
+# 工作线程停止时将执行中的任务放回队列，本次执行不计入执行次数
+_REQUEUE_SQL = text(
+    """
+    UPDATE jobs SET
+        status = 'queued',
+        attempts = attempts - 1,
+        run_after = now(),
+        progress = CAST(:progress AS jsonb),
+        lease_owner = NULL
+    WHERE id = :id AND lease_owner = :owner AND status = 'running'
+    """
+)
+
+# 请求取消：排队中的任务直接取消，运行中的任务由执行者在下次心跳时得知
+_CANCEL_SQL = text(
+    """
+    UPDATE jobs SET
+        cancel_requested = true,
+        status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+        finished_at = CASE WHEN status = 'queued' THEN now() ELSE finished_at END
+    WHERE kind = :kind AND video_id = :video_id AND status IN ('queued', 'running')
+    """
+)
+
+
+def enqueue(kind, video_id, commit=True):
+    """
+    创建任务并返回任务ID；该视频已有同类活动任务时返回 None。
+    commit 为 False 时不提交，任务随调用方会话中的事务一同提交。
+    """
+    stmt = (
+        insert(Job)
+        .values(
+            kind=kind,
+            video_id=str(video_id),
+            max_attempts=Config.JOB_MAX_ATTEMPTS,
+        )
+        .on_conflict_do_nothing(
+            index_elements=[Job.kind, Job.video_id],
+            index_where=Job.status.in_(ACTIVE_STATUSES),
+        )
+        .returning(Job.id)
+    )
+    job_id = db.session.execute(stmt).scalar()
+    if commit:
+        db.session.commit()
+    return job_id
+
+
+def request_cancel(kind, video_id):
+    """
+    请求取消视频的同类活动任务，返回是否存在这样的任务。
+    """
+    result = db.session.execute(_CANCEL_SQL, {"kind": kind, "video_id": str(video_id)})
+    db.session.commit()
+    return result.rowcount > 0
+
+
+def active_jobs(video_id=None):
+    """
+    返回排队中和运行中的任务，可按 video_id 过滤。
+    """
+    query = select(Job).where(Job.status.in_(ACTIVE_STATUSES))
+    if video_id:
+        query = query.where(Job.video_id == str(video_id))
+    return db.session.execute(query.order_by(Job.created_at)).scalars().all()
+
+
+def job_queue_depth():
+    """
+    返回各类任务排队中与运行中的数量 {(kind, status): 数量}。
+    """
+    rows = db.session.execute(
+        select(Job.kind, Job.status, func.count())
+        .where(Job.status.in_(ACTIVE_STATUSES))
+        .group_by(Job.kind, Job.status)
+    )
+    return {(kind, status): count for kind, status, count in rows}
+
+
+def claim(kind, owner):
+    """
+    认领一个 kind 类任务，返回任务行；没有可认领的任务或已达到全局并发上限时返回 None。
+    同类任务的认领通过事务级咨询锁串行化，保证运行中的任务数不超过 Config.JOB_CONCURRENCY。
+    """
+    limit = Config.JOB_CONCURRENCY.get(kind, 1)
+    with db.engine.begin() as conn:
+        conn.execute(select(func.pg_advisory_xact_lock(func.hashtext(f"jobs:{kind}"))))
+        conn.execute(_REAP_SQL, {"kind": kind})
+        running = conn.execute(
+            select(func.count())
+            .select_from(Job)
+            .where(
+                Job.kind == kind,
+                Job.status == "running",
+                Job.lease_expires_at >= func.now(),
+            )
+        ).scalar_one()
+        if running >= limit:
+            return None
+        return conn.execute(
+            _CLAIM_SQL,
+            {"kind": kind, "owner": owner, "lease": Config.JOB_LEASE_SECONDS},
+        ).first()
+
+
+def _update(statement, params):
+    with db.engine.begin() as conn:
+        return conn.execute(statement, params)
+
+
+class JobContext:
+    """
+    传给任务处理函数的上下文：video_id、可随时更新的 progress（由心跳写入数据库），
+    以及 cancelled 标志（收到取消请求、租约被接管或工作线程停止时为 True）。
+    """
+
+    def __init__(self, job, stop_event):
+        self.job_id = job.id
+        self.kind = job.kind
+        self.video_id = job.video_id
+        self.attempts = job.attempts
+        self.progress = dict(job.progress or {})
+        self.cancel_requested = False
+        self.lease_lost = False
+        self.stop_event = stop_event
+
+    @property
+    def cancelled(self):
+        return self.cancel_requested or self.lease_lost or self.stop_event.is_set()
+
+
+class JobWorker(threading.Thread):
+    """
+    任务工作线程：轮询认领 handlers 中各类任务并执行，执行期间由心跳线程续约。
+    处理函数 handler(ctx) 返回 completed 或 cancelled，抛出异常时按重试策略处理。
+    """
+
+    def __init__(self, app, handlers, stop_event, name):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self.handlers = handlers
+        self.stop_event = stop_event
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{name}"
+
+    def run(self):
+        with self.app.app_context():
+            while not self.stop_event.is_set():
+                job = None
+                kind = None
+                try:
+                    for kind in self.handlers:
+                        job = claim(kind, self.owner)
+                        if job is not None:
+                            break
+                except Exception as e:
+                    metrics.job_errors.inc(kind=kind, stage="claim")
+                    print(f"认领任务失败：{e}")
+                if job is None:
+                    self.stop_event.wait(Config.JOB_POLL_INTERVAL)
+                    continue
+                self._execute(job)
+                db.session.remove()
+
+    def _execute(self, job):
+        ctx = JobContext(job, self.stop_event)
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(ctx, done), daemon=True
+        )
+        heartbeat.start()
+
+        error = None
+        status = "completed"
+        started = time.perf_counter()
+        try:
+            status = self.handlers[job.kind](ctx) or "completed"
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            metrics.job_errors.inc(kind=ctx.kind, stage="handler")
+            print(f"任务 {ctx.job_id}（{ctx.kind} {ctx.video_id}）出错：{error}")
+            traceback.print_exc()
+        finally:
+            done.set()
+            heartbeat.join()
+            db.session.rollback()
+        metrics.job_duration.observe(
+            time.perf_counter() - started,
+            kind=ctx.kind,
+            status=status if error is None else "error",
+        )
+
+        if ctx.lease_lost:
+            return
+        params = {"id": ctx.job_id, "owner": self.owner, "progress": _json(ctx)}
+        try:
+            if error is not None:
+                _update(
+                    _FAIL_SQL,
+                    dict(params, error=error, backoff=Config.JOB_RETRY_BACKOFF),
+                )
+            elif status == "cancelled" and not ctx.cancel_requested:
+                # 因工作线程停止而中断，放回队列由其他工作线程继续
+                _update(_REQUEUE_SQL, params)
+            else:
+                _update(_FINISH_SQL, dict(params, status=status))
+        except Exception as e:
+            # 写回失败时任务保持运行状态，租约过期后由其他工作线程重新认领
+            metrics.job_errors.inc(kind=ctx.kind, stage="finish")
+            print(f"任务 {ctx.job_id} 写回状态失败：{e}")
+
+    def _heartbeat(self, ctx, done):
+        with self.app.app_context():
+            while not done.wait(Config.JOB_HEARTBEAT_INTERVAL):
+                try:
+                    row = _update(
+                        _HEARTBEAT_SQL,
+                        {
+                            "id": ctx.job_id,
+                            "owner": self.owner,
+                            "lease": Config.JOB_LEASE_SECONDS,
+                            "progress": _json(ctx),
+                        },
+                    ).first()
+                except Exception as e:
+                    metrics.job_errors.inc(kind=ctx.kind, stage="heartbeat")
+                    print(f"任务 {ctx.job_id} 心跳失败：{e}")
+                    continue
+                if row is None:
+                    ctx.lease_lost = True
+                    return
+                ctx.cancel_requested = row.cancel_requested
+
+
+def _json(ctx):
+    return json.dumps(ctx.progress)
+
+
+# 服务进程内所有工作线程共用的停止信号
+stop_event = threading.Event()
+
+
+def start_workers(app, count, handlers):
+    """
+    启动 count 个任务工作线程，返回线程列表。
+    """
+    workers = [
+        JobWorker(app, handlers, stop_event, name=f"job-worker-{index}")
+        for index in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
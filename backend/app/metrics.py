@@ -0,0 +1,429 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .config import Config
+
+# 延迟直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# 条数直方图的默认分桶（页大小、批大小等）
+SIZE_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+class _Metric:
+    """
+    指标的公共部分：按标签值元组保存各时间序列的值，所有操作都在一把锁内完成，开销为一次字典更新。
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            samples = [[list(key), value] for key, value in self._values.items()]
+        return {
+            "type": self.kind,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            "samples": samples,
+        }
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """
+    直方图：每个时间序列保存 [各分桶计数（非累计）..., 总和, 次数]，输出时再换算为累计计数。
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        上下文管理器：观测 with 块的耗时（秒）。
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        snapshot["buckets"] = list(self.buckets)
+        with self._lock:
+            snapshot["samples"] = [
+                [list(key), list(value)] for key, value in self._values.items()
+            ]
+        return snapshot
+
+
+class _CallbackMetric:
+    """
+    取值时才调用 collect() 的指标，用于导出已有的统计（如推理缓存的 stats()）。
+    collect 返回 {标签值元组: 数值}。
+    """
+
+    def __init__(self, kind, name, documentation, labelnames, collect):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def snapshot(self):
+        return {
+            "type": self.kind,
+            "help": self.documentation,
+            "labelnames": list(self.labelnames),
+            "samples": [[list(key), value] for key, value in self.collect().items()],
+        }
+
+
+class Registry:
+    """
+    指标注册表。多进程部署（gunicorn）时各进程的指标只在本进程内累加，
+    设置 Config.METRICS_DIR 后每个进程定期把快照写入该目录，render() 汇总所有进程的快照：
+    计数器与直方图按时间序列求和（已退出进程的快照保留，计数不会因进程重启而回退），
+    仪表只汇总仍在运行的进程。
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._snapshot_pid = None
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, kind, name, documentation, labelnames, collect):
+        return self._register(
+            _CallbackMetric(kind, name, documentation, labelnames, collect)
+        )
+
+    def reset(self):
+        """
+        清空所有计数器、仪表和直方图的值（fork 出的子进程不应继承父进程的计数）。
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            if isinstance(metric, _Metric):
+                with metric._lock:
+                    metric._values.clear()
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshot = {}
+        for metric in metrics:
+            try:
+                snapshot[metric.name] = metric.snapshot()
+            except Exception as e:
+                print(f"采集指标 {metric.name} 失败：{e}")
+        return snapshot
+
+    def write_snapshot(self):
+        """
+        将本进程的指标快照原子地写入 Config.METRICS_DIR/<pid>.json，未设置该目录时不做任何事。
+        """
+        if not Config.METRICS_DIR:
+            return
+        pid = os.getpid()
+        path = os.path.join(Config.METRICS_DIR, f"{pid}.json")
+        with self._write_lock:
+            if self._snapshot_pid != pid:
+                # 进程号被复用时，同名文件是已退出进程留下的快照，改名保留其计数
+                os.makedirs(Config.METRICS_DIR, exist_ok=True)
+                if os.path.exists(path):
+                    os.replace(
+                        path,
+                        os.path.join(
+                            Config.METRICS_DIR, f"exited-{pid}-{time.time_ns()}.json"
+                        ),
+                    )
+                self._snapshot_pid = pid
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+    def collect(self):
+        """
+        返回汇总后的快照：未设置 Config.METRICS_DIR 时为本进程的快照，否则合并目录中所有进程的快照。
+        """
+        if not Config.METRICS_DIR:
+            return self.snapshot()
+        self.write_snapshot()
+        merged = {}
+        for filename in os.listdir(Config.METRICS_DIR):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(
+                    os.path.join(Config.METRICS_DIR, filename), encoding="utf-8"
+                ) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            stem = filename[:-5]
+            _merge(merged, snapshot, alive=stem.isdigit() and _process_alive(int(stem)))
+        return merged
+
+    def render(self, extra=None):
+        """
+        以 Prometheus 文本格式输出所有指标，extra 为额外的全局快照（如按数据库统计的任务队列长度）。
+        """
+        snapshot = self.collect()
+        if extra:
+            snapshot.update(extra)
+        lines = []
+        for name, metric in snapshot.items():
+            lines.append(f"# HELP {name} {_escape_help(metric['help'])}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            labelnames = metric["labelnames"]
+            for values, value in metric["samples"]:
+                labels = list(zip(labelnames, values))
+                if metric["type"] != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric["buckets"] + ["+Inf"], value):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _number(bound)
+                    lines.append(
+                        f"{name}_bucket{_labels(labels + [('le', le)])} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value[-2])}")
+                lines.append(f"{name}_count{_labels(labels)} {value[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge(merged, snapshot, alive):
+    for name, metric in snapshot.items():
+        if metric["type"] == "gauge" and not alive:
+            continue
+        target = merged.setdefault(name, dict(metric, samples=[]))
+        index = {
+            tuple(values): position
+            for position, (values, _) in enumerate(target["samples"])
+        }
+        for values, value in metric["samples"]:
+            position = index.get(tuple(values))
+            if position is None:
+                index[tuple(values)] = len(target["samples"])
+                target["samples"].append([values, value])
+            elif isinstance(value, list):
+                current = target["samples"][position][1]
+                target["samples"][position][1] = [a + b for a, b in zip(current, value)]
+            else:
+                target["samples"][position][1] += value
+
+
+def _process_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return (
+        "{"
+        + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels)
+        + "}"
+    )
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def start_snapshot_writer():
+    """
+    设置了 Config.METRICS_DIR 时启动后台线程，每 Config.METRICS_FLUSH_INTERVAL 秒写入一次本进程的快照。
+    """
+    if not Config.METRICS_DIR:
+        return
+
+    def loop():
+        while True:
+            try:
+                registry.write_snapshot()
+            except OSError as e:
+                print(f"写入指标快照失败：{e}")
+            time.sleep(Config.METRICS_FLUSH_INTERVAL)
+
+    threading.Thread(target=loop, name="metrics-snapshot", daemon=True).start()
+
+
+# 服务进程内共享的指标注册表
+registry = Registry()
+
+# ---------------------------
+# 抓取
+# ---------------------------
+upstream_requests = registry.counter(
+    "douyin_upstream_requests_total",
+    "请求抖音接口的次数，status 为 HTTP 状态码、api_error（返回码表示失败）或异常类型",
+    ("endpoint", "status"),
+)
+upstream_latency = registry.histogram(
+    "douyin_upstream_request_seconds",
+    "请求抖音接口的耗时（秒），不含限速与并发排队",
+    ("endpoint",),
+)
+upstream_page_size = registry.histogram(
+    "douyin_upstream_page_comments",
+    "抖音接口每页返回的评论数",
+    ("endpoint",),
+    buckets=SIZE_BUCKETS,
+)
+reply_thread_errors = registry.counter(
+    "douyin_reply_thread_errors_total",
+    "抓取或存储某条一级评论的回复时出错而提前结束的次数",
+    ("stage",),
+)
+
+# ---------------------------
+# 写入
+# ---------------------------
+upsert_latency = registry.histogram(
+    "douyin_comment_upsert_seconds",
+    "一批评论写入数据库（含提交）的耗时（秒），path 为 unnest / copy / checkpoint（只保存断点）",
+    ("path",),
+)
+upsert_rows = registry.counter(
+    "douyin_comment_rows_total",
+    "写入数据库的评论行数，result 为 inserted（新增）或 updated（内容有变化）",
+    ("result",),
+)
+
+# ---------------------------
+# 推理
+# ---------------------------
+inference_batch_size = registry.histogram(
+    "douyin_inference_batch_size",
+    "每次调用模型的文本条数",
+    buckets=SIZE_BUCKETS,
+)
+inference_batch_latency = registry.histogram(
+    "douyin_inference_batch_seconds", "每次调用模型的耗时（秒）"
+)
+inference_batch_errors = registry.counter(
+    "douyin_inference_batch_errors_total", "调用模型出错的批次数"
+)
+stream_batch_latency = registry.histogram(
+    "douyin_stream_batch_seconds",
+    "情感分析流每批评论的处理耗时（秒），含读取缓存与结果表、推理和序列化",
+)
+active_streams = registry.gauge("douyin_active_streams", "正在输出的情感分析流数量")
+
+# ---------------------------
+# HTTP 与后台任务
+# ---------------------------
+http_requests = registry.histogram(
+    "douyin_http_request_seconds",
+    "接口处理耗时（秒），流式接口只计到开始输出",
+    ("endpoint", "method", "status"),
+)
+job_duration = registry.histogram(
+    "douyin_job_seconds",
+    "后台任务每次执行的耗时（秒），status 为 completed / cancelled / error",
+    ("kind", "status"),
+)
+job_errors = registry.counter(
+    "douyin_job_errors_total",
+    "后台任务工作线程出错的次数，stage 为 claim（认领）、handler（任务处理函数抛出异常）、"
+    "heartbeat（心跳续约）或 finish（写回任务状态）",
+    ("kind", "stage"),
+)
+video_info_lookups = registry.counter(
+    "douyin_video_info_cache_total",
+    "视频信息查询，result 为 fresh（新鲜命中）、stale（返回旧数据并后台刷新）或 miss（请求上游）",
+    ("result",),
+)
@@ -1,44 +1,378 @@
-from sqlalchemy import Column, String, Text, DateTime, Integer, Sequence, Index
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    String,
+    Text,
+    DateTime,
+    Float,
+    Integer,
+    LargeBinary,
+    Index,
+    event,
+    func,
+    insert,
+    select,
+    text,
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from .config import Config
 from .sql import db
 
-# 定义一个全局缓存字典
-_model_cache = {}
-
-
-def create_model(video_id):
-    """
-    针对每个 video_id 动态创建一个评论表模型，并且只创建一次。
-    新增自增序号字段 seq，并为 seq 和 create_time 建立索引，
-    以便后续实现高效的键集分页查询（例如：通过序号或时间戳查询）。
-    """
-    if video_id in _model_cache:
-        return _model_cache[video_id]
-
-    table_name = f"video_{video_id}"
-    class_name = f"DynamicComment_{video_id}"
-    seq_name = f"seq_{table_name}"
-    seq = Sequence(seq_name, start=1, increment=1)
-
-    model = type(
-        class_name,
-        (db.Model,),
-        {
-            "__tablename__": table_name,
-            "__table_args__": (
-                Index(f"idx_seq_{video_id}", "seq"),
-                Index(f"idx_create_time_{video_id}", "create_time"),
-                {"extend_existing": True},
-            ),
-            "seq": Column(
-                Integer, seq, server_default=seq.next_value(), nullable=False
-            ),
-            "cid": Column(String(50), primary_key=True),
-            "text": Column(Text, nullable=False),
-            "create_time": Column(DateTime(timezone=True), nullable=False),
-            "reply_comment_total": Column(Integer, default=0, nullable=False),
-            "__repr__": lambda self: f"<Comment {self.cid}>",
-        },
-    )
-
-    _model_cache[video_id] = model
-    return model
+
+class Video(db.Model):
+    """
+    已跟踪视频的登记表兼视频摘要，抓取评论和情绪分析时原地更新，
+    /all_store_videos 直接读取本表，无需逐个统计评论数量。
+    next_seq 为该视频下一条新评论的序号，写入评论时在同一事务内按批次分配。
+    comment_count 为已存储的评论总数（含二级评论），reply_count 为其中二级评论的数量。
+    last_analyzed_seq 之前（含）的评论均已有情绪分析结果，emotion_counts 为各情绪的评论数。
+    published_at 为视频的发布时间，获取视频信息时写入，用于按发布后经过的时间统计情绪。
+    """
+
+    __tablename__ = "videos"
+
+    video_id = Column(String(50), primary_key=True)
+    next_seq = Column(Integer, nullable=False, default=1, server_default="1")
+    comment_count = Column(Integer, nullable=False, default=0, server_default="0")
+    reply_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_synced_at = Column(DateTime(timezone=True), nullable=True)
+    last_analyzed_seq = Column(Integer, nullable=False, default=0, server_default="0")
+    emotion_counts = Column(JSONB, nullable=False, default=dict, server_default="{}")
+    published_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    def __repr__(self):
+        return f"<Video {self.video_id}>"
+
+
+class SchemaVersion(db.Model):
+    """
+    已执行的数据库结构升级步骤（见 SCHEMA_MIGRATIONS），每个版本号一行。
+    """
+
+    __tablename__ = "schema_versions"
+
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+
+# 数据表首次发布后的结构升级步骤 (版本号, 语句列表)：create_all 不会为已存在的表补建列和索引，
+# 由 apply_schema_migrations 按版本号顺序各执行一次并记录到 schema_versions；
+# 语句本身也是幂等的，新建的数据库执行时不会出错。新步骤只能追加在末尾，已发布的步骤不要修改
+SCHEMA_MIGRATIONS = [
+    (
+        1,
+        [
+            "ALTER TABLE videos ADD COLUMN IF NOT EXISTS published_at timestamptz",
+            "ALTER TABLE crawl_checkpoints "
+            "ADD COLUMN IF NOT EXISTS high_water_mark timestamptz",
+        ],
+    ),
+    (
+        2,
+        [
+            # 评论文本的字符二元组（转小写后每两个相邻字符一组），中文没有空格分词，
+            # pg_trgm 在常见的 C 语言环境下也不会为中文字符生成三元组，因此用二元组建立 GIN 索引
+            """
+            CREATE OR REPLACE FUNCTION comment_bigrams(t text) RETURNS text[]
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+                SELECT COALESCE(array_agg(DISTINCT substr(lower(t), i, 2)), '{}')
+                FROM generate_series(1, GREATEST(char_length(t) - 1, 1)) AS i
+            $$
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_comments_text_bigrams "
+            "ON comments USING gin (comment_bigrams(text))",
+            "CREATE INDEX IF NOT EXISTS idx_comments_video_reply_total "
+            "ON comments (video_id, reply_comment_total)",
+        ],
+    ),
+    (3, ["ALTER TABLE watchlist ADD COLUMN IF NOT EXISTS sync_estimate integer"]),
+    (
+        4,
+        [
+            # 情绪分析结果冗余记录评论所属的视频与序号，已有结果按评论表补全
+            "ALTER TABLE sentiment_results "
+            "ADD COLUMN IF NOT EXISTS video_id varchar(50), "
+            "ADD COLUMN IF NOT EXISTS seq integer",
+            "UPDATE sentiment_results r SET video_id = c.video_id, seq = c.seq "
+            "FROM comments c WHERE c.cid = r.cid AND r.video_id IS NULL",
+            "CREATE INDEX IF NOT EXISTS idx_sentiment_results_video_label "
+            "ON sentiment_results (video_id, model_revision, label, seq)",
+        ],
+    ),
+]
+
+
+def apply_schema_migrations(conn):
+    """
+    在 conn 的事务中执行 schema_versions 中尚未记录的升级步骤，需在 create_all 之后调用。
+    已是最新版本时只查询一次版本号；否则取得事务级咨询锁后再检查，多个进程同时启动时每个步骤只执行一次。
+    """
+    latest = SCHEMA_MIGRATIONS[-1][0]
+    current = select(func.max(SchemaVersion.version))
+    if (conn.execute(current).scalar() or 0) >= latest:
+        return
+    conn.execute(select(func.pg_advisory_xact_lock(func.hashtext("schema_migrations"))))
+    applied = set(conn.execute(select(SchemaVersion.version)).scalars())
+    for version, statements in SCHEMA_MIGRATIONS:
+        if version in applied:
+            continue
+        for statement in statements:
+            conn.exec_driver_sql(statement)
+        conn.execute(insert(SchemaVersion).values(version=version))
+
+
+class Comment(db.Model):
+    """
+    所有视频共用的评论表，以 (video_id, cid) 为主键，并按 video_id 哈希分区。
+    seq 为视频内递增的序号，配合 (video_id, seq) 和 (video_id, create_time) 索引
+    实现高效的键集分页查询；二级评论的 parent_cid 为其所属一级评论的 cid。
+    """
+
+    __tablename__ = "comments"
+    __table_args__ = (
+        Index("idx_comments_video_seq", "video_id", "seq"),
+        Index("idx_comments_video_create_time", "video_id", "create_time"),
+        {"postgresql_partition_by": "HASH (video_id)"},
+    )
+
+    video_id = Column(String(50), primary_key=True)
+    cid = Column(String(50), primary_key=True)
+    seq = Column(Integer, nullable=False)
+    parent_cid = Column(String(50), nullable=True)
+    text = Column(Text, nullable=False)
+    create_time = Column(DateTime(timezone=True), nullable=False)
+    reply_comment_total = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<Comment {self.cid}>"
+
+
+@event.listens_for(Comment.__table__, "after_create")
+def _create_comment_partitions(target, connection, **kw):
+    """
+    创建 comments 表后，按配置的分区数量创建哈希分区。
+    """
+    modulus = Config.COMMENTS_PARTITIONS
+    for remainder in range(modulus):
+        connection.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {target.name}_p{remainder} "
+            f"PARTITION OF {target.name} "
+            f"FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})"
+        )
+
+
+class CrawlCheckpoint(db.Model):
+    """
+    评论抓取的断点，记录最近一次成功写入后上游返回的游标和 has_more。
+    parent_cid 为空字符串时表示视频的一级评论，否则为该一级评论的回复。
+    抓取中断（超时、上游出错、取消）后，新任务从 has_more 为真的断点继续翻页；
+    回复抓取完毕时记录当时一级评论的 reply_total，回复数不变的一级评论再次抓取时直接跳过。
+    一级评论抓取完毕时记录已存储一级评论的最晚发布时间 high_water_mark，供增量同步判断新旧。
+    """
+
+    __tablename__ = "crawl_checkpoints"
+
+    video_id = Column(String(50), primary_key=True)
+    parent_cid = Column(String(50), primary_key=True, default="", server_default="")
+    cursor = Column(BigInteger, nullable=False, default=0, server_default="0")
+    has_more = Column(Boolean, nullable=False, default=True, server_default="true")
+    reply_total = Column(Integer, nullable=True)
+    high_water_mark = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False,
+    )
+
+    def __repr__(self):
+        return f"<CrawlCheckpoint {self.video_id} {self.parent_cid} {self.cursor}>"
+
+
+class SentimentResult(db.Model):
+    """
+    评论情绪分析结果表，以评论 cid 为主键。
+    同时记录推理时评论文本的哈希值和模型版本，二者任一与当前不一致即视为过期，需要重新推理。
+    scores 按固定标签顺序以半精度浮点紧凑存储 7 类情绪得分。
+    video_id 与 seq 冗余自评论表，配合 (video_id, model_revision, label, seq) 索引按情绪键集分页查询评论。
+    """
+
+    __tablename__ = "sentiment_results"
+    __table_args__ = (
+        Index(
+            "idx_sentiment_results_video_label",
+            "video_id",
+            "model_revision",
+            "label",
+            "seq",
+        ),
+    )
+
+    cid = Column(String(50), primary_key=True)
+    video_id = Column(String(50), nullable=True)
+    seq = Column(Integer, nullable=True)
+    text_hash = Column(String(32), nullable=False)
+    model_revision = Column(String(50), nullable=False)
+    label = Column(String(10), nullable=False)
+    scores = Column(LargeBinary, nullable=False)
+    updated_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False,
+    )
+
+    def __repr__(self):
+        return f"<SentimentResult {self.cid} {self.label}>"
+
+
+class InferenceCacheEntry(db.Model):
+    """
+    跨视频共享的推理结果缓存，以规范化后短文本的哈希值和模型版本为主键。
+    重复评论（如“哈哈哈哈”、表情、复制粘贴的刷屏内容）命中缓存后无需再次推理。
+    """
+
+    __tablename__ = "inference_cache"
+
+    text_hash = Column(String(32), primary_key=True)
+    model_revision = Column(String(50), primary_key=True)
+    label = Column(String(10), nullable=False)
+    scores = Column(LargeBinary, nullable=False)
+    created_at = Column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    def __repr__(self):
+        return f"<InferenceCacheEntry {self.text_hash} {self.label}>"
+
+
+class VideoMeta(db.Model):
+    """
+    视频信息缓存的持久化层，info 为 /video_info 返回的视频信息，fetched_at 为从上游获取的时间。
+    """
+
+    __tablename__ = "video_meta"
+
+    video_id = Column(String(50), primary_key=True)
+    info = Column(JSONB, nullable=False)
+    fetched_at = Column(DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return f"<VideoMeta {self.video_id}>"
+
+
+class VideoStatsSnapshot(db.Model):
+    """
+    每次从上游获取视频信息时记录的统计数据快照，形成播放、点赞、评论等数据的时间序列。
+    """
+
+    __tablename__ = "video_stats_history"
+
+    video_id = Column(String(50), primary_key=True)
+    captured_at = Column(DateTime(timezone=True), primary_key=True)
+    play_count = Column(BigInteger, nullable=False, default=0)
+    like_count = Column(BigInteger, nullable=False, default=0)
+    comment_count = Column(BigInteger, nullable=False, default=0)
+    share_count = Column(BigInteger, nullable=False, default=0)
+    favorite_count = Column(BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<VideoStatsSnapshot {self.video_id} {self.captured_at}>"
+
+
+class WatchedVideo(db.Model):
+    """
+    自动同步的关注列表。调度器根据历次同步抓到的新评论数估计每个视频的新评论速度
+    velocity（条/小时，指数滑动平均），据此安排下次同步时间 next_sync_at；
+    sync_job_id 为正在执行的同步任务，任务结束后调度器据其结果更新速度；
+    sync_estimate 为提交该任务时预计的上游请求页数，任务结束后按实际页数修正请求预算。
+    """
+
+    __tablename__ = "watchlist"
+
+    video_id = Column(String(50), primary_key=True)
+    velocity = Column(Float, nullable=True)
+    last_new_comments = Column(Integer, nullable=True)
+    last_synced_at = Column(DateTime(timezone=True), nullable=True)
+    next_sync_at = Column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False, index=True
+    )
+    sync_job_id = Column(BigInteger, nullable=True)
+    sync_estimate = Column(Integer, nullable=True)
+    created_at = Column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    def __repr__(self):
+        return f"<WatchedVideo {self.video_id} {self.velocity}>"
+
+
+class WatchBudget(db.Model):
+    """
+    关注列表调度器的上游请求预算（令牌桶），只有 id = 1 一行。
+    所有进程的调度器在同一咨询锁内读写这一行，共用 Config.WATCH_REQUEST_BUDGET 页/小时的预算；
+    refilled_at 为上次补充令牌的时间。
+    """
+
+    __tablename__ = "watch_budget"
+
+    id = Column(Integer, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    refilled_at = Column(DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return f"<WatchBudget {self.tokens}>"
+
+
+class Job(db.Model):
+    """
+    持久化的后台任务队列，取代进程内的任务字典，服务重启或重新部署后任务不会丢失。
+    工作线程（可位于不同进程或容器）用 FOR UPDATE SKIP LOCKED 认领任务，认领后持有租约，
+    运行期间定期心跳续约并写入进度；租约过期的任务可被其他工作线程重新认领。
+    每个视频的同类任务同时只能有一个处于 queued 或 running 状态。
+    """
+
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index(
+            "uq_jobs_active",
+            "kind",
+            "video_id",
+            unique=True,
+            postgresql_where=text("status IN ('queued', 'running')"),
+        ),
+        Index("idx_jobs_claim", "kind", "status", "run_after"),
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    video_id = Column(String(50), nullable=False)
+    # queued、running、completed、cancelled、error
+    status = Column(String(20), nullable=False, server_default="queued")
+    progress = Column(JSONB, nullable=False, default=dict, server_default="{}")
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    max_attempts = Column(Integer, nullable=False)
+    cancel_requested = Column(
+        Boolean, nullable=False, default=False, server_default="false"
+    )
+    lease_owner = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    # 重试的任务在此时间之后才会被再次认领
+    run_after = Column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    created_at = Column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.video_id} {self.status}>"
@@ -1,133 +1,445 @@
-import json
-from modelscope.pipelines import pipeline
-from modelscope.utils.constant import Tasks
-from .models import create_model
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import metrics
+from .backends import load_backend, max_token_length, result_revision
+from .config import Config
+from .database import advance_analyzed_seq, video_exists
+from .inference import InferenceCancelled, InferenceScheduler
+from .inference_cache import inference_cache
+from .models import Comment
+from .sentiment_store import load_results, save_results, text_hash
 from .sql import db
-from sqlalchemy import inspect
+from .streaming import client_disconnected, dumps, stream_stats
 from flask import request
+from sqlalchemy import select
 
 # 定义全局默认批次大小
 DEFAULT_BATCH_SIZE = 20
 
-# 在模块加载时预先初始化情绪分析模型
-model_dir = "/app/bert"
-semantic_cls = pipeline(
-    Tasks.text_classification,
-    model_revision="v1.0.0",
-    model=model_dir,
+# 结果表中的模型版本标识，区分不同推理后端给出的结果
+RESULT_REVISION = result_revision()
+
+# 预热推理使用的文本，覆盖短文本与较长文本两种形状
+WARMUP_TEXTS = ["哈哈哈", "这条评论用于模型预热" * 10]
+
+# 情绪分析模型由后台线程按 Config.INFER_BACKEND 加载，加载并完成预热推理前为 None
+semantic_cls = None
+_model_error = None
+_model_loaded = threading.Event()
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+# preload_model() 在 fork 工作进程之前加载的模型，尚未执行预热推理
+_preloaded = None
+
+
+def preload_model():
+    """
+    在预派生（pre-fork）服务器的主进程中加载模型权重，工作进程 fork 后以写时复制方式共享，
+    内存占用不随工作进程数成倍增加。仅对 pytorch 后端生效：ONNX Runtime 会话持有的线程池
+    不能跨 fork 使用，由各工作进程自行加载。这里不执行推理，避免推理线程池在 fork 前初始化；
+    预热推理在工作进程调用 start_model_warmup() 时进行。
+    """
+    global _preloaded
+    if Config.INFER_BACKEND == "pytorch" and _preloaded is None:
+        _preloaded = load_backend(Config.INFER_BACKEND, Config.MODEL_DIR)
+
+
+def start_model_warmup():
+    """
+    在后台线程中加载情绪分析模型并执行一次预热推理，重复调用不会重复加载。
+    """
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(
+                target=_load_model, name="model-warmup", daemon=True
+            )
+            _warmup_thread.start()
+
+
+def _load_model():
+    global semantic_cls, _model_error
+    try:
+        backend = _preloaded or load_backend(Config.INFER_BACKEND, Config.MODEL_DIR)
+        backend(WARMUP_TEXTS)
+        semantic_cls = backend
+    except Exception as e:
+        _model_error = str(e)
+        print(f"情绪分析模型加载失败：{e}")
+    finally:
+        _model_loaded.set()
+
+
+def model_status():
+    """
+    返回模型状态：ready（可以推理）、warming_up（加载或预热中）、error（加载失败）及错误信息。
+    """
+    if not _model_loaded.is_set():
+        return "warming_up", None
+    if semantic_cls is None:
+        return "error", _model_error
+    return "ready", None
+
+
+def _run_model(texts):
+    """
+    对一个微批次调用模型，返回与输入等长的原始输出列表。
+    模型尚未加载时先触发加载并等待其完成。
+    """
+    start_model_warmup()
+    _model_loaded.wait()
+    if semantic_cls is None:
+        raise RuntimeError(f"情绪分析模型加载失败：{_model_error}")
+    return semantic_cls(texts)
+
+
+def token_length(text):
+    """
+    估算文本的 token 数：中文 BERT 分词基本一字一词，另加 [CLS] 与 [SEP]，
+    不超过当前推理后端实际处理的最大长度（见 max_token_length）。
+    """
+    return min(len(text) + 2, max_token_length())
+
+
+def truncate_text(text):
+    """
+    将文本截断到 Config.INFER_MAX_TEXT_LENGTH 个字符，避免个别超长评论拖慢整批推理。
+    """
+    return text[: Config.INFER_MAX_TEXT_LENGTH]
+
+
+# 所有请求路径共用的推理调度器，将并发请求的文本合并为微批次，
+# 再按长度分桶拆分为 padding 开销受控的子批次推理
+scheduler = InferenceScheduler(
+    _run_model,
+    max_batch_size=Config.INFER_MAX_BATCH_SIZE,
+    max_wait=Config.INFER_MAX_WAIT_MS / 1000,
+    token_budget=Config.INFER_TOKEN_BUDGET,
+    length_of=token_length,
+    cancel_poll=Config.STREAM_DISCONNECT_CHECK_MS / 1000,
+)
+
+# 取值时读取调度器、推理缓存与流式接口已有的统计
+metrics.registry.callback(
+    "gauge",
+    "douyin_inference_queue_depth",
+    "推理调度器中文本尚未全部送入模型的请求数",
+    (),
+    lambda: {(): scheduler.queue_depth()},
+)
+metrics.registry.callback(
+    "counter",
+    "douyin_inference_cancelled_texts_total",
+    "因请求取消而未推理（skipped）或推理结果被丢弃（wasted）的文本数",
+    ("result",),
+    lambda: {
+        ("skipped",): scheduler.stats()["cancelled_texts"],
+        ("wasted",): scheduler.stats()["wasted_texts"],
+    },
+)
+metrics.registry.callback(
+    "counter",
+    "douyin_inference_cache_texts_total",
+    "经推理缓存查询的文本数，result 为 memory_hit / table_hit / batch_duplicate / inferred，"
+    "命中率 = 1 - inferred / 全部",
+    ("result",),
+    lambda: {
+        (result,): inference_cache.stats()[key]
+        for result, key in (
+            ("memory_hit", "memory_hits"),
+            ("table_hit", "table_hits"),
+            ("batch_duplicate", "batch_duplicates"),
+            ("inferred", "inferred"),
+        )
+    },
+)
+metrics.registry.callback(
+    "gauge",
+    "douyin_inference_cache_memory_entries",
+    "推理缓存内存层的条目数",
+    (),
+    lambda: {(): inference_cache.stats()["memory_entries"]},
+)
+metrics.registry.callback(
+    "counter",
+    "douyin_streams_total",
+    "情感分析流的数量，result 为 started / completed / disconnected",
+    ("result",),
+    lambda: {
+        (name,): value
+        for name, value in stream_stats.stats().items()
+        if name != "undelivered_comments"
+    },
 )
 
 
-def client_disconnected():
+def parse_model_output(result):
     """
-    检查客户端是否已断开连接
+    将模型对单条文本的输出解析为 (预测标签, {标签: 置信度})，没有给出结果时为 (None, {})。
     """
-    inp = request.environ.get("wsgi.input")
-    return inp and getattr(inp, "closed", False)
+    scores = result.get("scores", [])
+    labels = result.get("labels", [])
+    if not scores or not labels:
+        return None, {}
+    max_index = scores.index(max(scores))
+    return labels[max_index], dict(zip(labels, scores))
 
 
-def analyze_comments_sentiment(comment_texts, batch_size=DEFAULT_BATCH_SIZE):
+def score_texts(texts, cancelled=None):
+    """
+    不经缓存直接推理：文本截断后经推理调度器与其他请求合并、按长度分桶推理，
+    返回按输入顺序排列的 (预测标签, {标签: 置信度}) 列表。
+    cancelled() 返回 True 时放弃等待并抛出 InferenceCancelled。
+    """
+    results = scheduler.submit(
+        [truncate_text(text) for text in texts], cancelled=cancelled
+    )
+    return [parse_model_output(result) for result in results]
+
+
+def analyze_comments_scores(comment_texts, cancelled=None):
+    """
+    对多条评论文本进行情绪分析，返回每条文本对应的 (预测标签, {标签: 置信度}) 列表。
+    模型没有给出结果的文本对应 (None, {})。
+    批内重复和跨视频重复的文本由推理缓存直接给出结果，其余文本才交给模型。
+    """
+    return inference_cache.analyze(
+        [truncate_text(text) for text in comment_texts],
+        lambda texts: score_texts(texts, cancelled),
+        RESULT_REVISION,
+    )
+
+
+class SchedulerPool:
+    """
+    与 InferencePool 接口相同的服务进程内推理池，供后台分析任务使用。
+    每段评论经共享推理调度器推理，最多 workers 段同时在途，读写数据库与推理可以重叠进行。
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="analyze-video"
+        )
+
+    def submit(self, texts):
+        return self.executor.submit(score_texts, list(texts))
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def analyze_comments_sentiment(comment_texts):
     """
     对多条评论文本进行情绪分析，返回每条文本对应的预测情绪标签列表。
-    通过一次调用 pipeline 的批量推理来提升效率。
     """
-    results = semantic_cls(input=comment_texts, batch_size=batch_size)
-    predicted_labels = []
-    for result in results:
-        scores = result.get("scores", [])
-        labels = result.get("labels", [])
-        if not scores or not labels:
-            predicted_labels.append(None)
-        else:
-            max_index = scores.index(max(scores))
-            predicted_labels.append(labels[max_index])
-    return predicted_labels
+    return [label for label, _ in analyze_comments_scores(comment_texts)]
 
 
-def generate_sentiment_results(video_id, start_seq=0, batch_size=DEFAULT_BATCH_SIZE):
+def lookup_predictions(comment_objs):
     """
-    生成器：从数据库中批量读取评论，按批量进行情绪分析，并以 JSON 字符串的形式 yield 给前端。
+    查询一批评论已存储且未过期（文本哈希与模型版本一致）的结果。
+    返回 (文本哈希列表, {cid: 标签}, 需要推理的评论下标列表)。
+    """
+    hashes = [text_hash(com_obj.text) for com_obj in comment_objs]
+    stored = load_results(
+        [com_obj.cid for com_obj in comment_objs], hashes, RESULT_REVISION
+    )
+    pending = [
+        index for index, com_obj in enumerate(comment_objs) if com_obj.cid not in stored
+    ]
+    return hashes, stored, pending
+
+
+def save_predictions(video_id, comment_objs, hashes, stored, pending, analyzed):
+    """
+    将 pending 中评论的推理结果 analyzed 写回结果表，返回整批评论的情绪标签列表。
+    """
+    new_entries = []
+    for index, (label, confidences) in zip(pending, analyzed):
+        stored[comment_objs[index].cid] = label
+        if label is not None:
+            new_entries.append(
+                {
+                    "cid": comment_objs[index].cid,
+                    "seq": comment_objs[index].seq,
+                    "text_hash": hashes[index],
+                    "label": label,
+                    "scores": confidences,
+                }
+            )
+    save_results(video_id, new_entries, RESULT_REVISION)
+    return [stored.get(com_obj.cid) for com_obj in comment_objs]
+
+
+class AnalysisCheckpoint:
+    """
+    分析进度检查点：记录从 start_seq 起连续得到情绪结果的最后一条评论的 seq，
+    每 every 批写入一次视频的 last_analyzed_seq，结束时调用 flush 写入剩余进度。
+    某条评论没有得到结果（模型未给出标签，结果未存储）后检查点不再前进，续跑和回填时会重新分析它。
+    """
+
+    def __init__(self, video_id, start_seq, every=1):
+        self.video_id = video_id
+        self.start_seq = start_seq
+        self.every = max(1, every)
+        self.last_seq = start_seq - 1
+        self.saved_seq = start_seq - 1
+        self.blocked = False
+        self.batches = 0
+
+    def update(self, comment_objs, labels):
+        """
+        记录一批已写回结果表的评论及其情绪标签（与 save_predictions 的返回值对应）。
+        """
+        if not self.blocked:
+            for com_obj, label in zip(comment_objs, labels):
+                if label is None:
+                    self.blocked = True
+                    break
+                self.last_seq = com_obj.seq
+        self.batches += 1
+        if self.batches % self.every == 0:
+            self.flush()
+
+    def flush(self):
+        if self.last_seq > self.saved_seq:
+            advance_analyzed_seq(self.video_id, self.start_seq, self.last_seq)
+            self.saved_seq = self.last_seq
+
+
+def predict_comments_emotion(video_id, comment_objs, cancelled=None):
+    """
+    返回一批评论对应的情绪标签列表。
+    已存储且未过期的结果直接复用，只对缺失或过期的评论调用模型推理，并将新结果写回结果表。
+    """
+    hashes, stored, pending = lookup_predictions(comment_objs)
+    analyzed = []
+    if pending:
+        analyzed = analyze_comments_scores(
+            [comment_objs[index].text for index in pending], cancelled
+        )
+    return save_predictions(video_id, comment_objs, hashes, stored, pending, analyzed)
+
+
+def generate_sentiment_results(
+    video_id, start_seq=0, batch_size=DEFAULT_BATCH_SIZE, columnar=False
+):
+    """
+    生成器：从数据库中批量读取评论，按批量获取情绪分析结果，每批序列化为一个字节块 yield 给前端。
+    已分析过的评论直接从结果表读取，只有缺失或过期的评论才会重新推理。
     可通过 start_seq 参数指定从某个序号开始处理数据。
-    在处理过程中，会检查客户端是否断开连接，如果断开，则提前终止任务。
+    columnar 为 False 时每条评论一行 JSON（NDJSON），为 True 时每批输出一行列式帧，见 _columnar_frame。
+    每批处理前和等待推理期间检查客户端是否断开连接；断开后（或服务器因写入失败关闭本生成器时）
+    立即取消排队中的推理、关闭数据库游标并结束，浪费的工作计入 stream_stats。
     """
-    CommentModel = create_model(video_id)
-    insp = inspect(db.engine)
-    if CommentModel.__tablename__ not in insp.get_table_names():
-        yield json.dumps({"error": "该视频没有评论数据"}) + "\n"
+    if not video_exists(video_id):
+        yield dumps({"error": "该视频没有评论数据"}) + b"\n"
         return
 
-    # 通过过滤 seq 字段实现分页
-    query = (
-        CommentModel.query.filter(CommentModel.seq >= start_seq)
-        .order_by(CommentModel.seq)
-        .yield_per(batch_size)
-    )
+    environ = request.environ
 
-    comments_batch = []
-    comment_objs = []
-
-    for comment in query:
-        if client_disconnected():
-            return
-        comments_batch.append(comment.text)
-        comment_objs.append(comment)
-        if len(comments_batch) == batch_size:
-            predicted_emotions = analyze_comments_sentiment(
-                comments_batch, batch_size=batch_size
+    def cancelled():
+        return client_disconnected(environ)
+
+    # 通过过滤 seq 字段实现分页，服务端游标每次取回一批
+    result = db.session.execute(
+        select(Comment)
+        .where(Comment.video_id == video_id, Comment.seq >= start_seq)
+        .order_by(Comment.seq)
+        .execution_options(yield_per=batch_size)
+    ).scalars()
+    stream_stats.record(started=1)
+    metrics.active_streams.inc()
+    checkpoint = AnalysisCheckpoint(
+        video_id, start_seq, every=Config.STREAM_CHECKPOINT_BATCHES
+    )
+    # 已交给下游但客户端尚未取走的一批评论数，客户端断开时计为未送达
+    undelivered = 0
+    try:
+        for comment_objs in result.partitions(batch_size):
+            if cancelled():
+                stream_stats.record(disconnected=1)
+                return
+            started = time.perf_counter()
+            block = _format_batch(
+                video_id, checkpoint, comment_objs, columnar, cancelled
             )
-            for com_obj, emotion in zip(comment_objs, predicted_emotions):
-                result_dict = {
-                    "seq": com_obj.seq,
-                    "cid": com_obj.cid,
-                    "text": com_obj.text,
-                    "create_time": com_obj.create_time.isoformat()
-                    if com_obj.create_time
-                    else "",
-                    "reply_comment_total": com_obj.reply_comment_total,
-                    "predicted_emotion": emotion,
-                }
-                if client_disconnected():
-                    return
-                yield json.dumps(result_dict) + "\n"
-            comments_batch = []
-            comment_objs = []
-
-    if comments_batch:
-        if client_disconnected():
-            return
-        predicted_emotions = analyze_comments_sentiment(
-            comments_batch, batch_size=len(comments_batch)
-        )
-        for com_obj, emotion in zip(comment_objs, predicted_emotions):
-            result_dict = {
+            metrics.stream_batch_latency.observe(time.perf_counter() - started)
+            undelivered = len(comment_objs)
+            yield block
+            undelivered = 0
+        stream_stats.record(completed=1)
+    except GeneratorExit:
+        stream_stats.record(disconnected=1, undelivered_comments=undelivered)
+        raise
+    except InferenceCancelled:
+        stream_stats.record(disconnected=1)
+    finally:
+        metrics.active_streams.dec()
+        result.close()
+        checkpoint.flush()
+
+
+def _format_batch(video_id, checkpoint, comment_objs, columnar=False, cancelled=None):
+    """
+    获取一批评论的情绪标签并记入分析进度检查点，然后序列化为 NDJSON 行或列式帧。
+    """
+    predicted_emotions = predict_comments_emotion(video_id, comment_objs, cancelled)
+    checkpoint.update(comment_objs, predicted_emotions)
+    if columnar:
+        return dumps(_columnar_frame(comment_objs, predicted_emotions)) + b"\n"
+    return b"".join(
+        dumps(
+            {
                 "seq": com_obj.seq,
                 "cid": com_obj.cid,
                 "text": com_obj.text,
-                "create_time": com_obj.create_time.isoformat()
-                if com_obj.create_time
-                else "",
+                "create_time": com_obj.create_time,
                 "reply_comment_total": com_obj.reply_comment_total,
                 "predicted_emotion": emotion,
             }
-            if client_disconnected():
-                return
-            yield json.dumps(result_dict) + "\n"
+        )
+        + b"\n"
+        for com_obj, emotion in zip(comment_objs, predicted_emotions)
+    )
+
+
+def _columnar_frame(comment_objs, predicted_emotions):
+    """
+    列式帧：每个字段一个数组，不再逐行重复字段名。
+    create_time 为 Unix 时间戳（秒），predicted_emotion 为 labels 中的下标（无结果时为 null）。
+    """
+    labels = list(dict.fromkeys(label for label in predicted_emotions if label))
+    index = {label: position for position, label in enumerate(labels)}
+    return {
+        "seq": [com_obj.seq for com_obj in comment_objs],
+        "cid": [com_obj.cid for com_obj in comment_objs],
+        "text": [com_obj.text for com_obj in comment_objs],
+        "create_time": [
+            int(com_obj.create_time.timestamp()) for com_obj in comment_objs
+        ],
+        "reply_comment_total": [
+            com_obj.reply_comment_total for com_obj in comment_objs
+        ],
+        "labels": labels,
+        "predicted_emotion": [index.get(label) for label in predicted_emotions],
+    }
 
 
 def infer_text_single(text):
     """
     对单条文本进行情绪推理，返回所有预测的情绪标签及其对应的置信度。
-    使用全局初始化的 semantic_cls pipeline 实例进行推理。
+    文本经推理缓存查询，未命中时与其他请求合并为微批次后推理。
     """
-    results = semantic_cls(input=[text], batch_size=1)
-    if not results:
+    label, all_confidences = analyze_comments_scores([text])[0]
+    if label is None:
         return None
-
-    result = results[0]
-    scores = result.get("scores", [])
-    labels = result.get("labels", [])
-    if not scores or not labels:
-        return None
-
-    all_confidences = {label: score for label, score in zip(labels, scores)}
     return all_confidences
@@ -1,204 +1,83 @@
-import threading
 import time
 import json
-import requests
-from datetime import datetime, timezone
-from flask import Blueprint, request, jsonify, current_app, stream_with_context
-from sqlalchemy import inspect
-
-from .config import Config
-from .database import db, get_all_video
-from .comments import fetch_replies_for_comment, create_model
-from .video_info import get_video_info
+from flask import (
+    Blueprint,
+    Response,
+    g,
+    request,
+    jsonify,
+    current_app,
+    stream_with_context,
+)
+
+from . import metrics
+from .comment_query import parse_time, search_comments
+from .database import get_all_video
+from .inference_cache import inference_cache
+from .jobs import active_jobs, enqueue, job_queue_depth, request_cancel
+from .stats import get_emotion_stats
+from .streaming import encode_stream, negotiate_encoding, stream_stats
+from .tasks import TASK_HANDLERS
+from .video_info import get_video_info, get_video_infos, get_video_stats_history
+from .watchlist import get_watchlist, unwatch_video, watch_video
 from .login import login_handler
-from .pipeline import generate_sentiment_results, infer_text_single
+from .pipeline import (
+    generate_sentiment_results,
+    infer_text_single,
+    model_status,
+    scheduler,
+)
 
 bp = Blueprint("main", __name__)
 
-# ---------------------------
-# 全局任务队列及锁
-# ---------------------------
-# 任务队列保存当前正在运行的任务，分别管理 fetch_comments 和 fetch_comments_replies
-# 每个任务的结构示例：
-# {
-#    "video_id": <视频ID>,
-#    "progress": { ... },
-#    "status": "running",  # running, completed, cancelled, error
-#    "cancel_event": threading.Event 对象,
-#    "thread": <Thread对象>
-# }
-task_lock = threading.Lock()
-tasks = {
-    "fetch_comments": {},  # key 为 video_id
-    "fetch_comments_replies": {},  # key 为 video_id
-}
 
+@bp.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-# ---------------------------
-# 后台任务函数：抓取一级评论
-# ---------------------------
-def run_fetch_comments_task(video_id, task_info, app):
-    with app.app_context():
-        fetched_total = 0
-        stored_total = 0
-        cursor = 0
-        external_url = f"{Config.DOUYIN_API_BASE_URI}/fetch_video_comments"
-        CommentModel = create_model(video_id)
-        with db.engine.begin() as conn:
-            CommentModel.__table__.create(bind=conn, checkfirst=True)
-
-        while True:
-            # 检查是否收到取消信号
-            if task_info["cancel_event"].is_set():
-                task_info["status"] = "cancelled"
-                break
-
-            params = {"aweme_id": str(video_id), "cursor": cursor}
-            try:
-                # 设置合理的 timeout，防止一直阻塞
-                ext_response = requests.get(external_url, params=params, timeout=5)
-                ext_response.raise_for_status()
-            except Exception as e:
-                task_info["status"] = "error"
-                task_info["error"] = str(e)
-                break
-
-            resp_json = ext_response.json()
-            if (
-                resp_json.get("code") != 200
-                or resp_json.get("data", {}).get("status_code") != 0
-            ):
-                task_info["status"] = "error"
-                task_info["error"] = resp_json
-                break
-
-            comments_list = resp_json.get("data", {}).get("comments", [])
-            new_cursor = resp_json.get("data", {}).get("cursor")
-            has_more = resp_json.get("data", {}).get("has_more", 0)
-            if not comments_list:
-                break
-
-            fetched_total += len(comments_list)
-            insert_data = []
-            for item in comments_list:
-                cid = item.get("cid")
-                text = item.get("text")
-                create_time = item.get("create_time")
-                if cid and text and create_time:
-                    dt = datetime.fromtimestamp(create_time, tz=timezone.utc)
-                    reply_total = item.get("reply_comment_total", 0)
-                    insert_data.append(
-                        {
-                            "cid": cid,
-                            "text": text,
-                            "create_time": dt,
-                            "reply_comment_total": reply_total,
-                        }
-                    )
-
-            if insert_data:
-                cids_to_check = [d["cid"] for d in insert_data]
-                existing_rows = CommentModel.query.filter(
-                    CommentModel.cid.in_(cids_to_check)
-                ).all()
-                existing_cids = {row.cid for row in existing_rows}
-                # 更新已有记录
-                update_data = [d for d in insert_data if d["cid"] in existing_cids]
-                if update_data:
-                    try:
-                        db.session.bulk_update_mappings(CommentModel, update_data)
-                        db.session.commit()
-                    except Exception as e:
-                        db.session.rollback()
-                        task_info["status"] = "error"
-                        task_info["error"] = str(e)
-                        break
-                # 插入新记录
-                final_data = [d for d in insert_data if d["cid"] not in existing_cids]
-                if final_data:
-                    try:
-                        db.session.bulk_insert_mappings(CommentModel, final_data)
-                        db.session.commit()
-                        stored_total += len(final_data)
-                    except Exception as e:
-                        db.session.rollback()
-                        task_info["status"] = "error"
-                        task_info["error"] = str(e)
-                        break
-
-            # 更新任务进度信息
-            task_info["progress"] = {"fetched": fetched_total, "stored": stored_total}
-
-            if has_more == 1:
-                cursor = new_cursor
-            else:
-                break
-
-            # 用 cancel_event.wait 替代 time.sleep
-            # 如果在等待期间 cancel_event 被 set，则立即退出
-            if task_info["cancel_event"].wait(timeout=1):
-                task_info["status"] = "cancelled"
-                break
-
-        if task_info.get("status") == "running":
-            task_info["status"] = "completed"
-
-        # 任务结束后，从全局任务队列中移除
-        with task_lock:
-            tasks["fetch_comments"].pop(video_id, None)
 
+@bp.after_request
+def observe_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        metrics.http_requests.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint,
+            method=request.method,
+            status=response.status_code,
+        )
+    return response
 
-# ---------------------------
-# 后台任务函数：抓取二级评论（回复）
-# ---------------------------
-def run_fetch_comments_replies_task(video_id, task_info, app):
-    with app.app_context():
-        CommentModel = create_model(video_id)
-        inspector = inspect(db.engine)
-        if CommentModel.__tablename__ not in inspector.get_table_names():
-            task_info["status"] = "completed"
-            with task_lock:
-                tasks["fetch_comments_replies"].pop(video_id, None)
-            return
-
-        first_level_comments = CommentModel.query.filter(
-            CommentModel.reply_comment_total > 0
-        ).all()
-        if not first_level_comments:
-            task_info["status"] = "completed"
-            with task_lock:
-                tasks["fetch_comments_replies"].pop(video_id, None)
-            return
-
-        total_replies = 0
-        processed_comments = 0
-        for comment in first_level_comments:
-            if task_info["cancel_event"].is_set():
-                task_info["status"] = "cancelled"
-                break
-
-            replies_count = fetch_replies_for_comment(video_id, comment.cid)
-            total_replies += replies_count
-            processed_comments += 1
-
-            task_info["progress"] = {
-                "processed": processed_comments,
-                "stored": total_replies,
-            }
-            if task_info["cancel_event"].wait(timeout=1):
-                task_info["status"] = "cancelled"
-                break
-
-        if task_info.get("status") == "running":
-            task_info["status"] = "completed"
-
-        with task_lock:
-            tasks["fetch_comments_replies"].pop(video_id, None)
+
+def model_unavailable():
+    """
+    模型尚未就绪时返回 503 响应，就绪时返回 None。
+    """
+    status, error = model_status()
+    if status == "warming_up":
+        return jsonify({"error": "模型预热中，请稍后重试", "status": status}), 503
+    if status == "error":
+        return jsonify(
+            {"error": "模型加载失败", "details": error, "status": status}
+        ), 503
+    return None
 
 
 # ---------------------------
 # 普通接口（无需后台任务）
 # ---------------------------
+@bp.route("/ready", methods=["GET"])
+def ready():
+    """
+    健康检查：模型加载并完成预热后返回 200，否则返回 503 及当前状态。
+    """
+    status, error = model_status()
+    result = {"status": status}
+    if error:
+        result["error"] = error
+    return jsonify(result), 200 if status == "ready" else 503
+
+
 @bp.route("/login", methods=["POST"])
 def login():
     result, status_code = login_handler()
@@ -218,16 +97,135 @@ def video_info():
     return jsonify(result), status_code
 
 
+@bp.route("/video_info_batch", methods=["GET"])
+def video_info_batch():
+    """
+    批量获取视频信息，video_ids 为逗号分隔的视频ID列表；
+    返回 {"videos": {video_id: info}, "errors": {video_id: 错误描述}}。
+    """
+    video_ids = request.args.get("video_ids", "").split(",")
+    result, status_code = get_video_infos([video_id.strip() for video_id in video_ids])
+    return jsonify(result), status_code
+
+
+@bp.route("/video_stats_history", methods=["GET"])
+def video_stats_history():
+    video_id = request.args.get("video_id")
+    result, status_code = get_video_stats_history(video_id)
+    return jsonify(result), status_code
+
+
+@bp.route("/emotion_stats", methods=["GET"])
+def emotion_stats():
+    video_id = request.args.get("video_id")
+    bucket = request.args.get("bucket", default="hour")
+    align = request.args.get("align", default="calendar")
+    result, status_code = get_emotion_stats(video_id, bucket, align)
+    if status_code != 200:
+        return jsonify(result), status_code
+
+    # 以统计版本号作为 ETag，数据未变化时返回 304
+    if request.if_none_match.contains(result["version"]):
+        return "", 304
+    response = jsonify(result)
+    response.set_etag(result["version"])
+    return response
+
+
 @bp.route("/sentiment_pipeline", methods=["GET"])
 def sentiment_pipeline():
     video_id = request.args.get("video_id")
     start = request.args.get("start", default=0, type=int)
+    # format=columnar 时每批输出一行列式帧，字段名不再逐行重复
+    columnar = request.args.get("format") == "columnar"
     if not video_id:
         return jsonify({"error": "缺少 video_id 参数"}), 400
-    return current_app.response_class(
-        stream_with_context(generate_sentiment_results(video_id, start_seq=start)),
+    unavailable = model_unavailable()
+    if unavailable:
+        return unavailable
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding"))
+    response = current_app.response_class(
+        stream_with_context(
+            encode_stream(
+                generate_sentiment_results(
+                    video_id, start_seq=start, columnar=columnar
+                ),
+                encoding,
+            )
+        ),
         mimetype="application/x-ndjson",
     )
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+@bp.route("/search_comments", methods=["GET"])
+def search_comments_endpoint():
+    """
+    按情绪、发布时间范围、回复数下限和关键词查询评论，按 seq 键集分页：
+    将返回的 next_cursor 作为下一次请求的 after 参数，为 null 时表示没有更多结果。
+    since / until 可以是 Unix 时间戳（秒）或 ISO 8601 时间。
+    """
+    video_id = request.args.get("video_id")
+    if not video_id:
+        return jsonify({"error": "缺少 video_id 参数"}), 400
+    try:
+        since = request.args.get("since")
+        until = request.args.get("until")
+        result, status_code = search_comments(
+            video_id,
+            emotion=request.args.get("emotion") or None,
+            since=parse_time(since) if since else None,
+            until=parse_time(until) if until else None,
+            min_replies=request.args.get("min_replies", type=int),
+            keyword=(request.args.get("keyword") or "").strip() or None,
+            after=request.args.get("after", default=0, type=int),
+            limit=request.args.get("limit", type=int),
+        )
+    except ValueError as e:
+        return jsonify({"error": "参数格式错误", "details": str(e)}), 400
+    return jsonify(result), status_code
+
+
+@bp.route("/inference_cache_stats", methods=["GET"])
+def inference_cache_stats():
+    return jsonify(inference_cache.stats()), 200
+
+
+@bp.route("/stream_stats", methods=["GET"])
+def stream_stats_endpoint():
+    """
+    流式接口与推理调度器的统计：因客户端断开而提前结束的流、取消时丢弃的推理文本数，
+    以及客户端离开后仍然完成、结果被丢弃的推理文本数。
+    """
+    return jsonify(
+        {"streams": stream_stats.stats(), "inference": scheduler.stats()}
+    ), 200
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Prometheus 文本格式的指标：抓取、写入、推理各阶段的延迟直方图与计数，
+    gunicorn 多进程部署时汇总所有工作进程；后台任务队列长度按数据库中的任务行统计。
+    """
+    job_queue = {
+        "douyin_job_queue_depth": {
+            "type": "gauge",
+            "help": "排队中与运行中的后台任务数",
+            "labelnames": ["kind", "status"],
+            "samples": [
+                [[kind, status], count]
+                for (kind, status), count in job_queue_depth().items()
+            ],
+        }
+    }
+    return Response(
+        metrics.registry.render(job_queue),
+        mimetype="text/plain; version=0.0.4",
+    )
 
 
 @bp.route("/infer_text", methods=["POST"])
@@ -235,6 +233,9 @@ def infer_text():
     data = request.get_json()
     if not data or "text" not in data:
         return jsonify({"error": "缺少文本参数"}), 400
+    unavailable = model_unavailable()
+    if unavailable:
+        return unavailable
     text = data["text"]
     result = infer_text_single(text)
     if result is None:
@@ -245,43 +246,38 @@ def infer_text():
 # ---------------------------
 # 非流式任务接口（分离任务创建与取消，保证原子性）
 # ---------------------------
+def enqueue_task(kind, video_id):
+    """
+    将任务加入持久化任务队列，同一视频已有同类活动任务时返回错误。
+    """
+    job_id = enqueue(kind, video_id)
+    if job_id is None:
+        return jsonify({"error": "相同 video_id 的任务已存在"}), 400
+    return jsonify(
+        {"message": "任务已加入队列", "video_id": video_id, "job_id": job_id}
+    ), 200
+
+
+def cancel_task(kind, video_id):
+    """
+    请求取消视频的同类活动任务：排队中的任务立即取消，运行中的任务在下次心跳时停止。
+    """
+    if not request_cancel(kind, video_id):
+        return jsonify({"error": "该 video_id 的任务不存在"}), 400
+    return jsonify({"message": "任务取消请求已发送", "video_id": video_id}), 200
+
+
 @bp.route("/fetch_comments", methods=["GET"])
 def create_fetch_comments_task():
     """
     创建 fetch_comments 任务：
       - 如果相同 video_id 的任务已经存在，则返回错误
-      - 全局同时允许最多 2 个 fetch_comments 任务
+      - 所有工作进程中同时最多运行 Config.JOB_CONCURRENCY 中配置数量的任务，其余排队等待
     """
     video_id = request.args.get("video_id")
     if not video_id:
         return jsonify({"error": "缺少 video_id 参数"}), 400
-
-    with task_lock:
-        if video_id in tasks["fetch_comments"]:
-            return jsonify({"error": "相同 video_id 的任务已存在"}), 400
-
-        if len(tasks["fetch_comments"]) >= 2:
-            return jsonify(
-                {"error": "当前任务数量已满，请先取消任务或者等待任务完成"}
-            ), 400
-
-        cancel_event = threading.Event()
-        task_info = {
-            "video_id": video_id,
-            "progress": {},
-            "status": "running",
-            "cancel_event": cancel_event,
-            "thread": None,
-        }
-        app_instance = current_app._get_current_object()
-        thread = threading.Thread(
-            target=run_fetch_comments_task, args=(video_id, task_info, app_instance)
-        )
-        task_info["thread"] = thread
-        tasks["fetch_comments"][video_id] = task_info
-        thread.start()
-
-    return jsonify({"message": "任务已加入队列", "video_id": video_id}), 200
+    return enqueue_task("fetch_comments", video_id)
 
 
 @bp.route("/cancel_fetch_comments", methods=["GET"])
@@ -289,81 +285,128 @@ def cancel_fetch_comments_task():
     """
     取消 fetch_comments 任务：
       - 使用 GET 方法，通过查询参数传入 video_id
-      - 如果指定 video_id 对应的任务存在，则设置 cancel_event 标记
+      - 如果指定 video_id 对应的任务存在，则标记取消
     """
     video_id = request.args.get("video_id")
     if not video_id:
         return jsonify({"error": "缺少 video_id 参数"}), 400
+    return cancel_task("fetch_comments", video_id)
 
-    with task_lock:
-        if video_id not in tasks["fetch_comments"]:
-            return jsonify({"error": "该 video_id 的任务不存在"}), 400
-        tasks["fetch_comments"][video_id]["cancel_event"].set()
 
-    return jsonify({"message": "任务取消请求已发送", "video_id": video_id}), 200
+@bp.route("/sync_comments", methods=["GET"])
+def create_sync_comments_task():
+    """
+    创建 sync_comments 任务，增量同步视频的一级评论：
+      - 只写入新评论和内容有变化的评论，连续遇到一段已存储的旧评论后停止翻页
+      - 视频尚未完整抓取过时按 fetch_comments 的方式完整抓取
+      - 如果相同 video_id 的任务已经存在，则返回错误
+    """
+    video_id = request.args.get("video_id")
+    if not video_id:
+        return jsonify({"error": "缺少 video_id 参数"}), 400
+    return enqueue_task("sync_comments", video_id)
+
+
+@bp.route("/cancel_sync_comments", methods=["GET"])
+def cancel_sync_comments_task():
+    """
+    取消 sync_comments 任务，已写入的评论会保留。
+    """
+    video_id = request.args.get("video_id")
+    if not video_id:
+        return jsonify({"error": "缺少 video_id 参数"}), 400
+    return cancel_task("sync_comments", video_id)
+
+
+@bp.route("/watch_video", methods=["GET"])
+def watch_video_endpoint():
+    """
+    将视频加入关注列表，由调度器按其新评论速度自动安排增量同步。
+    """
+    video_id = request.args.get("video_id")
+    if not video_id:
+        return jsonify({"error": "缺少 video_id 参数"}), 400
+    if not watch_video(video_id):
+        return jsonify({"error": "该视频已在关注列表中"}), 400
+    return jsonify({"message": "已加入关注列表", "video_id": video_id}), 200
+
+
+@bp.route("/unwatch_video", methods=["GET"])
+def unwatch_video_endpoint():
+    video_id = request.args.get("video_id")
+    if not video_id:
+        return jsonify({"error": "缺少 video_id 参数"}), 400
+    if not unwatch_video(video_id):
+        return jsonify({"error": "该视频不在关注列表中"}), 400
+    return jsonify({"message": "已移出关注列表", "video_id": video_id}), 200
+
+
+@bp.route("/watchlist", methods=["GET"])
+def watchlist():
+    return jsonify({"watchlist": get_watchlist()}), 200
 
 
 @bp.route("/fetch_comments_replies", methods=["GET"])
 def fetch_comments_replies_endpoint():
     """
-    非流式抓取二级评论：
-      - 如果该 video_id 已有任务，则立即通过 cancel_event 通知取消
-      - 全局同时允许最多 1 个 fetch_comments_replies 任务
+    创建 fetch_comments_replies 任务，抓取视频所有一级评论的二级评论：
+      - 如果相同 video_id 的任务已经存在，则返回错误
+      - 超出全局并发上限的任务排队等待
     """
     video_id = request.args.get("video_id")
     if not video_id:
         return jsonify({"error": "缺少 video_id 参数"}), 400
+    return enqueue_task("fetch_comments_replies", video_id)
 
-    with task_lock:
-        if video_id in tasks["fetch_comments_replies"]:
-            tasks["fetch_comments_replies"][video_id]["cancel_event"].set()
-
-        if len(tasks["fetch_comments_replies"]) >= 1:
-            return jsonify(
-                {"message": "当前任务数量已满，请先取消任务或者等待任务完成"}
-            ), 200
-
-        cancel_event = threading.Event()
-        task_info = {
-            "video_id": video_id,
-            "progress": {},
-            "status": "running",
-            "cancel_event": cancel_event,
-            "thread": None,
-        }
-        app_instance = current_app._get_current_object()
-        thread = threading.Thread(
-            target=run_fetch_comments_replies_task,
-            args=(video_id, task_info, app_instance),
-        )
-        task_info["thread"] = thread
-        tasks["fetch_comments_replies"][video_id] = task_info
-        thread.start()
 
-    return jsonify({"message": "任务已加入队列", "video_id": video_id}), 200
+@bp.route("/analyze_video", methods=["GET"])
+def create_analyze_video_task():
+    """
+    创建 analyze_video 任务：在后台分析视频全部评论的情绪并写入结果表
+      - 从视频的分析进度（last_analyzed_seq）之后继续，已分析的评论不会重复推理
+      - 如果相同 video_id 的任务已经存在，则返回错误
+      - 超出全局并发上限的任务排队等待
+    """
+    video_id = request.args.get("video_id")
+    if not video_id:
+        return jsonify({"error": "缺少 video_id 参数"}), 400
+
+    status, error = model_status()
+    if status == "error":
+        return jsonify({"error": "模型加载失败", "details": error}), 503
+    return enqueue_task("analyze_video", video_id)
+
+
+@bp.route("/cancel_analyze_video", methods=["GET"])
+def cancel_analyze_video_task():
+    """
+    取消 analyze_video 任务，已完成的分析进度会保留，再次提交时从中断处继续。
+    """
+    video_id = request.args.get("video_id")
+    if not video_id:
+        return jsonify({"error": "缺少 video_id 参数"}), 400
+    return cancel_task("analyze_video", video_id)
 
 
 # ---------------------------
-# 接口：查询任务进度（剔除不可序列化字段）
+# 接口：查询任务进度（排队中和运行中的任务）
 # ---------------------------
 @bp.route("/task_progress", methods=["GET"])
 def task_progress():
     video_id = request.args.get("video_id")
-    result = {}
-    with task_lock:
+    result = {} if video_id else {task_type: [] for task_type in TASK_HANDLERS}
+    for job in active_jobs(video_id):
+        info = {
+            "job_id": job.id,
+            "video_id": job.video_id,
+            "progress": job.progress,
+            "status": job.status,
+            "attempts": job.attempts,
+        }
+        if job.error:
+            info["error"] = job.error
         if video_id:
-            for task_type in tasks:
-                if video_id in tasks[task_type]:
-                    info = tasks[task_type][video_id].copy()
-                    info.pop("thread", None)
-                    info.pop("cancel_event", None)
-                    result[task_type] = info
+            result[job.kind] = info
         else:
-            for task_type, task_dict in tasks.items():
-                result[task_type] = []
-                for task_info in task_dict.values():
-                    info = task_info.copy()
-                    info.pop("thread", None)
-                    info.pop("cancel_event", None)
-                    result[task_type].append(info)
+            result.setdefault(job.kind, []).append(info)
     return jsonify(result), 200
@@ -0,0 +1,122 @@
+import hashlib
+import struct
+from collections import Counter
+from sqlalchemy import func, literal_column, or_, select
+from sqlalchemy.dialects.postgresql import insert
+
+from .database import record_emotion_counts
+from .models import SentimentResult
+from .sql import db
+
+# StructBERT 七分类模型的情绪标签，scores 按此顺序存储
+EMOTION_LABELS = ("恐惧", "愤怒", "厌恶", "喜好", "悲伤", "高兴", "惊讶")
+
+# 7 个小端半精度浮点数，每条结果仅占 14 字节
+_SCORES_STRUCT = struct.Struct(f"<{len(EMOTION_LABELS)}e")
+
+
+def text_hash(text):
+    """
+    计算评论文本的哈希值，用于判断已存储的结果是否对应当前文本。
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def pack_scores(confidences):
+    """
+    将 {标签: 置信度} 字典按 EMOTION_LABELS 顺序打包为紧凑的二进制。
+    """
+    return _SCORES_STRUCT.pack(
+        *(float(confidences.get(label, 0.0)) for label in EMOTION_LABELS)
+    )
+
+
+def unpack_scores(blob):
+    """
+    将二进制得分还原为 {标签: 置信度} 字典。
+    """
+    return dict(zip(EMOTION_LABELS, _SCORES_STRUCT.unpack(blob)))
+
+
+def load_results(cids, hashes, model_revision):
+    """
+    批量读取已存储的情绪分析结果。
+    仅返回文本哈希与模型版本都与当前一致的记录，返回 {cid: label}，
+    缺失或过期的评论不会出现在结果中。
+    """
+    if not cids:
+        return {}
+
+    rows = db.session.execute(
+        select(
+            SentimentResult.cid,
+            SentimentResult.text_hash,
+            SentimentResult.label,
+        ).where(
+            SentimentResult.cid.in_(cids),
+            SentimentResult.model_revision == model_revision,
+        )
+    ).all()
+
+    expected = dict(zip(cids, hashes))
+    return {
+        row.cid: row.label for row in rows if expected.get(row.cid) == row.text_hash
+    }
+
+
+def save_results(video_id, entries, model_revision):
+    """
+    写入（或覆盖过期的）情绪分析结果，并在同一事务内更新视频摘要中的情绪分布。
+    entries 为字典列表，包含 cid、seq、text_hash、label、scores（{标签: 置信度}）。
+    已被其他请求写入最新结果的评论会被跳过，避免重复计数。
+    使用独立连接提交，避免打断调用方会话中正在进行的流式查询。
+    """
+    if not entries:
+        return
+
+    values = [
+        {
+            "cid": entry["cid"],
+            "video_id": str(video_id),
+            "seq": entry["seq"],
+            "text_hash": entry["text_hash"],
+            "model_revision": model_revision,
+            "label": entry["label"],
+            "scores": pack_scores(entry["scores"]),
+        }
+        for entry in entries
+    ]
+    stmt = insert(SentimentResult).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SentimentResult.cid],
+        set_={
+            "video_id": stmt.excluded.video_id,
+            "seq": stmt.excluded.seq,
+            "text_hash": stmt.excluded.text_hash,
+            "model_revision": stmt.excluded.model_revision,
+            "label": stmt.excluded.label,
+            "scores": stmt.excluded.scores,
+            "updated_at": func.now(),
+        },
+        where=or_(
+            SentimentResult.text_hash != stmt.excluded.text_hash,
+            SentimentResult.model_revision != stmt.excluded.model_revision,
+        ),
+    ).returning(SentimentResult.cid, literal_column("xmax = 0").label("inserted"))
+
+    new_labels = {entry["cid"]: entry["label"] for entry in entries}
+    with db.engine.begin() as conn:
+        # 锁定已有结果并记下旧标签，覆盖过期结果时需要从情绪分布中扣除
+        previous = dict(
+            conn.execute(
+                select(SentimentResult.cid, SentimentResult.label)
+                .where(SentimentResult.cid.in_(new_labels))
+                .with_for_update()
+            ).all()
+        )
+        delta = Counter()
+        for row in conn.execute(stmt):
+            delta[new_labels[row.cid]] += 1
+            if not row.inserted and row.cid in previous:
+                delta[previous[row.cid]] -= 1
+        record_emotion_counts(conn, video_id, delta)
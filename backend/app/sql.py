@@ -1,3 +1,70 @@
 from flask_sqlalchemy import SQLAlchemy
 
+from .config import Config
+
 db = SQLAlchemy()
+
+# 服务进程内除请求线程与任务工作线程外，还可能同时占用连接的后台线程：
+# 关注列表调度器、推理缓存写入线程和视频信息后台刷新（2 个线程）
+BACKGROUND_CONNECTIONS = 4
+
+# 支持的最低 PostgreSQL 版本：统计查询使用带时区参数的 date_trunc（PostgreSQL 12 起提供）
+MIN_SERVER_VERSION = (12,)
+
+
+def engine_options():
+    """
+    按服务进程内可能同时使用数据库连接的线程数设置连接池大小，Config.SQLALCHEMY_ENGINE_OPTIONS 可覆盖。
+    每个请求线程和任务工作线程常驻一条会话连接，计入 pool_size；
+    流式接口读取评论时会话连接被服务端游标占用，写入结果和推进分析进度需要再取一条独立连接，
+    分析任务同样如此，另有心跳线程的一条连接，这些短时占用计入 max_overflow，用完即关闭。
+    SQLAlchemy 默认的 5 + 10 条连接不足以支撑 SERVER_THREADS 个并发的流式请求，会等到超时报错。
+    """
+    return {
+        "pool_size": Config.SERVER_THREADS
+        + Config.JOB_WORKERS
+        + BACKGROUND_CONNECTIONS,
+        "max_overflow": Config.SERVER_THREADS + 2 * Config.JOB_WORKERS,
+    }
+
+
+def check_server_version(conn):
+    """
+    检查 PostgreSQL 服务器版本不低于 MIN_SERVER_VERSION，过低时抛出 RuntimeError。
+    """
+    version = conn.dialect.server_version_info
+    if version < MIN_SERVER_VERSION:
+        raise RuntimeError(
+            f"需要 PostgreSQL {'.'.join(map(str, MIN_SERVER_VERSION))} 或更高版本，"
+            f"当前数据库为 {'.'.join(map(str, version))}"
+        )
+
+
+def pool_limit(app):
+    """
+    返回应用连接池最多同时打开的连接数（pool_size + max_overflow）。
+    """
+    options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+    return options.get("pool_size", 5) + options.get("max_overflow", 10)
+
+
+def check_connection_limit(app, processes):
+    """
+    检查 processes 个服务进程的连接池上限之和不超过 PostgreSQL 的可用连接数
+    （max_connections 减去为超级用户保留的连接），超出时抛出 RuntimeError，返回剩余的连接数。
+    剩余连接供 worker.py、命令行工具和数据库管理使用。
+    """
+    with app.app_context(), db.engine.connect() as conn:
+        max_connections = int(conn.exec_driver_sql("SHOW max_connections").scalar())
+        reserved = int(
+            conn.exec_driver_sql("SHOW superuser_reserved_connections").scalar()
+        )
+    available = max_connections - reserved
+    needed = processes * pool_limit(app)
+    if needed > available:
+        raise RuntimeError(
+            f"{processes} 个服务进程的连接池最多需要 {needed} 条数据库连接，"
+            f"超过 PostgreSQL 可用的 {available} 条（max_connections = {max_connections}），"
+            "请调大 max_connections 或减少 SERVER_WORKERS / SERVER_THREADS / JOB_WORKERS"
+        )
+    return available - needed
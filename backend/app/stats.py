@@ -0,0 +1,148 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from sqlalchemy import select, text
+
+from .backends import result_revision
+from .config import Config
+from .models import Video
+from .sql import db
+
+# 时间粒度对应的 date_trunc 单位与秒数
+BUCKETS = {"hour": 3600, "day": 86400}
+# calendar 按自然小时/自然日分桶，publish 按视频发布后经过的时间分桶
+ALIGNS = ("calendar", "publish")
+
+# 按自然时间分桶：date_trunc 带时区参数（需要 PostgreSQL 12+，启动时检查），按 Config.STATS_TIMEZONE 的自然小时/日切分
+_CALENDAR_SQL = text(
+    """
+    SELECT date_trunc(:unit, c.create_time, :tz) AS bucket, r.label, COUNT(*) AS total
+    FROM comments c JOIN sentiment_results r ON r.cid = c.cid
+    WHERE c.video_id = :video_id AND r.model_revision = :model_revision
+    GROUP BY 1, 2
+    ORDER BY 1
+    """
+)
+
+# 按发布后经过的时间分桶：bucket 为发布后第几个小时/天（从 0 开始）
+_PUBLISH_SQL = text(
+    """
+    SELECT floor(extract(epoch FROM c.create_time - :published_at) / :step)::int AS bucket,
+        r.label, COUNT(*) AS total
+    FROM comments c JOIN sentiment_results r ON r.cid = c.cid
+    WHERE c.video_id = :video_id AND r.model_revision = :model_revision
+    GROUP BY 1, 2
+    ORDER BY 1
+    """
+)
+
+# 统计结果缓存：(video_id, bucket, align) -> (版本号, 结果)，按最近使用淘汰
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _version_token(video):
+    """
+    根据视频摘要计算统计结果的版本号。
+    写入评论或情绪分析结果时摘要会在同一事务内更新，版本号随之变化，缓存即失效。
+    """
+    parts = (
+        video.next_seq,
+        video.comment_count,
+        sorted((video.emotion_counts or {}).items()),
+        video.published_at.isoformat() if video.published_at else "",
+        result_revision(),
+    )
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _cache_get(key, version):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None or entry[0] != version:
+            return None
+        _cache.move_to_end(key)
+        return entry[1]
+
+
+def _cache_put(key, version, result):
+    with _cache_lock:
+        _cache[key] = (version, result)
+        _cache.move_to_end(key)
+        while len(_cache) > Config.STATS_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _aggregate(video, bucket, align):
+    """
+    在数据库中按时间桶和情绪标签计数，返回 (时间线, 总体分布, 总数)。
+    """
+    params = {"video_id": video.video_id, "model_revision": result_revision()}
+    if align == "publish":
+        rows = db.session.execute(
+            _PUBLISH_SQL,
+            dict(params, published_at=video.published_at, step=BUCKETS[bucket]),
+        )
+    else:
+        rows = db.session.execute(
+            _CALENDAR_SQL, dict(params, unit=bucket, tz=Config.STATS_TIMEZONE)
+        )
+
+    timeline = []
+    distribution = {}
+    total = 0
+    for row in rows:
+        key = row.bucket.isoformat() if align == "calendar" else row.bucket
+        if not timeline or timeline[-1]["bucket"] != key:
+            timeline.append({"bucket": key, "counts": {}, "total": 0})
+        timeline[-1]["counts"][row.label] = row.total
+        timeline[-1]["total"] += row.total
+        distribution[row.label] = distribution.get(row.label, 0) + row.total
+        total += row.total
+    return timeline, distribution, total
+
+
+def get_emotion_stats(video_id, bucket="hour", align="calendar"):
+    """
+    返回视频已分析评论的情绪统计：按时间桶的情绪计数时间线和总体情绪分布。
+    bucket 为时间粒度（hour 或 day）；align 为 calendar 时按自然时间分桶，
+    为 publish 时按视频发布后经过的小时/天数分桶（需要先获取过视频信息以得知发布时间）。
+    结果按视频缓存，视频摘要变化后自动重新计算。
+    """
+    if not video_id:
+        return {"error": "缺少 video_id 参数"}, 400
+    if bucket not in BUCKETS:
+        return {"error": f"bucket 参数只能为 {', '.join(BUCKETS)}"}, 400
+    if align not in ALIGNS:
+        return {"error": f"align 参数只能为 {', '.join(ALIGNS)}"}, 400
+
+    try:
+        video = db.session.execute(
+            select(Video).where(Video.video_id == str(video_id))
+        ).scalar_one_or_none()
+        if video is None:
+            return {"error": "该视频没有评论数据"}, 404
+        if align == "publish" and video.published_at is None:
+            return {"error": "视频发布时间未知，请先获取视频信息"}, 400
+
+        version = _version_token(video)
+        key = (video.video_id, bucket, align)
+        result = _cache_get(key, version)
+        if result is None:
+            timeline, distribution, total = _aggregate(video, bucket, align)
+            result = {
+                "video_id": video.video_id,
+                "bucket": bucket,
+                "align": align,
+                "published_at": video.published_at.isoformat()
+                if video.published_at
+                else "",
+                "total": total,
+                "distribution": distribution,
+                "timeline": timeline,
+                "version": version,
+            }
+            _cache_put(key, version, result)
+        return result, 200
+    except Exception as e:
+        return {"error": str(e)}, 500
@@ -0,0 +1,168 @@
+import json
+import select
+import socket
+import threading
+import time
+import zlib
+
+from .config import Config
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时退回标准库
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # 未安装 zstandard 时只支持 gzip
+    zstandard = None
+
+
+def dumps(obj):
+    """
+    将对象序列化为 JSON 字节串。优先使用 orjson，datetime 直接按 ISO 8601 输出。
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, default=_isoformat).encode("utf-8")
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+def client_disconnected(environ):
+    """
+    检查流式响应的客户端是否已断开连接。
+    wsgi.input 只反映请求体是否读完，不能说明连接状态，因此直接探测服务器放在 environ 中的连接套接字
+    （gunicorn.socket 或 werkzeug.socket）：对端关闭后套接字变为可读且 MSG_PEEK 读到 0 字节，
+    连接被重置时读取出错。拿不到套接字或无法探测（如 TLS 套接字）时视为仍然连接。
+    """
+    sock = environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        if not _readable(sock):
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except (BlockingIOError, InterruptedError, ValueError):
+        return False
+    except OSError:
+        return True
+
+
+def _readable(sock):
+    # 先确认可读再 recv，即使套接字设置了超时也不会阻塞；poll 不受 select 的描述符上限限制
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN)
+        return bool(poller.poll(0))
+    readable, _, _ = select.select([sock], [], [], 0)
+    return bool(readable)
+
+
+class StreamStats:
+    """
+    流式接口统计：开始、完整结束和因客户端断开而提前结束的流数量，
+    以及客户端断开时已处理但没有送达的评论数。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "started": 0,
+            "completed": 0,
+            "disconnected": 0,
+            "undelivered_comments": 0,
+        }
+
+    def record(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._stats[name] += value
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+# 服务进程内共享的流式接口统计
+stream_stats = StreamStats()
+
+
+def negotiate_encoding(accept_encoding):
+    """
+    根据请求的 Accept-Encoding 选择响应压缩方式：zstd（需安装 zstandard）优先，其次 gzip，
+    都不接受时返回 None。
+    """
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            quality = 1.0
+        if quality > 0:
+            accepted.add(name.strip().lower())
+    if zstandard is not None and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    """
+    流式压缩器：每个分块压缩后立即刷出，客户端收到即可解压，不必等待整个响应结束。
+    """
+
+    def __init__(self, encoding):
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(
+                level=Config.STREAM_ZSTD_LEVEL
+            ).compressobj()
+            self._flush_mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._obj = zlib.compressobj(Config.STREAM_GZIP_LEVEL, zlib.DEFLATED, 31)
+            self._flush_mode = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data):
+        return self._obj.compress(data) + self._obj.flush(self._flush_mode)
+
+    def finish(self):
+        return self._obj.flush()
+
+
+def encode_stream(blocks, encoding=None):
+    """
+    生成器：将逐批产生的字节块合并为较大的分块输出，累计达到 Config.STREAM_CHUNK_BYTES 字节
+    或距上次输出超过 Config.STREAM_FLUSH_MS 毫秒时输出一次，再按 encoding（gzip、zstd 或 None）压缩。
+    客户端断开导致服务器关闭本生成器时，同时关闭 blocks，让上游立即停止工作并释放资源。
+    """
+    compressor = _Compressor(encoding) if encoding else None
+    flush_after = Config.STREAM_FLUSH_MS / 1000
+    pending = []
+    size = 0
+    last_flush = time.monotonic()
+    try:
+        for block in blocks:
+            pending.append(block)
+            size += len(block)
+            now = time.monotonic()
+            if size < Config.STREAM_CHUNK_BYTES and now - last_flush < flush_after:
+                continue
+            chunk = b"".join(pending)
+            pending = []
+            size = 0
+            last_flush = now
+            yield compressor.compress(chunk) if compressor else chunk
+
+        chunk = b"".join(pending)
+        if compressor:
+            yield compressor.compress(chunk) + compressor.finish()
+        elif chunk:
+            yield chunk
+    finally:
+        if hasattr(blocks, "close"):
+            blocks.close()
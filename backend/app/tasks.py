@@ -0,0 +1,189 @@
+from .backfill import backfill_video_sentiment
+from .comments import reply_crawl_targets, store_comment_replies
+from .config import Config
+from .crawler import iter_comment_batches
+from .database import (
+    ensure_video,
+    get_crawl_checkpoint,
+    save_crawl_checkpoint,
+    video_exists,
+)
+from .ingest import changed_comment_rows, parse_comment_items, upsert_comments
+from .models import Video
+from .pipeline import SchedulerPool
+from .sql import db
+
+
+# ---------------------------
+# 后台任务：抓取一级评论
+# ---------------------------
+def run_fetch_comments_task(ctx):
+    video_id = ctx.video_id
+    fetched_total = 0
+    stored_total = 0
+    updated_total = 0
+    ensure_video(video_id)
+
+    # 上次抓取中断（超时、上游出错、取消）时从保存的游标继续，上次已抓取完毕则从头同步
+    checkpoint = get_crawl_checkpoint(video_id)
+    cursor = checkpoint.cursor if checkpoint is not None and checkpoint.has_more else 0
+
+    # 抓取与写库流水线并行：后台按游标预取评论页放入有界队列，
+    # 当前线程把已到达的若干页合并为一批写入数据库，并在同一事务内保存最后一页之后的游标；
+    # 上游或写库出错时异常直接抛出，由任务队列按重试策略处理
+    batches = iter_comment_batches(video_id, cursor)
+    try:
+        for pages in batches:
+            # 检查是否收到取消信号
+            if ctx.cancelled:
+                return "cancelled"
+
+            comments_list = [item for page in pages for item in page.comments]
+            fetched_total += len(comments_list)
+            rows = parse_comment_items(comments_list)
+            last_page = pages[-1]
+            inserted, updated = upsert_comments(
+                video_id,
+                rows,
+                checkpoint={
+                    "cursor": last_page.cursor,
+                    "has_more": bool(last_page.comments) and last_page.has_more == 1,
+                },
+            )
+            stored_total += inserted
+            updated_total += updated
+
+            # 更新任务进度信息
+            ctx.progress = {
+                "fetched": fetched_total,
+                "stored": stored_total,
+                "updated": updated_total,
+                "resumed_from": cursor,
+            }
+    finally:
+        batches.close()
+    return "completed"
+
+
+# ---------------------------
+# 后台任务：增量同步一级评论
+# ---------------------------
+def run_sync_comments_task(ctx):
+    video_id = ctx.video_id
+    ensure_video(video_id)
+
+    # 还没有完整抓取过（或上次抓取中断）时没有可靠的高水位，退回可续跑的完整抓取
+    checkpoint = get_crawl_checkpoint(video_id)
+    if checkpoint is None or checkpoint.has_more or checkpoint.high_water_mark is None:
+        return run_fetch_comments_task(ctx)
+    high_water_mark = checkpoint.high_water_mark
+
+    fetched_total = 0
+    stored_total = 0
+    updated_total = 0
+    # 连续遇到的已存储且不晚于高水位的评论数，达到 Config.SYNC_STOP_AFTER_KNOWN 即停止翻页
+    known_run = 0
+    cursor = 0
+    batches = iter_comment_batches(video_id)
+    try:
+        for pages in batches:
+            if ctx.cancelled:
+                return "cancelled"
+
+            comments_list = [item for page in pages for item in page.comments]
+            fetched_total += len(comments_list)
+            rows = parse_comment_items(comments_list)
+            # 只写入新评论和内容有变化的评论
+            changed, stored_cids = changed_comment_rows(video_id, rows)
+            for row in rows:
+                if row["cid"] in stored_cids and row["create_time"] <= high_water_mark:
+                    known_run += 1
+                else:
+                    known_run = 0
+            inserted, updated = upsert_comments(video_id, changed)
+            stored_total += inserted
+            updated_total += updated
+            cursor = pages[-1].cursor
+
+            ctx.progress = {
+                "fetched": fetched_total,
+                "stored": stored_total,
+                "updated": updated_total,
+                "skipped": fetched_total - stored_total - updated_total,
+            }
+            if known_run >= Config.SYNC_STOP_AFTER_KNOWN:
+                break
+    finally:
+        batches.close()
+
+    # 同步完成后推进高水位，断点保持“已抓取完毕”
+    save_crawl_checkpoint(video_id, cursor, has_more=False)
+    db.session.commit()
+    return "completed"
+
+
+# ---------------------------
+# 后台任务：抓取二级评论（回复）
+# ---------------------------
+def run_fetch_comments_replies_task(ctx):
+    video_id = ctx.video_id
+    if not video_exists(video_id):
+        return "completed"
+
+    # 跳过已抓取完毕且回复数未变化的一级评论，中断过的从断点继续
+    targets = reply_crawl_targets(video_id)
+    if not targets:
+        return "completed"
+
+    # 多条一级评论的回复并发抓取，每处理完一条更新一次进度并检查取消信号
+    replies = store_comment_replies(video_id, targets)
+    try:
+        for progress in replies:
+            ctx.progress = progress
+            if ctx.cancelled:
+                return "cancelled"
+    finally:
+        replies.close()
+    return "completed"
+
+
+# ---------------------------
+# 后台任务：分析视频全部评论的情绪
+# ---------------------------
+def run_analyze_video_task(ctx):
+    video_id = ctx.video_id
+    video = db.session.get(Video, video_id)
+    if video is None:
+        return "completed"
+
+    # 从视频已持久化的分析进度 last_analyzed_seq 之后继续，取消、重启或重试后都能续跑
+    total_seq = video.next_seq - 1
+    ctx.progress = {
+        "analyzed": 0,
+        "inferred": 0,
+        "cached": 0,
+        "last_seq": video.last_analyzed_seq,
+        "total_seq": total_seq,
+        "rate": 0.0,
+    }
+    with SchedulerPool() as pool:
+        analysis = backfill_video_sentiment(
+            video_id, pool, chunk_size=Config.ANALYZE_CHUNK_SIZE
+        )
+        try:
+            for progress in analysis:
+                ctx.progress = dict(progress, total_seq=total_seq)
+                if ctx.cancelled:
+                    return "cancelled"
+        finally:
+            analysis.close()
+    return "completed"
+
+
+# 任务类型及其处理函数，工作线程按此顺序认领任务
+TASK_HANDLERS = {
+    "fetch_comments": run_fetch_comments_task,
+    "sync_comments": run_sync_comments_task,
+    "fetch_comments_replies": run_fetch_comments_replies_task,
+    "analyze_video": run_analyze_video_task,
+}
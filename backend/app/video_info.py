@@ -1,12 +1,277 @@
-import requests
-import datetime
-from datetime import timezone
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from . import metrics
 from .config import Config
+from .crawler import fetch_video_details
+from .database import record_published_at
+from .models import VideoMeta, VideoStatsSnapshot
+from .sql import db
+
+
+def parse_video_detail(video_id, detail):
+    """
+    将接口返回的 aweme_detail 整理为视频信息，包括基本属性和统计数据。
+    """
+    video_id = detail.get("aweme_id", video_id)
+    description = detail.get("desc", "")
+    create_time_ts = detail.get("create_time", 0)
+    try:
+        dt = datetime.fromtimestamp(create_time_ts, tz=timezone.utc)
+        create_time_iso = dt.isoformat()
+    except Exception:
+        create_time_iso = ""
+
+    # 处理时长：如果 duration 大于 1000，则认为单位为毫秒，否则为秒
+    duration_raw = detail.get("duration", 0)
+    if duration_raw > 1000:
+        duration_sec = round(duration_raw / 1000)
+    else:
+        duration_sec = duration_raw
+
+    stats_raw = detail.get("statistics", {})
+    stats = {
+        "play_count": stats_raw.get("play_count", 0),
+        "like_count": stats_raw.get("digg_count", 0),
+        "comment_count": stats_raw.get("comment_count", 0),
+        "share_count": stats_raw.get("share_count", 0),
+        "favorite_count": stats_raw.get("collect_count", 0),
+    }
+
+    video_info = detail.get("video", {})
+    cover_info = video_info.get("cover", {})
+    cover_url_list = cover_info.get("url_list", [])
+    # 如果有数据，就取第一个作为封面地址，否则为空字符串
+    cover_url = cover_url_list[0] if cover_url_list else ""
+
+    return {
+        "video_id": video_id,
+        "description": description,
+        "create_time": create_time_iso,
+        "duration": duration_sec,
+        "cover_url": cover_url,
+        "stats": stats,
+    }
+
+
+class VideoInfoCache:
+    """
+    视频信息缓存：先查内存 LRU（最多 Config.VIDEO_INFO_CACHE_SIZE 条），再查持久化的 video_meta 表。
+    获取时间在 Config.VIDEO_INFO_TTL 秒内的直接返回；超过 TTL 但未超过 Config.VIDEO_INFO_STALE_TTL 的
+    先返回旧数据，同时在后台刷新；其余视频通过抓取引擎并发请求上游。
+    同一视频同时只有一个上游请求在途，并发的调用方等待在途请求的结果，不会重复请求上游。
+    每次从上游获取成功都会写回两级缓存，并在 video_stats_history 中追加一条统计数据快照。
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        # 正在从上游获取的视频 {video_id: Future}，结果为 (视频信息, 错误描述)
+        self._fetching = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="video-info-refresh"
+        )
+
+    def get_many(self, video_ids):
+        """
+        获取多个视频的信息，需在应用上下文中调用。
+        返回 (视频信息 {video_id: info}, 错误信息 {video_id: 描述})。
+        """
+        video_ids = list(dict.fromkeys(str(video_id) for video_id in video_ids))
+        now = time.time()
+        entries = self._lookup(video_ids)
+
+        infos = {}
+        stale = []
+        missing = []
+        for video_id in video_ids:
+            entry = entries.get(video_id)
+            age = now - entry[1] if entry is not None else None
+            if age is not None and age <= Config.VIDEO_INFO_TTL:
+                infos[video_id] = entry[0]
+            elif age is not None and age <= Config.VIDEO_INFO_STALE_TTL:
+                infos[video_id] = entry[0]
+                stale.append(video_id)
+            else:
+                missing.append(video_id)
+        metrics.video_info_lookups.inc(len(infos) - len(stale), result="fresh")
+        metrics.video_info_lookups.inc(len(stale), result="stale")
+        metrics.video_info_lookups.inc(len(missing), result="miss")
+
+        errors = {}
+        if missing:
+            fetched, errors = self._fetch_shared(missing)
+            infos.update(fetched)
+            # 上游失败时退回过旧的缓存数据，总比没有好
+            for video_id in list(errors):
+                if video_id in entries:
+                    infos[video_id] = entries[video_id][0]
+                    del errors[video_id]
+        if stale:
+            self._refresh_in_background(stale)
+        return infos, errors
+
+    def _lookup(self, video_ids):
+        # 返回 {video_id: (info, 获取时间戳)}
+        entries = {}
+        with self._lock:
+            for video_id in video_ids:
+                entry = self._entries.get(video_id)
+                if entry is not None:
+                    self._entries.move_to_end(video_id)
+                    entries[video_id] = entry
+
+        table_ids = [video_id for video_id in video_ids if video_id not in entries]
+        if table_ids:
+            rows = db.session.execute(
+                select(VideoMeta).where(VideoMeta.video_id.in_(table_ids))
+            ).scalars()
+            for row in rows:
+                entry = (row.info, row.fetched_at.timestamp())
+                entries[row.video_id] = entry
+                self._remember(row.video_id, entry)
+        return entries
+
+    def _fetch_shared(self, video_ids):
+        """
+        从上游获取视频信息；其他调用方正在获取的视频不再重复请求，等待其结果。
+        """
+        owned = {}
+        waiting = {}
+        with self._lock:
+            for video_id in video_ids:
+                future = self._fetching.get(video_id)
+                if future is None:
+                    future = owned[video_id] = Future()
+                    self._fetching[video_id] = future
+                else:
+                    waiting[video_id] = future
+
+        infos = {}
+        errors = {}
+        try:
+            if owned:
+                infos, errors = self._fetch(list(owned))
+                for video_id, future in owned.items():
+                    future.set_result((infos.get(video_id), errors.get(video_id)))
+        except Exception as e:
+            for future in owned.values():
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                for video_id in owned:
+                    self._fetching.pop(video_id, None)
+
+        for video_id, future in waiting.items():
+            try:
+                info, error = future.result()
+            except Exception as e:
+                info, error = None, str(e) or type(e).__name__
+            if info is not None:
+                infos[video_id] = info
+            else:
+                errors[video_id] = error
+        return infos, errors
+
+    def _fetch(self, video_ids):
+        infos = {}
+        errors = {}
+        published = {}
+        fetched_at = datetime.now(timezone.utc)
+        for video_id, detail in zip(video_ids, fetch_video_details(video_ids)):
+            if isinstance(detail, Exception):
+                errors[video_id] = str(detail) or type(detail).__name__
+                continue
+            infos[video_id] = parse_video_detail(video_id, detail)
+            # 记录发布时间，供按发布后经过时间统计情绪使用
+            create_time_ts = detail.get("create_time", 0)
+            if create_time_ts:
+                published[video_id] = datetime.fromtimestamp(
+                    create_time_ts, tz=timezone.utc
+                )
+        if infos:
+            self._store(infos, published, fetched_at)
+        return infos, errors
+
+    def _store(self, infos, published, fetched_at):
+        # 视频信息、统计快照与发布时间在同一事务中写入
+        stmt = insert(VideoMeta).values(
+            [
+                {"video_id": video_id, "info": info, "fetched_at": fetched_at}
+                for video_id, info in infos.items()
+            ]
+        )
+        db.session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[VideoMeta.video_id],
+                set_={
+                    "info": stmt.excluded.info,
+                    "fetched_at": stmt.excluded.fetched_at,
+                },
+            )
+        )
+        db.session.execute(
+            insert(VideoStatsSnapshot)
+            .values(
+                [
+                    dict(info["stats"], video_id=video_id, captured_at=fetched_at)
+                    for video_id, info in infos.items()
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+        record_published_at(published)
+        db.session.commit()
+        for video_id, info in infos.items():
+            self._remember(video_id, (info, fetched_at.timestamp()))
+
+    def _refresh_in_background(self, video_ids):
+        with self._lock:
+            video_ids = [
+                video_id for video_id in video_ids if video_id not in self._refreshing
+            ]
+            self._refreshing.update(video_ids)
+        if video_ids:
+            app = current_app._get_current_object()
+            self._executor.submit(self._refresh, app, video_ids)
+
+    def _refresh(self, app, video_ids):
+        with app.app_context():
+            try:
+                _, errors = self._fetch(video_ids)
+                for video_id, error in errors.items():
+                    print(f"刷新视频 {video_id} 信息失败：{error}")
+            except Exception as e:
+                db.session.rollback()
+                print(f"刷新视频信息失败：{e}")
+            finally:
+                with self._lock:
+                    self._refreshing.difference_update(video_ids)
+                db.session.remove()
+
+    def _remember(self, video_id, entry):
+        with self._lock:
+            self._entries[video_id] = entry
+            self._entries.move_to_end(video_id)
+            while len(self._entries) > Config.VIDEO_INFO_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+
+# 服务进程内共享的视频信息缓存
+video_info_cache = VideoInfoCache()
 
 
 def get_video_info(video_id):
     """
-    根据视频ID获取视频信息，包括基本属性和统计数据。
+    根据视频ID获取视频信息，包括基本属性和统计数据，优先使用缓存。
 
     参数:
         video_id (str): 视频的唯一标识符（aweme_id）
@@ -16,59 +281,58 @@ def get_video_info(video_id):
     if not video_id:
         return {"error": "video_id is required"}, 400
 
-    external_url = f"{Config.DOUYIN_API_BASE_URI}/fetch_one_video"
-    params = {"aweme_id": video_id}
     try:
-        response = requests.get(external_url, params=params)
-        if response.status_code != 200:
-            return {
-                "error": "Failed to fetch video info from douyin api"
-            }, response.status_code
-
-        data = response.json()
+        infos, errors = video_info_cache.get_many([video_id])
+    except Exception as e:
+        return {"error": str(e)}, 500
+    if str(video_id) in errors:
+        return {"error": errors[str(video_id)]}, 500
+    return infos[str(video_id)], 200
 
-        detail = data.get("data", {}).get("aweme_detail", {})
 
-        video_id = detail.get("aweme_id", video_id)
-        description = detail.get("desc", "")
-        create_time_ts = detail.get("create_time", 0)
-        try:
-            dt = datetime.fromtimestamp(create_time_ts, tz=timezone.utc)
-            create_time_iso = dt.isoformat()
-        except Exception:
-            create_time_iso = ""
-
-        # 处理时长：如果 duration 大于 1000，则认为单位为毫秒，否则为秒
-        duration_raw = detail.get("duration", 0)
-        if duration_raw > 1000:
-            duration_sec = round(duration_raw / 1000)
-        else:
-            duration_sec = duration_raw
-
-        stats_raw = detail.get("statistics", {})
-        stats = {
-            "play_count": stats_raw.get("play_count", 0),
-            "like_count": stats_raw.get("digg_count", 0),
-            "comment_count": stats_raw.get("comment_count", 0),
-            "share_count": stats_raw.get("share_count", 0),
-            "favorite_count": stats_raw.get("collect_count", 0),
-        }
+def get_video_infos(video_ids):
+    """
+    批量获取视频信息，缓存未命中的视频并发请求上游。
 
-        video_info = detail.get("video", {})
-        cover_info = video_info.get("cover", {})
-        cover_url_list = cover_info.get("url_list", [])
-        # 如果有数据，就取第一个作为封面地址，否则为空字符串
-        cover_url = cover_url_list[0] if cover_url_list else ""
-
-        result = {
-            "video_id": video_id,
-            "description": description,
-            "create_time": create_time_iso,
-            "duration": duration_sec,
-            "cover_url": cover_url,
-            "stats": stats,
-        }
-        return result, 200
+    返回:
+        tuple: ({"videos": {video_id: info}, "errors": {video_id: 错误描述}}, status_code)
+    """
+    video_ids = [video_id for video_id in video_ids if video_id]
+    if not video_ids:
+        return {"error": "video_ids is required"}, 400
+    if len(video_ids) > Config.VIDEO_INFO_BATCH_MAX:
+        return {"error": f"单次最多查询 {Config.VIDEO_INFO_BATCH_MAX} 个视频"}, 400
 
+    try:
+        infos, errors = video_info_cache.get_many(video_ids)
     except Exception as e:
         return {"error": str(e)}, 500
+    return {"videos": infos, "errors": errors}, 200
+
+
+def get_video_stats_history(video_id, limit=500):
+    """
+    返回视频统计数据的历史快照，按时间先后排列，最多最近 limit 条。
+    """
+    if not video_id:
+        return {"error": "video_id is required"}, 400
+
+    rows = db.session.execute(
+        select(VideoStatsSnapshot)
+        .where(VideoStatsSnapshot.video_id == str(video_id))
+        .order_by(VideoStatsSnapshot.captured_at.desc())
+        .limit(limit)
+    ).scalars()
+    history = [
+        {
+            "captured_at": row.captured_at.isoformat(),
+            "play_count": row.play_count,
+            "like_count": row.like_count,
+            "comment_count": row.comment_count,
+            "share_count": row.share_count,
+            "favorite_count": row.favorite_count,
+        }
+        for row in rows
+    ]
+    history.reverse()
+    return {"video_id": video_id, "history": history}, 200
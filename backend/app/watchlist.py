@@ -0,0 +1,233 @@
+import heapq
+import math
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from .comments import reply_crawl_targets
+from .config import Config
+from .jobs import ACTIVE_STATUSES, enqueue, stop_event
+from .models import Job, WatchBudget, WatchedVideo
+from .sql import db
+
+
+def watch_video(video_id):
+    """
+    将视频加入关注列表并尽快安排一次同步，返回是否为新加入。
+    """
+    stmt = (
+        insert(WatchedVideo)
+        .values(video_id=str(video_id))
+        .on_conflict_do_nothing(index_elements=[WatchedVideo.video_id])
+        .returning(WatchedVideo.video_id)
+    )
+    created = db.session.execute(stmt).first() is not None
+    db.session.commit()
+    return created
+
+
+def unwatch_video(video_id):
+    """
+    将视频移出关注列表，返回视频是否在列表中；已提交的同步任务不受影响。
+    """
+    result = db.session.execute(
+        delete(WatchedVideo).where(WatchedVideo.video_id == str(video_id))
+    )
+    db.session.commit()
+    return result.rowcount > 0
+
+
+def get_watchlist():
+    """
+    返回关注列表中各视频的新评论速度估计与同步时间。
+    """
+    videos = db.session.execute(
+        select(WatchedVideo).order_by(WatchedVideo.next_sync_at)
+    ).scalars()
+    return [
+        {
+            "video_id": video.video_id,
+            "velocity": video.velocity,
+            "last_new_comments": video.last_new_comments,
+            "last_synced_at": video.last_synced_at.isoformat()
+            if video.last_synced_at
+            else "",
+            "next_sync_at": video.next_sync_at.isoformat(),
+            "syncing": video.sync_job_id is not None,
+        }
+        for video in videos
+    ]
+
+
+def sync_interval(velocity):
+    """
+    按新评论速度（条/小时）计算下次同步的间隔：每次同步大约抓到 Config.WATCH_TARGET_NEW_COMMENTS 条新评论，
+    结果限制在 [Config.WATCH_MIN_INTERVAL, Config.WATCH_MAX_INTERVAL] 秒之间。
+    尚无速度估计时取最短间隔，以便尽快得到第二次测量。
+    """
+    if velocity is None:
+        return Config.WATCH_MIN_INTERVAL
+    if velocity <= 0:
+        return Config.WATCH_MAX_INTERVAL
+    seconds = Config.WATCH_TARGET_NEW_COMMENTS / velocity * 3600
+    return min(max(seconds, Config.WATCH_MIN_INTERVAL), Config.WATCH_MAX_INTERVAL)
+
+
+def estimate_pages(new_comments):
+    """
+    估计一次增量同步消耗的上游请求页数：新评论所在的页，加上确认已无新评论所需翻过的页。
+    """
+    return math.ceil(
+        (new_comments + Config.SYNC_STOP_AFTER_KNOWN) / Config.WATCH_PAGE_SIZE
+    )
+
+
+class WatchScheduler(threading.Thread):
+    """
+    关注列表的自适应同步调度器。每隔 Config.WATCH_TICK_SECONDS：
+      1. 收集已结束的同步任务，用本次抓到的新评论数更新视频的新评论速度并安排下次同步时间；
+         有一级评论回复数增长时，再提交只抓取这些评论回复的 fetch_comments_replies 任务；
+      2. 将到期的视频放入按预计新评论数排序的优先队列，在每小时 Config.WATCH_REQUEST_BUDGET 页的
+         请求预算（令牌桶）内依次提交 sync_comments 任务，预算不足的视频留到下一周期。
+    每个服务进程和 worker.py 都会运行调度器，各周期在事务级咨询锁内串行执行；
+    令牌桶（watch_budget 表）与已提交任务的预计页数（watchlist.sync_estimate）都保存在数据库中，
+    所有进程共用同一份预算，任务结束后由任一进程按实际页数修正。
+    """
+
+    def __init__(self, app, stop_event):
+        super().__init__(name="watch-scheduler", daemon=True)
+        self.app = app
+        self.stop_event = stop_event
+
+    def run(self):
+        with self.app.app_context():
+            while not self.stop_event.wait(Config.WATCH_TICK_SECONDS):
+                try:
+                    self.tick()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"关注列表调度失败：{e}")
+                finally:
+                    db.session.remove()
+
+    def tick(self):
+        locked = db.session.execute(
+            select(func.pg_try_advisory_xact_lock(func.hashtext("watchlist")))
+        ).scalar()
+        if not locked:
+            db.session.rollback()
+            return
+        now = datetime.now(timezone.utc)
+        budget = self._refill(now)
+        self._collect(now, budget)
+        self._dispatch(now, budget)
+        db.session.commit()
+
+    def _refill(self, now):
+        # 按距上次补充的时间补充令牌，首次运行时预算为满额
+        budget = db.session.get(WatchBudget, 1)
+        if budget is None:
+            budget = WatchBudget(
+                id=1, tokens=Config.WATCH_REQUEST_BUDGET, refilled_at=now
+            )
+            db.session.add(budget)
+            return budget
+        elapsed = max((now - budget.refilled_at).total_seconds(), 0)
+        budget.tokens = min(
+            Config.WATCH_REQUEST_BUDGET,
+            budget.tokens + elapsed / 3600 * Config.WATCH_REQUEST_BUDGET,
+        )
+        budget.refilled_at = now
+        return budget
+
+    def _collect(self, now, budget):
+        finished = db.session.execute(
+            select(WatchedVideo, Job)
+            .join(Job, Job.id == WatchedVideo.sync_job_id)
+            .where(Job.status.notin_(ACTIVE_STATUSES))
+        ).all()
+        for watched, job in finished:
+            estimate = watched.sync_estimate
+            watched.sync_job_id = None
+            watched.sync_estimate = None
+            if job.status != "completed":
+                watched.next_sync_at = now + timedelta(
+                    seconds=Config.WATCH_MIN_INTERVAL
+                )
+                continue
+
+            progress = job.progress or {}
+            if estimate is not None:
+                pages = math.ceil(progress.get("fetched", 0) / Config.WATCH_PAGE_SIZE)
+                budget.tokens -= max(pages, 1) - estimate
+
+            new_comments = progress.get("stored", 0)
+            finished_at = job.finished_at or now
+            if watched.last_synced_at is not None:
+                hours = (finished_at - watched.last_synced_at).total_seconds() / 3600
+                rate = new_comments / max(hours, 1 / 60)
+                alpha = Config.WATCH_VELOCITY_ALPHA
+                watched.velocity = (
+                    rate
+                    if watched.velocity is None
+                    else alpha * rate + (1 - alpha) * watched.velocity
+                )
+            watched.last_new_comments = new_comments
+            watched.last_synced_at = finished_at
+            watched.next_sync_at = finished_at + timedelta(
+                seconds=sync_interval(watched.velocity)
+            )
+
+            # 只有回复数发生变化的一级评论才需要抓取回复
+            if reply_crawl_targets(watched.video_id):
+                enqueue("fetch_comments_replies", watched.video_id, commit=False)
+
+    def _dispatch(self, now, budget):
+        due = db.session.execute(
+            select(WatchedVideo).where(
+                WatchedVideo.sync_job_id.is_(None), WatchedVideo.next_sync_at <= now
+            )
+        ).scalars()
+        # 优先级：距上次同步以来预计新增的评论数，从未同步过的视频最优先
+        queue = []
+        for watched in due:
+            if watched.last_synced_at is None:
+                expected = math.inf
+            else:
+                hours = (now - watched.last_synced_at).total_seconds() / 3600
+                velocity = watched.velocity
+                if velocity is None:
+                    velocity = Config.WATCH_TARGET_NEW_COMMENTS
+                expected = velocity * hours
+            heapq.heappush(queue, (-expected, watched.video_id, watched))
+
+        while queue:
+            negative_expected, _, watched = queue[0]
+            expected = -negative_expected
+            if math.isinf(expected):
+                expected = Config.WATCH_TARGET_NEW_COMMENTS
+            # 单次同步的预计页数不超过预算上限，保证任何视频最终都能被调度
+            cost = min(estimate_pages(expected), Config.WATCH_REQUEST_BUDGET)
+            if budget.tokens < cost:
+                break
+            heapq.heappop(queue)
+            job_id = enqueue("sync_comments", watched.video_id, commit=False)
+            if job_id is None:
+                # 已有手动提交的同步任务，等其结束后再安排
+                watched.next_sync_at = now + timedelta(
+                    seconds=Config.WATCH_MIN_INTERVAL
+                )
+                continue
+            watched.sync_job_id = job_id
+            watched.sync_estimate = cost
+            budget.tokens -= cost
+
+
+def start_watch_scheduler(app):
+    """
+    启动关注列表调度线程，与任务工作线程共用停止信号。
+    """
+    scheduler = WatchScheduler(app, stop_event)
+    scheduler.start()
+    return scheduler
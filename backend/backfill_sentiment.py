@@ -0,0 +1,67 @@
+"""
+使用多进程推理池批量回填视频评论的情绪分析结果。
+
+用法：
+    python3 backfill_sentiment.py 7312345678901234567            # 从上次分析进度继续
+    python3 backfill_sentiment.py --all --workers 8 --threads 4   # 回填全部视频
+    python3 backfill_sentiment.py 7312345678901234567 --restart   # 从头检查全部评论
+
+工作进程数与每个进程的推理线程数默认取 Config.INFER_POOL_WORKERS 与 Config.INFER_POOL_THREADS，
+两者的乘积一般取机器的物理核数。已存储且未过期的结果不会重复推理。
+"""
+
+import argparse
+
+from sqlalchemy import select
+
+from app import create_app
+from app.backfill import backfill_video_sentiment
+from app.inference_cache import inference_cache
+from app.inference_pool import InferencePool
+from app.models import Video
+from app.sql import db
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程批量回填评论情绪分析结果")
+    parser.add_argument("video_ids", nargs="*", help="需要回填的视频ID")
+    parser.add_argument("--all", action="store_true", help="回填全部已登记的视频")
+    parser.add_argument("--workers", type=int, help="工作进程数")
+    parser.add_argument("--threads", type=int, help="每个工作进程的推理线程数")
+    parser.add_argument(
+        "--restart", action="store_true", help="忽略分析进度，从第一条评论开始检查"
+    )
+    args = parser.parse_args()
+
+    app = create_app(background=False)
+    with app.app_context():
+        video_ids = args.video_ids
+        if args.all:
+            video_ids = list(
+                db.session.execute(
+                    select(Video.video_id).order_by(Video.created_at)
+                ).scalars()
+            )
+        if not video_ids:
+            parser.error("请指定视频ID或使用 --all")
+
+        with InferencePool(args.workers, args.threads) as pool:
+            print(f"推理池：{pool.workers} 个进程 × {pool.threads} 个线程")
+            for video_id in video_ids:
+                progress = None
+                for progress in backfill_video_sentiment(
+                    video_id, pool, start_seq=0 if args.restart else None
+                ):
+                    print(
+                        f"{video_id}: 已处理 {progress['analyzed']} 条，"
+                        f"推理 {progress['inferred']} 条，缓存命中 {progress['cached']} 条，"
+                        f"seq {progress['last_seq']}，{progress['rate']:.1f} 条/秒"
+                    )
+                if progress is None:
+                    print(f"{video_id}: 没有需要回填的评论")
+        # 等待推理缓存的后台写入完成再退出
+        inference_cache.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+"""
+离线性能基准：用本地的抖音接口替身和随机初始化的小模型驱动真实的抓取任务、评论写入、
+情感分析流式管道和 /infer_text，输出可跨提交对比的 JSON 结果。
+
+用法（在 backend 目录下运行）：
+    python3 -m bench --output before.json
+    python3 -m bench --scenarios crawl,replies --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+    python3 -m bench.compare before.json after.json
+"""
@@ -0,0 +1,50 @@
+"""
+对比两次基准测试的结果 JSON，逐项列出数值指标及其变化。
+
+用法：
+    python3 -m bench.compare before.json after.json
+"""
+
+import json
+import sys
+
+
+def flatten(results, prefix=""):
+    """
+    将嵌套的结果展开为 {"场景.指标": 数值}，只保留数值型指标。
+    """
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        raise SystemExit("用法：python3 -m bench.compare before.json after.json")
+    reports = []
+    for path in argv:
+        with open(path, encoding="utf-8") as f:
+            reports.append(json.load(f))
+    before, after = (flatten(report["results"]) for report in reports)
+
+    print(f"{'metric':<40}{'before':>14}{'after':>14}{'change':>10}")
+    print(
+        f"{'commit':<40}{str(reports[0].get('commit')):>14}{str(reports[1].get('commit')):>14}"
+    )
+    for name in sorted(before.keys() | after.keys()):
+        old = before.get(name)
+        new = after.get(name)
+        change = ""
+        if old and new is not None:
+            change = f"{(new - old) / old * 100:+.1f}%"
+        print(f"{name:<40}{str(old):>14}{str(new):>14}{change:>10}")
+
+
+if __name__ == "__main__":
+    main()
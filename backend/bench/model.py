@@ -0,0 +1,40 @@
+import numpy as np
+
+from app.sentiment_store import EMOTION_LABELS
+
+
+class TinyClassifier:
+    """
+    随机初始化的小型文本分类器，作为基准测试中的替身模型。
+    接口与推理后端相同：输入文本列表，输出等长的 {"labels", "scores"} 列表。
+    按字符查嵌入、经一层前馈后对有效位置取平均再分类，计算量随批大小和批内最长文本增长，
+    与真实模型一样受填充长度影响，但不依赖模型文件和 PyTorch。
+    """
+
+    def __init__(self, vocab_size=8192, dim=128, max_length=512, seed=0):
+        rng = np.random.default_rng(seed)
+        self.vocab_size = vocab_size
+        self.max_length = max_length
+        self.embeddings = rng.standard_normal((vocab_size, dim), dtype=np.float32)
+        self.hidden = rng.standard_normal((dim, dim), dtype=np.float32) / np.sqrt(dim)
+        self.output = rng.standard_normal(
+            (dim, len(EMOTION_LABELS)), dtype=np.float32
+        ) / np.sqrt(dim)
+
+    def __call__(self, texts):
+        texts = [text[: self.max_length] for text in texts]
+        width = max((len(text) for text in texts), default=0) or 1
+        ids = np.zeros((len(texts), width), dtype=np.int64)
+        mask = np.zeros((len(texts), width, 1), dtype=np.float32)
+        for row, text in enumerate(texts):
+            ids[row, : len(text)] = [ord(char) % self.vocab_size for char in text]
+            mask[row, : len(text)] = 1
+
+        states = np.tanh(self.embeddings[ids] @ self.hidden)
+        pooled = (states * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
+        logits = pooled @ self.output
+        exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+        probs = exp / exp.sum(axis=1, keepdims=True)
+        return [
+            {"labels": list(EMOTION_LABELS), "scores": row.tolist()} for row in probs
+        ]
@@ -0,0 +1,205 @@
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+# 合成评论使用的字符，以及重复出现的常见短评论
+_CHARS = "的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会家可下而过天去能对小多然于心学么之都好看起发当没成只如事把还用第样道想作种开美总从无情己面最女但现前些所同日手又行意动方期它头经长儿回位分爱老因很给名法间斯知世什两次使身者被高已亲其进此话常与活正感"
+_COMMON_TEXTS = [
+    "哈哈哈",
+    "好看",
+    "太真实了",
+    "笑死我了",
+    "支持",
+    "666",
+    "来了来了",
+    "[赞]",
+]
+
+
+@dataclass
+class StubSettings:
+    """
+    接口替身的参数：每个视频的一级评论数、每页条数、带回复的一级评论间隔与回复数，
+    每次请求的延迟（毫秒，在 ±jitter_ms 内均匀抖动）、出错概率、重复常见评论的比例和随机种子。
+    """
+
+    comments: int = 5000
+    page_size: int = 20
+    reply_every: int = 10
+    replies: int = 30
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    duplicate_rate: float = 0.1
+    seed: int = 0
+
+
+class SyntheticComments:
+    """
+    按视频ID和序号确定性地生成评论，同一参数下每次运行得到相同分布的数据。
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def text(self, rng):
+        """
+        生成一条评论文本：按 duplicate_rate 取常见短评论，否则为长度近似指数分布的随机文本。
+        """
+        if rng.random() < self.settings.duplicate_rate:
+            return rng.choice(_COMMON_TEXTS)
+        length = min(int(rng.expovariate(1 / 24)) + 2, 300)
+        return "".join(rng.choice(_CHARS) for _ in range(length))
+
+    def top_level(self, video_id, start, count):
+        """
+        返回视频第 start 条起的 count 条一级评论（接口返回的原始格式）。
+        """
+        items = []
+        for index in range(start, min(start + count, self.settings.comments)):
+            rng = random.Random(f"{self.settings.seed}:{video_id}:{index}")
+            has_replies = (
+                self.settings.reply_every and index % self.settings.reply_every == 0
+            )
+            items.append(
+                {
+                    "cid": f"{video_id}-{index}",
+                    "text": self.text(rng),
+                    "create_time": 1700000000 + index * 37,
+                    "reply_comment_total": self.settings.replies if has_replies else 0,
+                }
+            )
+        return items
+
+    def replies(self, comment_id, start, count):
+        """
+        返回一级评论 comment_id 第 start 条起的 count 条回复。
+        """
+        items = []
+        for index in range(start, min(start + count, self.settings.replies)):
+            rng = random.Random(f"{self.settings.seed}:{comment_id}:{index}")
+            items.append(
+                {
+                    "cid": f"{comment_id}-r{index}",
+                    "text": self.text(rng),
+                    "create_time": 1700100000 + index * 11,
+                }
+            )
+        return items
+
+
+class StubDouyinAPI:
+    """
+    本地的抖音接口替身，提供 fetch_video_comments、fetch_video_comment_replies 和 fetch_one_video，
+    路径与返回格式与 Config.DOUYIN_API_BASE_URI 指向的服务一致。
+    每次请求按设置注入延迟，并以 error_rate 的概率返回 HTTP 503；requests / errors 记录各接口的请求数。
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.data = SyntheticComments(settings)
+        self.requests = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(settings.seed)
+        self._server = None
+        self.app = self._create_app()
+
+    def _create_app(self):
+        app = Flask("bench_stub_api")
+        app.add_url_rule(
+            "/api/douyin/web/fetch_video_comments", view_func=self._comments
+        )
+        app.add_url_rule(
+            "/api/douyin/web/fetch_video_comment_replies", view_func=self._replies
+        )
+        app.add_url_rule("/api/douyin/web/fetch_one_video", view_func=self._video)
+        return app
+
+    def start(self):
+        """
+        在后台线程中启动服务（监听随机端口），返回可用作 DOUYIN_API_BASE_URI 的地址。
+        """
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)
+        self._server = make_server("127.0.0.1", 0, self.app, threaded=True)
+        threading.Thread(
+            target=self._server.serve_forever, name="bench-stub-api", daemon=True
+        ).start()
+        return f"http://127.0.0.1:{self._server.server_port}/api/douyin/web"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = {}
+            self.errors = 0
+
+    def _begin(self, endpoint):
+        # 记录请求并注入延迟，需要模拟失败时返回 True
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            jitter = self._rng.uniform(-1, 1) * self.settings.jitter_ms
+            failed = self._rng.random() < self.settings.error_rate
+            if failed:
+                self.errors += 1
+        delay = max(self.settings.latency_ms + jitter, 0) / 1000
+        if delay:
+            time.sleep(delay)
+        return failed
+
+    def _page(self, items, cursor, total):
+        return jsonify(
+            {
+                "code": 200,
+                "data": {
+                    "status_code": 0,
+                    "comments": items,
+                    "cursor": cursor + len(items),
+                    "has_more": 1 if cursor + len(items) < total else 0,
+                },
+            }
+        )
+
+    def _comments(self):
+        if self._begin("fetch_video_comments"):
+            return jsonify({"code": 503, "data": {}}), 503
+        video_id = request.args["aweme_id"]
+        cursor = int(request.args.get("cursor", 0))
+        items = self.data.top_level(video_id, cursor, self.settings.page_size)
+        return self._page(items, cursor, self.settings.comments)
+
+    def _replies(self):
+        if self._begin("fetch_video_comment_replies"):
+            return jsonify({"code": 503, "data": {}}), 503
+        comment_id = request.args["comment_id"]
+        cursor = int(request.args.get("cursor", 0))
+        items = self.data.replies(comment_id, cursor, self.settings.page_size)
+        return self._page(items, cursor, self.settings.replies)
+
+    def _video(self):
+        if self._begin("fetch_one_video"):
+            return jsonify({"code": 503, "data": {}}), 503
+        video_id = request.args["aweme_id"]
+        rng = random.Random(f"{self.settings.seed}:{video_id}")
+        detail = {
+            "aweme_id": video_id,
+            "desc": self.data.text(rng),
+            "create_time": 1699990000,
+            "duration": rng.randint(5000, 300000),
+            "statistics": {
+                "play_count": rng.randint(0, 10**7),
+                "digg_count": rng.randint(0, 10**6),
+                "comment_count": self.settings.comments,
+                "share_count": rng.randint(0, 10**5),
+                "collect_count": rng.randint(0, 10**5),
+            },
+            "video": {"cover": {"url_list": [f"https://example.com/{video_id}.jpg"]}},
+        }
+        return jsonify({"code": 200, "data": {"aweme_detail": detail}})
@@ -0,0 +1,485 @@
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from app.config import Config
+
+from .stub_api import StubDouyinAPI, StubSettings, SyntheticComments
+
+SCENARIOS = ("crawl", "replies", "ingest", "stream", "infer", "video_info")
+
+# 替身模型使用独立的模型版本，结果不会与真实模型的结果表、推理缓存混用
+STUB_REVISION = "bench-stub"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python3 -m bench",
+        description="用本地接口替身和替身模型测量抓取、写入、情感分析流和推理接口的性能",
+    )
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"逗号分隔的场景列表，可选 {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("--output", help="结果 JSON 的写入路径，默认输出到标准输出")
+    parser.add_argument(
+        "--database-uri", help="使用的数据库，默认为 Config 中的数据库（建议单独的库）"
+    )
+    parser.add_argument(
+        "--backend",
+        default="stub",
+        help="推理后端：stub（随机初始化的小模型）或 pytorch / onnx / onnx-int8",
+    )
+    parser.add_argument(
+        "--comments", type=int, default=5000, help="每个视频的一级评论数"
+    )
+    parser.add_argument("--page-size", type=int, default=20, help="接口每页的评论数")
+    parser.add_argument(
+        "--reply-every", type=int, default=10, help="每隔多少条一级评论有一条带回复"
+    )
+    parser.add_argument(
+        "--replies", type=int, default=30, help="每条带回复的一级评论的回复数"
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=20, help="接口每次请求的延迟"
+    )
+    parser.add_argument("--jitter-ms", type=float, default=10, help="延迟的抖动范围 ±")
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="接口请求失败的概率"
+    )
+    parser.add_argument(
+        "--duplicate-rate", type=float, default=0.1, help="重复常见短评论的比例"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=1000,
+        help="覆盖 CRAWL_RATE_LIMIT（每秒请求数），默认放开以测量管道本身的吞吐量",
+    )
+    parser.add_argument("--ingest-rows", type=int, default=20000)
+    parser.add_argument("--ingest-batch", type=int, default=500)
+    parser.add_argument("--infer-requests", type=int, default=2000)
+    parser.add_argument("--infer-concurrency", type=int, default=16)
+    parser.add_argument("--video-info-batch", type=int, default=20)
+    parser.add_argument(
+        "--max-attempts", type=int, default=20, help="抓取任务出错后最多重试的次数"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--keep-data", action="store_true", help="结束后保留写入数据库的基准数据"
+    )
+    return parser.parse_args(argv)
+
+
+def percentile(values, q):
+    """
+    返回 values 的第 q 百分位数（最近秩），values 为空时返回 None。
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def latency_summary(seconds):
+    """
+    将一组耗时（秒）汇总为次数与 p50 / p99 / 最大值（毫秒）。
+    """
+    summary = {"count": len(seconds)}
+    for name, q in (("p50_ms", 50), ("p99_ms", 99), ("max_ms", 100)):
+        value = percentile(seconds, q)
+        summary[name] = round(value * 1000, 3) if value is not None else None
+    return summary
+
+
+def rate(count, elapsed):
+    return round(count / elapsed, 2) if elapsed > 0 else None
+
+
+def peak_rss_mb():
+    # Linux 上 ru_maxrss 的单位为 KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+class BenchSuite:
+    """
+    依次运行各场景，结果为 {场景: 指标}。所有写入数据库的视频ID以 bench-<运行编号>- 开头，
+    结束后删除（--keep-data 时保留）。
+    """
+
+    def __init__(self, args, app, stub, run_id):
+        self.args = args
+        self.app = app
+        self.stub = stub
+        self.run_id = run_id
+        self.upstream_latencies = []
+        self._instrument_engine()
+
+    def video_id(self, name):
+        return f"bench-{self.run_id}-{name}"
+
+    def _instrument_engine(self):
+        # 记录抓取引擎每次上游请求的耗时（含限速与并发排队）
+        from app.crawler import _engine
+
+        get_json = _engine.get_json
+        latencies = self.upstream_latencies
+
+        async def timed_get_json(endpoint, params, check_status=True):
+            started = time.perf_counter()
+            try:
+                return await get_json(endpoint, params, check_status)
+            finally:
+                latencies.append(time.perf_counter() - started)
+
+        _engine.get_json = timed_get_json
+
+    def _reset(self):
+        self.stub.reset_counters()
+        self.upstream_latencies.clear()
+
+    def run_task(self, kind, video_id):
+        """
+        直接调用任务处理函数执行一个任务，出错时像任务队列一样从断点重试（不等待退避）。
+        返回 (最后一次的进度, 重试次数)。
+        """
+        from app.jobs import JobContext
+        from app.models import Job
+        from app.sql import db
+        from app.tasks import TASK_HANDLERS
+
+        stop_event = threading.Event()
+        for attempt in range(1, self.args.max_attempts + 1):
+            job = Job(id=0, kind=kind, video_id=video_id, attempts=attempt, progress={})
+            ctx = JobContext(job, stop_event)
+            try:
+                TASK_HANDLERS[kind](ctx)
+                return ctx.progress, attempt - 1
+            except Exception as e:
+                db.session.rollback()
+                log(f"{kind} 第 {attempt} 次执行出错：{e}")
+        raise RuntimeError(f"{kind} 重试 {self.args.max_attempts} 次后仍然失败")
+
+    def count_comments(self, video_id, replies):
+        from sqlalchemy import func, select
+
+        from app.models import Comment
+        from app.sql import db
+
+        parent = (
+            Comment.parent_cid.isnot(None) if replies else Comment.parent_cid.is_(None)
+        )
+        return db.session.execute(
+            select(func.count()).where(Comment.video_id == video_id, parent)
+        ).scalar()
+
+    def _crawl_result(self, endpoint, rows, elapsed, retries):
+        pages = self.stub.requests.get(endpoint, 0)
+        return {
+            "rows": rows,
+            "pages": pages,
+            "elapsed_s": round(elapsed, 3),
+            "rows_per_s": rate(rows, elapsed),
+            "pages_per_s": rate(pages, elapsed),
+            "retries": retries,
+            "upstream_errors": self.stub.errors,
+            "page_latency": latency_summary(self.upstream_latencies),
+        }
+
+    def crawl(self):
+        video_id = self.video_id("crawl")
+        self._reset()
+        started = time.perf_counter()
+        _, retries = self.run_task("fetch_comments", video_id)
+        elapsed = time.perf_counter() - started
+        rows = self.count_comments(video_id, replies=False)
+        return self._crawl_result("fetch_video_comments", rows, elapsed, retries)
+
+    def replies(self):
+        video_id = self.video_id("crawl")
+        if not self.count_comments(video_id, replies=False):
+            self.run_task("fetch_comments", video_id)
+        self._reset()
+        started = time.perf_counter()
+        _, retries = self.run_task("fetch_comments_replies", video_id)
+        elapsed = time.perf_counter() - started
+        rows = self.count_comments(video_id, replies=True)
+        return self._crawl_result("fetch_video_comment_replies", rows, elapsed, retries)
+
+    def _synthetic_rows(self, video_id, count):
+        from app.ingest import parse_comment_items
+
+        settings = StubSettings(
+            comments=count,
+            duplicate_rate=self.args.duplicate_rate,
+            seed=self.args.seed,
+        )
+        return parse_comment_items(
+            SyntheticComments(settings).top_level(video_id, 0, count)
+        )
+
+    def ingest(self):
+        from app.database import ensure_video
+        from app.ingest import upsert_comments
+
+        video_id = self.video_id("ingest")
+        rows = self._synthetic_rows(video_id, self.args.ingest_rows)
+        ensure_video(video_id)
+        latencies = []
+        started = time.perf_counter()
+        for start in range(0, len(rows), self.args.ingest_batch):
+            batch_started = time.perf_counter()
+            upsert_comments(video_id, rows[start : start + self.args.ingest_batch])
+            latencies.append(time.perf_counter() - batch_started)
+        elapsed = time.perf_counter() - started
+        return {
+            "rows": len(rows),
+            "elapsed_s": round(elapsed, 3),
+            "rows_per_s": rate(len(rows), elapsed),
+            "batch_latency": latency_summary(latencies),
+        }
+
+    def _read_stream(self, video_id):
+        client = self.app.test_client()
+        started = time.perf_counter()
+        response = client.get(
+            f"/sentiment_pipeline?video_id={video_id}&format=columnar"
+        )
+        rows = 0
+        first_chunk = None
+        gaps = []
+        last = started
+        buffer = b""
+        for chunk in response.response:
+            now = time.perf_counter()
+            if first_chunk is None:
+                first_chunk = now - started
+            else:
+                gaps.append(now - last)
+            last = now
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    rows += len(json.loads(line).get("seq", []))
+        response.close()
+        elapsed = time.perf_counter() - started
+        return {
+            "status": response.status_code,
+            "rows": rows,
+            "elapsed_s": round(elapsed, 3),
+            "rows_per_s": rate(rows, elapsed),
+            "first_chunk_ms": round(first_chunk * 1000, 3) if first_chunk else None,
+            "chunk_gap": latency_summary(gaps),
+        }
+
+    def stream(self):
+        from app.database import ensure_video
+        from app.ingest import upsert_comments
+
+        video_id = self.video_id("stream")
+        rows = self._synthetic_rows(video_id, self.args.comments)
+        ensure_video(video_id)
+        for start in range(0, len(rows), 1000):
+            upsert_comments(video_id, rows[start : start + 1000])
+        # 第一遍需要推理，第二遍直接读取已存储的结果
+        return {
+            "cold": self._read_stream(video_id),
+            "warm": self._read_stream(video_id),
+        }
+
+    def infer(self):
+        # 每条文本都不相同，请求不会命中推理缓存
+        data = SyntheticComments(StubSettings(duplicate_rate=0, seed=self.args.seed))
+        texts = [
+            f"{index} " + data.text(random.Random(f"{self.run_id}:{index}"))
+            for index in range(self.args.infer_requests)
+        ]
+        latencies = []
+        errors = []
+        local = threading.local()
+
+        def post(text):
+            if not hasattr(local, "client"):
+                local.client = self.app.test_client()
+            started = time.perf_counter()
+            response = local.client.post("/infer_text", json={"text": text})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.infer_concurrency) as executor:
+            list(executor.map(post, texts))
+        elapsed = time.perf_counter() - started
+        return {
+            "requests": len(texts),
+            "concurrency": self.args.infer_concurrency,
+            "errors": len(errors),
+            "elapsed_s": round(elapsed, 3),
+            "requests_per_s": rate(len(texts), elapsed),
+            "latency": latency_summary(latencies),
+        }
+
+    def video_info(self):
+        client = self.app.test_client()
+        video_ids = ",".join(
+            self.video_id(f"info{index}") for index in range(self.args.video_info_batch)
+        )
+        result = {}
+        for name in ("cold", "warm"):
+            self._reset()
+            started = time.perf_counter()
+            response = client.get(f"/video_info_batch?video_ids={video_ids}")
+            result[name] = {
+                "status": response.status_code,
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+                "upstream_requests": sum(self.stub.requests.values()),
+            }
+        return result
+
+    def cleanup(self):
+        from sqlalchemy import text
+
+        from app.inference_cache import inference_cache
+        from app.pipeline import RESULT_REVISION
+        from app.sql import db
+
+        inference_cache.flush()
+        prefix = f"bench-{self.run_id}-%"
+        for table in (
+            "comments",
+            "crawl_checkpoints",
+            "video_meta",
+            "video_stats_history",
+            "videos",
+        ):
+            db.session.execute(
+                text(f"DELETE FROM {table} WHERE video_id LIKE :prefix"),
+                {"prefix": prefix},
+            )
+        db.session.execute(
+            text("DELETE FROM sentiment_results WHERE cid LIKE :prefix"),
+            {"prefix": prefix},
+        )
+        if RESULT_REVISION.startswith(STUB_REVISION):
+            db.session.execute(
+                text("DELETE FROM inference_cache WHERE model_revision = :revision"),
+                {"revision": RESULT_REVISION},
+            )
+        db.session.commit()
+
+
+def wait_for_model():
+    from app.pipeline import model_status
+
+    while True:
+        status, error = model_status()
+        if status == "ready":
+            return
+        if status == "error":
+            raise RuntimeError(f"模型加载失败：{error}")
+        time.sleep(0.1)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"未知的场景：{', '.join(sorted(unknown))}")
+
+    # 以下配置须在导入 app.pipeline 之前设置（其中的模型版本在导入时确定）
+    if args.database_uri:
+        Config.SQLALCHEMY_DATABASE_URI = args.database_uri
+    Config.CRAWL_RATE_LIMIT = args.rate_limit
+    if args.backend == "stub":
+        Config.MODEL_REVISION = STUB_REVISION
+    else:
+        Config.INFER_BACKEND = args.backend
+
+    stub = StubDouyinAPI(
+        StubSettings(
+            comments=args.comments,
+            page_size=args.page_size,
+            reply_every=args.reply_every,
+            replies=args.replies,
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            duplicate_rate=args.duplicate_rate,
+            seed=args.seed,
+        )
+    )
+    Config.DOUYIN_API_BASE_URI = stub.start()
+
+    from app import create_app
+    from app import pipeline
+
+    app = create_app(background=False)
+    if args.backend == "stub":
+        from .model import TinyClassifier
+
+        # 替身模型代替 preload_model() 预先加载的模型，由预热线程完成预热
+        pipeline._preloaded = TinyClassifier(seed=args.seed)
+    pipeline.start_model_warmup()
+    wait_for_model()
+
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    report = {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "params": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "database_uri", "keep_data")
+        },
+        "results": {},
+    }
+    with app.app_context():
+        suite = BenchSuite(args, app, stub, run_id)
+        try:
+            for name in scenarios:
+                log(f"运行场景 {name} ...")
+                result = getattr(suite, name)()
+                result["peak_rss_mb"] = peak_rss_mb()
+                report["results"][name] = result
+        finally:
+            if not args.keep_data:
+                suite.cleanup()
+            stub.stop()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        log(f"结果已写入 {args.output}")
+    else:
+        print(output)
@@ -0,0 +1,121 @@
+"""
+离线核对 ONNX 推理后端与 PyTorch 基线模型的一致性。
+
+用法：
+    python3 check_parity.py                          # 从评论表随机抽取 1000 条评论，核对 onnx 与 onnx-int8
+    python3 check_parity.py --backend onnx-int8 --limit 5000
+    python3 check_parity.py --file texts.txt         # 使用文本文件中的评论（每行一条）
+
+输出每个后端与 PyTorch 的标签一致率、置信度的平均/最大绝对差，以及各后端的吞吐量（条/秒）。
+"""
+
+import argparse
+import time
+
+from sqlalchemy import text
+
+from app import create_app
+from app.backends import load_backend
+from app.config import Config
+from app.sql import db
+
+
+def load_texts(args):
+    """
+    读取待核对的评论文本，按推理路径的规则截断。
+    """
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        app = create_app(background=False)
+        with app.app_context():
+            texts = list(
+                db.session.execute(
+                    text("SELECT text FROM comments ORDER BY random() LIMIT :limit"),
+                    {"limit": args.limit},
+                ).scalars()
+            )
+    return [text_[: Config.INFER_MAX_TEXT_LENGTH] for text_ in texts[: args.limit]]
+
+
+def run_backend(backend, texts, batch_size):
+    """
+    按长度排序后分批推理，返回 (按输入顺序排列的输出列表, 吞吐量)。
+    """
+    order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+    outputs = [None] * len(texts)
+    started = time.perf_counter()
+    for start in range(0, len(order), batch_size):
+        indexes = order[start : start + batch_size]
+        for index, output in zip(indexes, backend([texts[i] for i in indexes])):
+            outputs[index] = output
+    elapsed = time.perf_counter() - started
+    return outputs, len(texts) / elapsed if elapsed > 0 else 0.0
+
+
+def compare(baseline, candidate):
+    """
+    返回 (标签一致率, 置信度平均绝对差, 置信度最大绝对差)。
+    """
+    agree = 0
+    deltas = []
+    for base, cand in zip(baseline, candidate):
+        base_scores = dict(zip(base["labels"], base["scores"]))
+        cand_scores = dict(zip(cand["labels"], cand["scores"]))
+        if max(base_scores, key=base_scores.get) == max(
+            cand_scores, key=cand_scores.get
+        ):
+            agree += 1
+        deltas.extend(
+            abs(score - cand_scores.get(label, 0.0))
+            for label, score in base_scores.items()
+        )
+    return (
+        agree / len(baseline),
+        sum(deltas) / len(deltas),
+        max(deltas),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="核对 ONNX 后端与 PyTorch 模型的一致性"
+    )
+    parser.add_argument(
+        "--backend",
+        action="append",
+        choices=["onnx", "onnx-int8"],
+        help="待核对的后端，可重复指定，默认核对全部",
+    )
+    parser.add_argument("--limit", type=int, default=1000, help="核对的评论数量")
+    parser.add_argument("--file", help="评论文本文件，每行一条")
+    parser.add_argument(
+        "--batch-size", type=int, default=Config.INFER_MAX_BATCH_SIZE, help="批大小"
+    )
+    args = parser.parse_args()
+
+    texts = load_texts(args)
+    if not texts:
+        print("没有可用于核对的评论")
+        return
+
+    baseline, baseline_rate = run_backend(
+        load_backend("pytorch", Config.MODEL_DIR), texts, args.batch_size
+    )
+    print(f"pytorch: {baseline_rate:.1f} 条/秒（{len(texts)} 条评论）")
+
+    for name in args.backend or ["onnx", "onnx-int8"]:
+        outputs, rate = run_backend(
+            load_backend(name, Config.MODEL_DIR), texts, args.batch_size
+        )
+        agreement, mean_delta, max_delta = compare(baseline, outputs)
+        print(
+            f"{name}: {rate:.1f} 条/秒，加速 {rate / baseline_rate:.2f} 倍，"
+            f"标签一致率 {agreement:.2%}，"
+            f"置信度平均绝对差 {mean_delta:.4f}，最大绝对差 {max_delta:.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+将 StructBERT 情绪分类模型导出为 ONNX 格式，并生成动态量化的 int8 版本，供 ONNX Runtime 后端使用。
+
+用法：
+    python3 export_onnx.py              # 导出 model.onnx 与 model.int8.onnx
+    python3 export_onnx.py --skip-int8  # 只导出 fp32 模型
+
+导出的模型保存在 Config.ONNX_MODEL_DIR 中。导出后将 Config.INFER_BACKEND 设为 onnx 或 onnx-int8
+并重启服务即可切换后端；切换前可先用 check_parity.py 核对与 PyTorch 模型的一致性。
+"""
+
+import argparse
+import os
+
+import torch
+from transformers import BertTokenizerFast
+
+from app.backends import PytorchBackend, onnx_model_path
+from app.config import Config
+
+INPUT_NAMES = ["input_ids", "attention_mask", "token_type_ids"]
+
+
+class LogitsModel(torch.nn.Module):
+    """
+    包装 ModelScope 分类模型，只输出 logits，便于导出。
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+        )
+        return outputs.logits
+
+
+def export_fp32(path, opset):
+    """
+    导出 fp32 ONNX 模型，批大小与序列长度均为动态维度。
+    """
+    model = PytorchBackend(Config.MODEL_DIR).pipeline.model
+    model.eval()
+
+    tokenizer = BertTokenizerFast(os.path.join(Config.MODEL_DIR, "vocab.txt"))
+    sample = tokenizer(
+        ["这条评论用于导出模型", "哈哈哈"], padding="longest", return_tensors="pt"
+    )
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in INPUT_NAMES}
+    dynamic_axes["logits"] = {0: "batch"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            LogitsModel(model),
+            tuple(sample[name] for name in INPUT_NAMES),
+            path,
+            input_names=INPUT_NAMES,
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+
+
+def export_int8(fp32_path, int8_path):
+    """
+    对 fp32 模型做动态量化（权重 int8，激活在运行时量化），适合无 GPU 的 CPU 推理。
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出情绪分类模型的 ONNX 版本")
+    parser.add_argument("--opset", type=int, default=14, help="ONNX opset 版本")
+    parser.add_argument(
+        "--skip-int8", action="store_true", help="不生成动态量化的 int8 模型"
+    )
+    args = parser.parse_args()
+
+    os.makedirs(Config.ONNX_MODEL_DIR, exist_ok=True)
+    fp32_path = onnx_model_path("onnx")
+    export_fp32(fp32_path, args.opset)
+    print(f"已导出 {fp32_path}")
+
+    if not args.skip_int8:
+        int8_path = onnx_model_path("onnx-int8")
+        export_int8(fp32_path, int8_path)
+        print(f"已导出 {int8_path}")
+
+
+if __name__ == "__main__":
+    main()
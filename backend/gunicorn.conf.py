@@ -0,0 +1,85 @@
+"""
+gunicorn 配置：预派生多进程 + 每进程多线程（gthread），用于生产环境部署。
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+- preload_app：主进程加载应用和模型权重后再 fork，工作进程以写时复制方式共享模型内存；
+- post_fork：重建数据库连接池，启动模型预热、任务工作线程和关注列表调度器；
+- kill -HUP <主进程>：重新读取本配置文件并平滑替换工作进程，执行中的任务放回队列。
+  preload_app 下主进程已导入的应用代码、app/config.py 和模型不会重新加载，新工作进程仍运行旧代码；
+  修改代码后需完整重启服务，或向主进程发送 USR2 启动新的主进程，待其就绪后再向旧主进程发送 TERM；
+- on_starting：检查各工作进程的连接池上限之和不超过 PostgreSQL 的 max_connections；
+- 各工作进程定期把指标快照写入 Config.METRICS_DIR，/metrics 由任一进程汇总全部进程的指标。
+进程数、线程数与超时时间见 Config.SERVER_*。
+"""
+
+import gc
+import shutil
+import tempfile
+
+from app.config import Config
+
+# 本次启动的指标快照目录，在加载应用前设置，由主进程和所有工作进程共享
+if Config.METRICS_DIR is None:
+    Config.METRICS_DIR = tempfile.mkdtemp(prefix="douyin-metrics-")
+
+bind = "0.0.0.0:5000"
+preload_app = True
+worker_class = "gthread"
+workers = Config.SERVER_WORKERS
+threads = Config.SERVER_THREADS
+# gthread 工作进程的心跳与请求线程无关，流式响应耗时再长也不会触发超时
+timeout = Config.SERVER_TIMEOUT
+graceful_timeout = Config.SERVER_GRACEFUL_TIMEOUT
+keepalive = 5
+accesslog = "-"
+
+# 工作进程内的任务工作线程，worker_exit 时等待其放回执行中的任务
+_job_workers = []
+
+
+def on_starting(server):
+    from app.sql import check_connection_limit
+    from wsgi import app
+
+    # 各工作进程的连接池上限之和超过数据库的 max_connections 时直接启动失败，而不是在高峰期连接报错
+    spare = check_connection_limit(app, server.cfg.workers)
+    server.log.info(
+        "数据库连接：%s 个工作进程之外还可使用 %s 条", server.cfg.workers, spare
+    )
+
+
+def when_ready(server):
+    # 将 fork 前已存在的对象（含模型）移出垃圾回收的跟踪范围，
+    # 避免工作进程中的回收遍历触碰这些内存页而破坏写时复制共享
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    from app import start_background_services
+    from app.metrics import registry
+    from app.sql import db
+    from wsgi import app
+
+    # 主进程建立的数据库连接不能在多个进程间共用，丢弃后由各进程重新建立
+    with app.app_context():
+        db.engine.dispose(close=False)
+    # 主进程加载期间（如模型预热）记录的指标不属于任何工作进程，不应在每个进程中重复计数
+    registry.reset()
+    _job_workers.extend(start_background_services(app))
+
+
+def worker_exit(server, worker):
+    from app.jobs import stop_event
+    from app.metrics import registry
+
+    stop_event.set()
+    for thread in _job_workers:
+        thread.join(Config.SERVER_GRACEFUL_TIMEOUT)
+    # 写入最终快照，已退出进程的计数仍计入汇总
+    registry.write_snapshot()
+
+
+def on_exit(server):
+    shutil.rmtree(Config.METRICS_DIR, ignore_errors=True)
@@ -0,0 +1,115 @@
+"""
+将旧版按视频分表存储的评论（video_{id} 表）批量迁移到统一的 comments 表。
+
+用法：
+    python3 migrate_comments.py          # 迁移全部 video_{视频ID} 表，保留旧表
+    python3 migrate_comments.py --drop   # 迁移后删除旧表及其序列
+
+迁移在数据库内通过 INSERT ... SELECT 完成，每个视频一个事务，可重复执行，
+完成后会根据迁移的评论和已有的情绪分析结果重新统计视频摘要。
+旧表中的 seq 会被保留；若该视频在统一表中已有评论，则旧序号整体后移，避免冲突。
+旧表未记录二级评论所属的一级评论，迁移后这些评论的 parent_cid 为空。
+"""
+
+import argparse
+
+from sqlalchemy import inspect, text
+
+from app import create_app
+from app.backends import result_revision
+from app.database import refresh_video_summary
+from app.sql import db
+
+LEGACY_PREFIX = "video_"
+
+
+def legacy_video_id(table_name):
+    """
+    旧评论表名为 video_{抖音视频ID}（纯数字），返回其中的视频ID；不是旧评论表时返回 None。
+    video_meta、video_stats_history 等现有表同样以 video_ 开头，不能只按前缀判断。
+    """
+    if not table_name.startswith(LEGACY_PREFIX):
+        return None
+    video_id = table_name[len(LEGACY_PREFIX) :]
+    return video_id if video_id.isdigit() else None
+
+
+def migrate_table(conn, table_name, drop=False):
+    """
+    迁移单个旧评论表，返回迁移的评论数量。
+    """
+    video_id = legacy_video_id(table_name)
+
+    conn.execute(
+        text(
+            "INSERT INTO videos (video_id, next_seq) VALUES (:video_id, 1) "
+            "ON CONFLICT (video_id) DO NOTHING"
+        ),
+        {"video_id": video_id},
+    )
+    # 锁定视频行，迁移期间新写入的评论会等待迁移完成后再分配序号
+    offset = conn.execute(
+        text("SELECT next_seq - 1 FROM videos WHERE video_id = :video_id FOR UPDATE"),
+        {"video_id": video_id},
+    ).scalar_one()
+
+    moved = conn.execute(
+        text(
+            "INSERT INTO comments "
+            "(video_id, cid, seq, text, create_time, reply_comment_total) "
+            f'SELECT :video_id, cid, seq + :offset, text, create_time, reply_comment_total FROM "{table_name}" '
+            "ON CONFLICT (video_id, cid) DO NOTHING"
+        ),
+        {"video_id": video_id, "offset": offset},
+    ).rowcount
+
+    conn.execute(
+        text(
+            "UPDATE videos SET next_seq = GREATEST(next_seq, "
+            "(SELECT COALESCE(MAX(seq), 0) + 1 FROM comments WHERE video_id = :video_id)) "
+            "WHERE video_id = :video_id"
+        ),
+        {"video_id": video_id},
+    )
+
+    refresh_video_summary(conn, video_id, result_revision())
+
+    if drop:
+        conn.execute(text(f'DROP TABLE "{table_name}"'))
+        conn.execute(text(f'DROP SEQUENCE IF EXISTS "seq_{table_name}"'))
+
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="迁移 video_* 评论表到统一的 comments 表"
+    )
+    parser.add_argument(
+        "--drop", action="store_true", help="迁移成功后删除旧的 video_* 表及其序列"
+    )
+    args = parser.parse_args()
+
+    app = create_app(background=False)
+    with app.app_context():
+        legacy_tables = [
+            name
+            for name in inspect(db.engine).get_table_names()
+            if legacy_video_id(name) is not None
+        ]
+        if not legacy_tables:
+            print("没有需要迁移的 video_* 表")
+            return
+
+        total = 0
+        for table_name in legacy_tables:
+            with db.engine.begin() as conn:
+                moved = migrate_table(conn, table_name, drop=args.drop)
+            total += moved
+            print(f"{table_name}: 迁移 {moved} 条评论")
+
+        print(f"共迁移 {len(legacy_tables)} 个视频，{total} 条评论")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,29 @@
+import sys
+
+from flask.helpers import get_debug_flag
+from werkzeug.serving import is_running_from_reloader
+
 from app import create_app
 
-app = create_app()
+
+def is_reloader_watcher():
+    """
+    判断当前进程是否为开发服务器自动重载的监视进程。监视进程只在代码变化时重启服务子进程，不处理请求；
+    服务子进程由 werkzeug 设置 WERKZEUG_RUN_MAIN=true。
+    python run.py 总是启用自动重载；flask run 指定 --reload 或处于调试模式（未指定 --no-reload）时启用。
+    """
+    if is_running_from_reloader():
+        return False
+    if __name__ == "__main__":
+        return True
+    if "--no-reload" in sys.argv:
+        return False
+    return "--reload" in sys.argv or get_debug_flag()
+
+
+# 开发服务器的自动重载会在监视进程和实际服务的子进程中各导入一次本模块，
+# 只在处理请求的进程中启动后台服务，避免模型加载两次；生产环境请使用 gunicorn（见 gunicorn.conf.py）
+app = create_app(background=not is_reloader_watcher())
 
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,40 @@
+"""
+需要数据库的测试通过 db fixture 连接 TEST_DATABASE_URI 指定的 PostgreSQL 数据库，未设置时跳过。
+每个测试结束后会清空全部数据表，请使用单独的测试数据库：
+
+    TEST_DATABASE_URI=postgresql://postgres@localhost/test python -m pytest
+"""
+
+import os
+
+import pytest
+from sqlalchemy import text
+
+from app.config import Config
+
+
+@pytest.fixture(scope="session")
+def app():
+    uri = os.environ.get("TEST_DATABASE_URI")
+    if not uri:
+        pytest.skip("未设置 TEST_DATABASE_URI")
+    Config.SQLALCHEMY_DATABASE_URI = uri
+    from app import create_app
+
+    return create_app(background=False)
+
+
+@pytest.fixture
+def db(app):
+    """
+    在应用上下文中返回 SQLAlchemy 实例，测试结束后清空全部数据表。
+    """
+    from app.sql import db
+
+    with app.app_context():
+        yield db
+        db.session.rollback()
+        tables = ", ".join(table.name for table in db.metadata.sorted_tables)
+        db.session.execute(text(f"TRUNCATE {tables}"))
+        db.session.commit()
+        db.session.remove()
@@ -0,0 +1,28 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.comment_query import parse_time
+
+
+def test_parse_unix_timestamp():
+    assert parse_time("1700000000") == datetime(
+        2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc
+    )
+
+
+def test_parse_naive_iso_time_as_utc():
+    assert parse_time("2024-01-02T03:04:05") == datetime(
+        2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc
+    )
+
+
+def test_parse_iso_time_keeps_offset():
+    parsed = parse_time("2024-01-02T11:04:05+08:00")
+    assert parsed == datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("value", ["1e20", "-1e20", "inf", "nan", "昨天", ""])
+def test_invalid_time_raises_value_error(value):
+    with pytest.raises(ValueError):
+        parse_time(value)
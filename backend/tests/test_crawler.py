@@ -0,0 +1,177 @@
+import time
+
+import pytest
+from flask import jsonify, request
+
+from app import crawler
+from app.config import Config
+from app.crawler import (
+    CrawlEngine,
+    UpstreamRequestError,
+    UpstreamResponseError,
+    fetch_video_details,
+    iter_comment_batches,
+    iter_reply_pages,
+)
+from bench.stub_api import StubDouyinAPI, StubSettings
+
+
+class FaultyStubAPI(StubDouyinAPI):
+    """
+    在指定位置返回错误的接口替身：fail_cursors 中的一级评论游标返回 HTTP 503，
+    fail_comments 中一级评论的回复和 fail_videos 中视频的详情返回 code 非 200 的响应。
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.fail_cursors = set()
+        self.fail_comments = set()
+        self.fail_videos = set()
+
+    def _comments(self):
+        if int(request.args.get("cursor", 0)) in self.fail_cursors:
+            self._begin("fetch_video_comments")
+            return jsonify({"code": 503, "data": {}}), 503
+        return super()._comments()
+
+    def _replies(self):
+        if request.args["comment_id"] in self.fail_comments:
+            self._begin("fetch_video_comment_replies")
+            return jsonify({"code": 400, "data": {}})
+        return super()._replies()
+
+    def _video(self):
+        if request.args["aweme_id"] in self.fail_videos:
+            self._begin("fetch_one_video")
+            return jsonify({"code": 400, "data": {}})
+        return super()._video()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """
+    启动接口替身，并换用指向它、不限速的新抓取引擎。
+    """
+    api = FaultyStubAPI(
+        StubSettings(comments=100, page_size=10, reply_every=0, replies=25)
+    )
+    monkeypatch.setattr(Config, "DOUYIN_API_BASE_URI", api.start())
+    monkeypatch.setattr(Config, "CRAWL_RATE_LIMIT", 10_000)
+    engine = CrawlEngine()
+    monkeypatch.setattr(crawler, "_engine", engine)
+    yield api
+    if engine.loop is not None:
+        engine.run(engine.session.close())
+        engine.loop.call_soon_threadsafe(engine.loop.stop)
+    api.stop()
+
+
+def _cids(batches):
+    return [
+        item["cid"] for batch in batches for page in batch for item in page.comments
+    ]
+
+
+def test_iter_comment_batches_yields_all_pages_in_order(stub):
+    batches = list(iter_comment_batches("v1"))
+    pages = [page for batch in batches for page in batch]
+
+    assert _cids(batches) == [f"v1-{index}" for index in range(100)]
+    assert [page.cursor for page in pages] == list(range(10, 101, 10))
+    assert pages[-1].has_more == 0
+    assert stub.requests["fetch_video_comments"] == 10
+
+
+def test_iter_comment_batches_resumes_from_cursor(stub):
+    batches = list(iter_comment_batches("v1", cursor=70))
+    assert _cids(batches) == [f"v1-{index}" for index in range(70, 100)]
+
+
+def test_iter_comment_batches_yields_pages_before_error(stub):
+    stub.fail_cursors.add(30)
+    batches = []
+    with pytest.raises(UpstreamRequestError):
+        batches.extend(iter_comment_batches("v1"))
+
+    # 出错前到达的三页全部产出，之后不再请求
+    assert _cids(batches) == [f"v1-{index}" for index in range(30)]
+    assert batches[-1][-1].cursor == 30
+    assert stub.requests["fetch_video_comments"] == 4
+
+
+def test_iter_reply_pages_reports_error_per_thread(stub):
+    stub.fail_comments.add("c2")
+    pages = list(iter_reply_pages("v1", ["c1", "c2", "c3"], cursors={"c3": 20}))
+
+    failed = [page for page in pages if page.parent_cid == "c2"]
+    assert len(failed) == 1
+    assert failed[0].done
+    assert isinstance(failed[0].error, UpstreamResponseError)
+
+    # 其余一级评论不受影响，按游标顺序翻页直至结束
+    c1 = [page for page in pages if page.parent_cid == "c1"]
+    assert [page.cursor for page in c1] == [10, 20, 25]
+    assert [page.done for page in c1] == [False, False, True]
+    assert [item["cid"] for page in c1 for item in page.comments] == [
+        f"c1-r{index}" for index in range(25)
+    ]
+    c3 = [page for page in pages if page.parent_cid == "c3"]
+    assert [item["cid"] for page in c3 for item in page.comments] == [
+        f"c3-r{index}" for index in range(20, 25)
+    ]
+    assert all(page.error is None for page in c1 + c3)
+
+
+def test_iter_reply_pages_without_parents(stub):
+    assert list(iter_reply_pages("v1", [])) == []
+    assert stub.requests == {}
+
+
+def test_fetch_video_details_returns_errors_in_place(stub):
+    stub.fail_videos.add("v2")
+    details = fetch_video_details(["v1", "v2", "v3"])
+
+    assert details[0]["aweme_id"] == "v1"
+    assert isinstance(details[1], UpstreamResponseError)
+    assert details[1].data["code"] == 400
+    assert details[2]["aweme_id"] == "v3"
+
+
+def test_iter_comment_batches_bounds_prefetch(stub, monkeypatch):
+    monkeypatch.setattr(Config, "CRAWL_PREFETCH_PAGES", 2)
+    batches = iter_comment_batches("v1")
+    consumed = len(next(batches))
+    time.sleep(0.3)
+
+    # 预取最多领先队列长度加一页（已取到、等待放入队列的一页）
+    requested = stub.requests["fetch_video_comments"]
+    assert consumed < requested <= consumed + 3
+
+    # 调用方处理期间到达的页在下一批中一并产出
+    batch = next(batches)
+    assert len(batch) >= 2
+    consumed += len(batch)
+
+    # 关闭后最多完成已发出的请求，不再继续翻页
+    batches.close()
+    time.sleep(0.1)
+    requested = stub.requests["fetch_video_comments"]
+    assert requested <= consumed + 3
+    time.sleep(0.3)
+    assert stub.requests["fetch_video_comments"] == requested
+
+
+def test_iter_comment_batches_overlaps_fetching(stub, monkeypatch):
+    monkeypatch.setattr(Config, "CRAWL_PREFETCH_PAGES", 8)
+    stub.settings.latency_ms = 30
+    cids = []
+    started = time.perf_counter()
+    for batch in iter_comment_batches("v1"):
+        # 模拟调用方逐批写库，期间后台继续抓取
+        time.sleep(0.03 * len(batch))
+        cids.extend(item["cid"] for page in batch for item in page.comments)
+    elapsed = time.perf_counter() - started
+
+    assert cids == [f"v1-{index}" for index in range(100)]
+    # 串行抓取与处理需要 10 × (30 + 30) ms
+    assert elapsed < 0.5
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+from app.backends import model_fingerprint
+from app.config import Config
+from app.inference import InferenceScheduler, plan_batches
+from app.pipeline import token_length, truncate_text
+
+
+def _flatten(batches):
+    return sorted(index for batch in batches for index in batch)
+
+
+def test_plan_batches_covers_every_text_once():
+    lengths = [5, 120, 7, 64, 3, 250, 9, 66]
+    assert _flatten(plan_batches(lengths, 512, 64)) == list(range(len(lengths)))
+
+
+def test_plan_batches_respects_token_budget_and_batch_size():
+    lengths = [10, 11, 12, 13, 14, 15, 16, 40, 41, 42, 200, 201]
+    for batch in plan_batches(lengths, 64, 3):
+        assert len(batch) <= 3
+        assert len(batch) == 1 or len(batch) * max(lengths[i] for i in batch) <= 64
+
+
+def test_plan_batches_keeps_short_texts_away_from_long_ones():
+    lengths = [5, 200, 6, 7]
+    batches = plan_batches(lengths, 4096, 64)
+    assert [1] in batches
+    assert [0, 2, 3] in [sorted(batch) for batch in batches]
+
+
+def test_single_text_over_budget_gets_its_own_batch():
+    assert plan_batches([300, 300], 256, 64) == [[0], [1]]
+
+
+def test_token_length_follows_backend_limit(monkeypatch):
+    text = truncate_text("长" * 1000)
+    monkeypatch.setattr(Config, "INFER_BACKEND", "pytorch")
+    assert token_length(text) == Config.INFER_MAX_TEXT_LENGTH + 2
+    monkeypatch.setattr(Config, "INFER_BACKEND", "onnx")
+    assert token_length(text) == Config.INFER_MAX_SEQ_LENGTH
+    assert token_length("好看") == 4
+
+
+def _scheduler(run_batch, length_of=len, max_batch_size=8):
+    return InferenceScheduler(
+        run_batch,
+        max_batch_size=max_batch_size,
+        max_wait=0.001,
+        token_budget=4096,
+        length_of=length_of,
+    )
+
+
+def test_scheduler_returns_results_in_order():
+    scheduler = _scheduler(lambda texts: [text.upper() for text in texts])
+    texts = [f"t{index}" for index in range(20)]
+    assert scheduler.submit(texts) == [text.upper() for text in texts]
+
+
+def test_scheduler_error_reaches_callers_and_scheduler_survives():
+    def length_of(text):
+        if text == "bad":
+            raise RuntimeError("length failed")
+        return len(text)
+
+    scheduler = _scheduler(lambda texts: texts, length_of=length_of)
+    with pytest.raises(RuntimeError, match="length failed"):
+        scheduler.submit(["ok"] * 20 + ["bad"])
+    assert scheduler.submit(["still", "running"]) == ["still", "running"]
+    assert scheduler.queue_depth() == 0
+
+
+def test_small_request_is_not_starved_by_a_large_one():
+    batches = []
+    first_batch = threading.Event()
+    release = threading.Event()
+
+    def run_batch(texts):
+        batches.append(list(texts))
+        if len(batches) == 1:
+            first_batch.set()
+            release.wait(5)
+        return texts
+
+    scheduler = _scheduler(run_batch)
+    large = threading.Thread(target=scheduler.submit, args=(["large"] * 200,))
+    large.start()
+    assert first_batch.wait(5)
+
+    small = []
+    small_thread = threading.Thread(
+        target=lambda: small.append(scheduler.submit(["small"]))
+    )
+    small_thread.start()
+    deadline = time.monotonic() + 5
+    while scheduler.queue_depth() < 2 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    release.set()
+    small_thread.join(5)
+    large.join(5)
+
+    assert small == [["small"]]
+    assert "small" in batches[1]
+
+
+def test_model_fingerprint_changes_with_model_files_and_revision(tmp_path, monkeypatch):
+    weights = tmp_path / "pytorch_model.bin"
+    weights.write_bytes(b"a")
+    original = model_fingerprint(str(tmp_path))
+    assert model_fingerprint(str(tmp_path)) == original
+
+    weights.write_bytes(b"bb")
+    updated = model_fingerprint(str(tmp_path))
+    assert updated != original
+
+    monkeypatch.setattr(Config, "MODEL_REVISION", "v-next")
+    assert model_fingerprint(str(tmp_path)) != updated
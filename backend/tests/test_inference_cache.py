@@ -0,0 +1,101 @@
+from sqlalchemy import func, select
+
+from app.config import Config
+from app.inference_cache import InferenceCache, normalize_text
+from app.models import InferenceCacheEntry
+from app.sentiment_store import text_hash
+
+
+class CountingModel:
+    """
+    记录每次推理收到的文本，按文本是否含“好”给出固定结果。
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [
+            ("高兴", {"高兴": 0.75, "悲伤": 0.25})
+            if "好" in text
+            else ("悲伤", {"高兴": 0.25, "悲伤": 0.75})
+            for text in texts
+        ]
+
+
+def _rows(db):
+    rows = db.session.execute(
+        select(InferenceCacheEntry.text_hash, InferenceCacheEntry.label)
+    )
+    return dict(rows.all())
+
+
+def test_normalize_text():
+    assert normalize_text("  哈哈\t哈\n\n哈 ") == "哈哈 哈 哈"
+    assert normalize_text(" \n ") == ""
+
+
+def test_long_texts_are_deduplicated_but_not_cached(monkeypatch):
+    monkeypatch.setattr(Config, "INFER_CACHE_MAX_TEXT_LENGTH", 4)
+    cache = InferenceCache()
+    model = CountingModel()
+    texts = ["很好很好很好", " 很好很好很好 ", "太难过了吧"]
+
+    results = cache.analyze(texts, model, "r1")
+
+    assert model.calls == [["很好很好很好", "太难过了吧"]]
+    assert [label for label, _ in results] == ["高兴", "高兴", "悲伤"]
+    stats = cache.stats()
+    assert (stats["inferred"], stats["batch_duplicates"]) == (2, 1)
+    assert stats["memory_entries"] == 0
+
+
+def test_new_results_written_behind_and_shared(db):
+    cache = InferenceCache()
+    model = CountingModel()
+    cache.analyze(["好看", "好看 ", "难过"], model, "r1")
+    cache.flush()
+
+    assert _rows(db) == {text_hash("好看"): "高兴", text_hash("难过"): "悲伤"}
+
+    # 同一进程内命中内存缓存
+    results = cache.analyze(["好看", "难过"], model, "r1")
+    assert [label for label, _ in results] == ["高兴", "悲伤"]
+    assert len(model.calls) == 1
+
+    # 新进程（内存缓存为空）命中数据表，得分按原值还原
+    other = InferenceCache()
+    results = other.analyze(["好看", "新评论"], model, "r1")
+    label, scores = results[0]
+    assert (label, scores["高兴"], scores["悲伤"], scores["愤怒"]) == (
+        "高兴",
+        0.75,
+        0.25,
+        0.0,
+    )
+    assert model.calls[-1] == ["新评论"]
+    assert other.stats()["table_hits"] == 1
+
+    # 模型版本不同时不复用
+    other.analyze(["好看"], model, "r2")
+    assert model.calls[-1] == ["好看"]
+    other.flush()
+    count = db.session.execute(
+        select(func.count()).select_from(InferenceCacheEntry)
+    ).scalar_one()
+    assert count == 4
+
+
+def test_failed_write_does_not_block_flush(db, capsys):
+    cache = InferenceCache()
+    # 标签超出列宽，写入失败
+    cache.analyze(["好看"], lambda texts: [("高兴" * 10, {})], "r1")
+    cache.flush()
+    assert "写入推理缓存失败" in capsys.readouterr().out
+    assert _rows(db) == {}
+
+    # 后台线程继续处理之后的写入
+    cache.analyze(["难过"], CountingModel(), "r1")
+    cache.flush()
+    assert _rows(db) == {text_hash("难过"): "悲伤"}
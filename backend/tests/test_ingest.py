@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from app.config import Config
+from app.database import ensure_video
+from app.ingest import upsert_comments
+from app.models import Comment, Video
+
+CREATED = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _row(cid, text="评论", parent_cid=None, reply_total=0, minutes=0):
+    return {
+        "cid": cid,
+        "parent_cid": parent_cid,
+        "text": text,
+        "create_time": CREATED + timedelta(minutes=minutes),
+        "reply_comment_total": reply_total,
+    }
+
+
+def _seqs(db, video_id):
+    rows = db.session.execute(
+        select(Comment.cid, Comment.seq).where(Comment.video_id == video_id)
+    )
+    return dict(rows.all())
+
+
+@pytest.fixture(params=["unnest", "copy"])
+def ingest_path(request, monkeypatch):
+    # COPY 路径在行数达到阈值时启用，阈值设为 1 使每批都走 COPY
+    if request.param == "copy":
+        monkeypatch.setattr(Config, "INGEST_COPY_THRESHOLD", 1)
+    return request.param
+
+
+def test_new_comments_get_consecutive_seqs(db, ingest_path):
+    ensure_video("v1")
+    rows = [_row("a"), _row("b"), _row("r1", parent_cid="a")]
+    assert upsert_comments("v1", rows) == (3, 0)
+
+    assert _seqs(db, "v1") == {"a": 1, "b": 2, "r1": 3}
+    video = db.session.get(Video, "v1")
+    assert (video.next_seq, video.comment_count, video.reply_count) == (4, 3, 1)
+    assert video.last_synced_at is not None
+
+
+def test_reupsert_counts_updates_and_keeps_seqs(db, ingest_path):
+    ensure_video("v1")
+    upsert_comments("v1", [_row("a"), _row("b"), _row("c")])
+
+    rows = [
+        _row("d"),
+        _row("a"),
+        _row("b", reply_total=5),
+        _row("e", text="制表符\t换行\n反斜杠\\"),
+    ]
+    assert upsert_comments("v1", rows) == (2, 1)
+
+    assert _seqs(db, "v1") == {"a": 1, "b": 2, "c": 3, "d": 4, "e": 5}
+    video = db.session.get(Video, "v1")
+    assert (video.next_seq, video.comment_count) == (6, 5)
+    stored = db.session.get(Comment, ("v1", "e"))
+    assert stored.text == "制表符\t换行\n反斜杠\\"
+    assert db.session.get(Comment, ("v1", "b")).reply_comment_total == 5
+
+
+def test_unchanged_batch_writes_nothing(db, ingest_path):
+    ensure_video("v1")
+    rows = [_row("a"), _row("b")]
+    upsert_comments("v1", rows)
+    assert upsert_comments("v1", rows) == (0, 0)
+    assert db.session.get(Video, "v1").next_seq == 3
+
+
+def test_seqs_are_per_video(db):
+    ensure_video("v1")
+    ensure_video("v2")
+    upsert_comments("v1", [_row("a"), _row("b")])
+    upsert_comments("v2", [_row("a"), _row("c")])
+    assert _seqs(db, "v2") == {"a": 1, "c": 2}
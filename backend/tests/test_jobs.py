@@ -0,0 +1,220 @@
+import threading
+
+import pytest
+from sqlalchemy import select, text, update
+
+from app import jobs, metrics
+from app.config import Config
+from app.jobs import claim, enqueue, request_cancel
+from app.models import Job
+
+KIND = "test_kind"
+
+
+@pytest.fixture(autouse=True)
+def job_config(monkeypatch):
+    monkeypatch.setitem(Config.JOB_CONCURRENCY, KIND, 2)
+    monkeypatch.setattr(Config, "JOB_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(Config, "JOB_RETRY_BACKOFF", 10)
+
+
+def _job(db, job_id):
+    db.session.expire_all()
+    return db.session.get(Job, job_id)
+
+
+def _expire_lease(db, job_id):
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job_id)
+        .values(lease_expires_at=text("now() - interval '1 second'"))
+    )
+    db.session.commit()
+
+
+def _fail(job_id, owner):
+    jobs._update(
+        jobs._FAIL_SQL,
+        {
+            "id": job_id,
+            "owner": owner,
+            "error": "出错",
+            "backoff": Config.JOB_RETRY_BACKOFF,
+            "progress": "{}",
+        },
+    )
+
+
+def test_enqueue_one_active_job_per_video(db):
+    first = enqueue(KIND, "v1")
+    assert first is not None
+    assert enqueue(KIND, "v1") is None
+    assert enqueue(KIND, "v2") is not None
+    assert enqueue("other_kind", "v1") is not None
+
+    # 任务结束后可以再次创建
+    db.session.execute(update(Job).where(Job.id == first).values(status="completed"))
+    db.session.commit()
+    assert enqueue(KIND, "v1") not in (None, first)
+
+
+def test_claim_in_order_up_to_concurrency(db):
+    ids = [enqueue(KIND, f"v{index}") for index in range(3)]
+
+    first = claim(KIND, "a")
+    second = claim(KIND, "b")
+    assert [first.id, second.id] == ids[:2]
+    assert first.attempts == 1
+    # 已有两个任务持有租约，达到并发上限
+    assert claim(KIND, "c") is None
+
+    job = _job(db, ids[0])
+    assert job.status == "running"
+    assert job.lease_owner == "a"
+    assert job.started_at is not None
+
+
+def test_claim_skips_locked_rows(db, app):
+    ids = [enqueue(KIND, f"v{index}") for index in range(2)]
+    with db.engine.connect() as conn:
+        # 另一个事务正持有第一个任务的行锁
+        conn.execute(select(Job.id).where(Job.id == ids[0]).with_for_update())
+        assert claim(KIND, "a").id == ids[1]
+        conn.rollback()
+    assert claim(KIND, "b").id == ids[0]
+
+
+def test_concurrent_claims_never_share_a_job(db, app, monkeypatch):
+    monkeypatch.setitem(Config.JOB_CONCURRENCY, KIND, 4)
+    for index in range(10):
+        enqueue(KIND, f"v{index}")
+    claimed = []
+
+    def worker(owner):
+        with app.app_context():
+            while (job := claim(KIND, owner)) is not None:
+                claimed.append(job.id)
+                jobs._update(
+                    jobs._FINISH_SQL,
+                    {
+                        "id": job.id,
+                        "owner": owner,
+                        "status": "completed",
+                        "progress": "{}",
+                    },
+                )
+
+    threads = [threading.Thread(target=worker, args=(f"w{n}",)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(claimed) == len(set(claimed)) == 10
+    statuses = db.session.execute(select(Job.status)).scalars().all()
+    assert statuses == ["completed"] * 10
+
+
+def test_expired_lease_is_reclaimed(db):
+    job_id = enqueue(KIND, "v1")
+    claim(KIND, "a")
+    _expire_lease(db, job_id)
+
+    job = claim(KIND, "b")
+    assert job.id == job_id
+    assert job.attempts == 2
+    assert _job(db, job_id).lease_owner == "b"
+
+    # 原持有者的心跳和写回不再生效
+    heartbeat = jobs._update(
+        jobs._HEARTBEAT_SQL,
+        {"id": job_id, "owner": "a", "lease": 60, "progress": "{}"},
+    )
+    assert heartbeat.first() is None
+    jobs._update(
+        jobs._FINISH_SQL,
+        {"id": job_id, "owner": "a", "status": "completed", "progress": "{}"},
+    )
+    assert _job(db, job_id).status == "running"
+
+
+def test_reap_expired_jobs(db):
+    cancelled = enqueue(KIND, "v1")
+    exhausted = enqueue(KIND, "v2")
+    waiting = enqueue(KIND, "v3")
+    claim(KIND, "a")
+    claim(KIND, "a")
+    request_cancel(KIND, "v1")
+    db.session.execute(
+        update(Job).where(Job.id == exhausted).values(attempts=Config.JOB_MAX_ATTEMPTS)
+    )
+    db.session.commit()
+    _expire_lease(db, cancelled)
+    _expire_lease(db, exhausted)
+
+    # 清理后两个并发名额空出，排队的任务被认领
+    assert claim(KIND, "b").id == waiting
+
+    job = _job(db, cancelled)
+    assert (job.status, job.lease_owner) == ("cancelled", None)
+    assert job.finished_at is not None
+    job = _job(db, exhausted)
+    assert job.status == "error"
+    assert job.error == "任务租约过期次数超过上限"
+
+
+def test_failed_job_requeued_with_backoff(db):
+    job_id = enqueue(KIND, "v1")
+    claim(KIND, "a")
+    _fail(job_id, "a")
+
+    job = _job(db, job_id)
+    assert (job.status, job.error, job.lease_owner) == ("queued", "出错", None)
+    delay = db.session.execute(
+        select(Job.run_after - text("now()")).where(Job.id == job_id)
+    ).scalar_one()
+    assert 9 < delay.total_seconds() <= 10
+    # 退避期间不会被认领
+    assert claim(KIND, "a") is None
+
+    db.session.execute(
+        update(Job).where(Job.id == job_id).values(run_after=text("now()"))
+    )
+    db.session.commit()
+    assert claim(KIND, "a").attempts == 2
+    _fail(job_id, "a")
+    delay = db.session.execute(
+        select(Job.run_after - text("now()")).where(Job.id == job_id)
+    ).scalar_one()
+    assert 19 < delay.total_seconds() <= 20
+
+
+def test_failed_job_errors_after_max_attempts(db):
+    job_id = enqueue(KIND, "v1")
+    db.session.execute(
+        update(Job).where(Job.id == job_id).values(attempts=Config.JOB_MAX_ATTEMPTS - 1)
+    )
+    db.session.commit()
+    claim(KIND, "a")
+    _fail(job_id, "a")
+
+    job = _job(db, job_id)
+    assert job.status == "error"
+    assert job.finished_at is not None
+    assert enqueue(KIND, "v1") is not None
+
+
+def test_worker_counts_handler_errors(db, app):
+    job_id = enqueue(KIND, "v1")
+    key = metrics.job_errors._key({"kind": KIND, "stage": "handler"})
+    before = metrics.job_errors._values.get(key, 0)
+
+    def handler(ctx):
+        raise ValueError("处理失败")
+
+    worker = jobs.JobWorker(app, {KIND: handler}, threading.Event(), name="test")
+    worker._execute(claim(KIND, worker.owner))
+
+    assert metrics.job_errors._values[key] == before + 1
+    job = _job(db, job_id)
+    assert (job.status, job.error) == ("queued", "处理失败")
@@ -0,0 +1,17 @@
+from migrate_comments import legacy_video_id
+
+
+def test_legacy_comment_tables():
+    assert legacy_video_id("video_7300000000000000001") == "7300000000000000001"
+
+
+def test_current_tables_are_not_legacy():
+    for name in (
+        "video_meta",
+        "video_stats_history",
+        "videos",
+        "video_",
+        "comments",
+        "sentiment_results",
+    ):
+        assert legacy_video_id(name) is None
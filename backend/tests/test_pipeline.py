@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+from app import pipeline
+from app.pipeline import AnalysisCheckpoint
+
+
+def _comments(*seqs):
+    return [SimpleNamespace(seq=seq) for seq in seqs]
+
+
+def _record_advances(monkeypatch):
+    advances = []
+    monkeypatch.setattr(
+        pipeline,
+        "advance_analyzed_seq",
+        lambda video_id, start_seq, last_seq: advances.append((start_seq, last_seq)),
+    )
+    return advances
+
+
+def test_checkpoint_stops_before_first_missing_result(monkeypatch):
+    advances = _record_advances(monkeypatch)
+    checkpoint = AnalysisCheckpoint("v1", 1)
+    checkpoint.update(_comments(1, 2, 3), ["高兴", "愤怒", "高兴"])
+    checkpoint.update(_comments(4, 5, 6), ["高兴", None, "高兴"])
+    checkpoint.update(_comments(7, 8, 9), ["高兴", "高兴", "高兴"])
+    checkpoint.flush()
+    assert advances == [(1, 3), (1, 4)]
+
+
+def test_checkpoint_writes_every_n_batches_and_on_flush(monkeypatch):
+    advances = _record_advances(monkeypatch)
+    checkpoint = AnalysisCheckpoint("v1", 0, every=2)
+    for start in range(0, 50, 10):
+        checkpoint.update(_comments(*range(start, start + 10)), ["高兴"] * 10)
+    assert advances == [(0, 19), (0, 39)]
+    checkpoint.flush()
+    checkpoint.flush()
+    assert advances == [(0, 19), (0, 39), (0, 49)]
+
+
+def test_checkpoint_does_not_advance_when_first_result_is_missing(monkeypatch):
+    advances = _record_advances(monkeypatch)
+    checkpoint = AnalysisCheckpoint("v1", 5)
+    checkpoint.update(_comments(5, 6), [None, "高兴"])
+    checkpoint.flush()
+    assert advances == []
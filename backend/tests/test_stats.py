@@ -0,0 +1,185 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from app import stats
+from app.backends import result_revision
+from app.config import Config
+from app.database import ensure_video, record_published_at
+from app.ingest import upsert_comments
+from app.models import Comment
+from app.sentiment_store import save_results, text_hash
+from app.sql import check_server_version
+
+# 2024-01-01 23:00（Asia/Shanghai）
+START = datetime(2024, 1, 1, 15, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache(monkeypatch):
+    monkeypatch.setattr(Config, "STATS_TIMEZONE", "Asia/Shanghai")
+    stats._cache.clear()
+    yield
+    stats._cache.clear()
+
+
+@pytest.fixture
+def aggregations(monkeypatch):
+    calls = []
+    aggregate = stats._aggregate
+
+    def counting(video, bucket, align):
+        calls.append((video.video_id, bucket, align))
+        return aggregate(video, bucket, align)
+
+    monkeypatch.setattr(stats, "_aggregate", counting)
+    return calls
+
+
+def _add(db, video_id, comments):
+    """
+    写入评论及其情绪分析结果，comments 为 [(cid, 发布后分钟数, 标签), ...]。
+    """
+    rows = [
+        {
+            "cid": cid,
+            "parent_cid": None,
+            "text": cid,
+            "create_time": START + timedelta(minutes=minutes),
+            "reply_comment_total": 0,
+        }
+        for cid, minutes, _ in comments
+    ]
+    upsert_comments(video_id, rows)
+    seqs = dict(
+        db.session.execute(
+            select(Comment.cid, Comment.seq).where(Comment.video_id == video_id)
+        ).all()
+    )
+    save_results(
+        video_id,
+        [
+            {
+                "cid": cid,
+                "seq": seqs[cid],
+                "text_hash": text_hash(cid),
+                "label": label,
+                "scores": {label: 1.0},
+            }
+            for cid, _, label in comments
+        ],
+        result_revision(),
+    )
+
+
+def _stats(db, video_id, **kwargs):
+    # 每次调用相当于一个新请求，不复用会话中已加载的视频摘要
+    db.session.commit()
+    return stats.get_emotion_stats(video_id, **kwargs)
+
+
+def test_calendar_buckets_follow_stats_timezone(db):
+    ensure_video("v1")
+    _add(db, "v1", [("a", 0, "高兴"), ("b", 30, "悲伤"), ("c", 70, "高兴")])
+
+    result, status = _stats(db, "v1", bucket="day")
+    assert status == 200
+    assert result["total"] == 3
+    assert result["distribution"] == {"高兴": 2, "悲伤": 1}
+    buckets = [datetime.fromisoformat(item["bucket"]) for item in result["timeline"]]
+    # 前两条在 1 月 1 日，第三条已是 1 月 2 日 00:10
+    assert buckets == [START - timedelta(hours=23), START + timedelta(hours=1)]
+    assert [item["counts"] for item in result["timeline"]] == [
+        {"高兴": 1, "悲伤": 1},
+        {"高兴": 1},
+    ]
+
+    result, _ = _stats(db, "v1", bucket="hour")
+    assert [item["total"] for item in result["timeline"]] == [2, 1]
+
+
+def test_publish_buckets(db):
+    ensure_video("v1")
+    _add(db, "v1", [("a", 10, "高兴"), ("b", 50, "悲伤"), ("c", 130, "高兴")])
+
+    result, status = _stats(db, "v1", align="publish")
+    assert status == 400
+
+    record_published_at({"v1": START})
+    result, status = _stats(db, "v1", align="publish")
+    assert status == 200
+    assert [item["bucket"] for item in result["timeline"]] == [0, 2]
+    assert [item["total"] for item in result["timeline"]] == [2, 1]
+    assert result["published_at"] == START.isoformat()
+
+
+def test_cached_until_version_changes(db, aggregations, monkeypatch):
+    ensure_video("v1")
+    _add(db, "v1", [("a", 0, "高兴")])
+
+    first, _ = _stats(db, "v1")
+    again, _ = _stats(db, "v1")
+    assert again is first
+    assert len(aggregations) == 1
+    # 不同粒度分别缓存
+    _stats(db, "v1", bucket="day")
+    assert len(aggregations) == 2
+
+    # 写入新评论和结果后摘要变化，版本号随之变化
+    _add(db, "v1", [("b", 5, "悲伤")])
+    updated, _ = _stats(db, "v1")
+    assert updated["version"] != first["version"]
+    assert updated["distribution"] == {"高兴": 1, "悲伤": 1}
+    assert len(aggregations) == 3
+
+    # 覆盖已有结果（标签变化）也会改变版本号
+    save_results(
+        "v1",
+        [
+            {
+                "cid": "a",
+                "seq": 1,
+                "text_hash": "changed",
+                "label": "悲伤",
+                "scores": {},
+            }
+        ],
+        result_revision(),
+    )
+    relabeled, _ = _stats(db, "v1")
+    assert relabeled["distribution"] == {"悲伤": 2}
+    assert len(aggregations) == 4
+
+    # 发布时间和模型版本都计入版本号
+    record_published_at({"v1": START})
+    published, _ = _stats(db, "v1")
+    assert published["version"] != relabeled["version"]
+    monkeypatch.setattr(Config, "MODEL_REVISION", "other")
+    other, _ = _stats(db, "v1")
+    assert other["total"] == 0
+    assert len(aggregations) == 6
+
+
+def test_invalid_parameters():
+    assert stats.get_emotion_stats("")[1] == 400
+    assert stats.get_emotion_stats("v1", bucket="week")[1] == 400
+    assert stats.get_emotion_stats("v1", align="upload")[1] == 400
+
+
+def test_unknown_video(db):
+    assert _stats(db, "missing")[1] == 404
+
+
+@pytest.mark.parametrize("version", [(11, 22), (9, 6, 24)])
+def test_check_server_version_rejects_old_servers(version):
+    conn = SimpleNamespace(dialect=SimpleNamespace(server_version_info=version))
+    with pytest.raises(RuntimeError, match="PostgreSQL 12"):
+        check_server_version(conn)
+
+
+def test_check_server_version_accepts_supported_servers():
+    for version in [(12, 0), (16, 4)]:
+        conn = SimpleNamespace(dialect=SimpleNamespace(server_version_info=version))
+        check_server_version(conn)
@@ -0,0 +1,103 @@
+import gzip
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from app import streaming
+from app.config import Config
+from app.pipeline import _columnar_frame
+from app.streaming import encode_stream, negotiate_encoding
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        ("gzip, deflate, br", "gzip"),
+        ("GZIP", "gzip"),
+        ("gzip;q=0", None),
+        ("gzip; q=0.0, identity", None),
+        ("deflate", None),
+        ("", None),
+        (None, None),
+    ],
+)
+def test_negotiate_encoding(accept_encoding, expected):
+    assert negotiate_encoding(accept_encoding) == expected
+
+
+def test_negotiate_encoding_prefers_zstd_when_available(monkeypatch):
+    monkeypatch.setattr(streaming, "zstandard", object())
+    assert negotiate_encoding("gzip, zstd") == "zstd"
+    assert negotiate_encoding("gzip, zstd;q=0") == "gzip"
+    monkeypatch.setattr(streaming, "zstandard", None)
+    assert negotiate_encoding("gzip, zstd") == "gzip"
+
+
+def _blocks(count):
+    return [f'{{"seq": {seq}}}\n'.encode() for seq in range(count)]
+
+
+def test_encode_stream_coalesces_blocks(monkeypatch):
+    monkeypatch.setattr(Config, "STREAM_CHUNK_BYTES", 30)
+    monkeypatch.setattr(Config, "STREAM_FLUSH_MS", 60_000)
+    blocks = _blocks(10)
+    chunks = list(encode_stream(iter(blocks)))
+    assert b"".join(chunks) == b"".join(blocks)
+    assert 1 < len(chunks) < len(blocks)
+    assert all(len(chunk) >= 30 for chunk in chunks[:-1])
+
+
+def test_encode_stream_gzip_round_trip(monkeypatch):
+    monkeypatch.setattr(Config, "STREAM_CHUNK_BYTES", 64)
+    blocks = _blocks(50)
+    data = b"".join(encode_stream(iter(blocks), "gzip"))
+    assert gzip.decompress(data) == b"".join(blocks)
+
+
+def test_encode_stream_zstd_round_trip():
+    zstandard = pytest.importorskip("zstandard")
+    blocks = _blocks(50)
+    data = b"".join(encode_stream(iter(blocks), "zstd"))
+    reader = zstandard.ZstdDecompressor().stream_reader(data)
+    assert reader.read() == b"".join(blocks)
+
+
+def test_encode_stream_closes_source_on_close(monkeypatch):
+    monkeypatch.setattr(Config, "STREAM_CHUNK_BYTES", 1)
+    closed = []
+
+    def source():
+        try:
+            yield from _blocks(10)
+        finally:
+            closed.append(True)
+
+    stream = encode_stream(source())
+    next(stream)
+    stream.close()
+    assert closed == [True]
+
+
+def test_columnar_frame():
+    created = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+    comments = [
+        SimpleNamespace(
+            seq=seq,
+            cid=f"c{seq}",
+            text=f"评论{seq}",
+            create_time=created,
+            reply_comment_total=seq,
+        )
+        for seq in (1, 2, 3, 4)
+    ]
+    frame = _columnar_frame(comments, ["高兴", None, "愤怒", "高兴"])
+
+    assert frame["seq"] == [1, 2, 3, 4]
+    assert frame["cid"] == ["c1", "c2", "c3", "c4"]
+    assert frame["create_time"] == [int(created.timestamp())] * 4
+    assert frame["labels"] == ["高兴", "愤怒"]
+    assert frame["predicted_emotion"] == [0, None, 1, 0]
+    # 帧需能直接序列化为一行 JSON
+    assert json.loads(streaming.dumps(frame)) == frame
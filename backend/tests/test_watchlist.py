@@ -0,0 +1,29 @@
+import math
+
+from app.config import Config
+from app.watchlist import estimate_pages, sync_interval
+
+
+def test_sync_interval_without_estimate_is_minimum():
+    assert sync_interval(None) == Config.WATCH_MIN_INTERVAL
+
+
+def test_sync_interval_for_quiet_video_is_maximum():
+    assert sync_interval(0) == Config.WATCH_MAX_INTERVAL
+
+
+def test_sync_interval_targets_new_comments_per_sync():
+    velocity = Config.WATCH_TARGET_NEW_COMMENTS / 2
+    assert sync_interval(velocity) == 7200
+
+
+def test_sync_interval_is_clamped():
+    assert sync_interval(1e9) == Config.WATCH_MIN_INTERVAL
+    assert sync_interval(1e-9) == Config.WATCH_MAX_INTERVAL
+
+
+def test_estimate_pages_includes_known_comments_before_stopping():
+    assert estimate_pages(0) == math.ceil(
+        Config.SYNC_STOP_AFTER_KNOWN / Config.WATCH_PAGE_SIZE
+    )
+    assert estimate_pages(Config.WATCH_PAGE_SIZE) == estimate_pages(0) + 1
@@ -0,0 +1,51 @@
+"""
+独立的任务工作进程，从数据库任务队列中认领并执行抓取与分析任务。
+
+用法：
+    python3 worker.py              # 启动 Config.JOB_WORKERS 个工作线程
+    python3 worker.py --workers 8
+
+可在多台机器上同时运行多个工作进程，各类任务的全局并发上限由 Config.JOB_CONCURRENCY 控制。
+收到 SIGTERM / SIGINT 后停止认领新任务，执行中的任务在当前批次结束后放回队列，由其他工作进程继续。
+"""
+
+import argparse
+import signal
+
+from app import create_app
+from app.config import Config
+from app.jobs import start_workers, stop_event
+from app.pipeline import start_model_warmup
+from app.tasks import TASK_HANDLERS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="任务队列工作进程")
+    parser.add_argument(
+        "--workers", type=int, default=Config.JOB_WORKERS, help="工作线程数"
+    )
+    args = parser.parse_args()
+
+    # 连接池按工作线程数设置大小，本进程没有请求线程
+    Config.JOB_WORKERS = args.workers
+    Config.SERVER_THREADS = 0
+    app = create_app(background=False)
+    start_model_warmup()
+
+    def shutdown(signum, frame):
+        print("正在停止工作进程，执行中的任务将放回队列")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    workers = start_workers(app, args.workers, TASK_HANDLERS)
+    print(f"已启动 {len(workers)} 个任务工作线程")
+    while not stop_event.wait(1):
+        pass
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+"""
+生产环境的 WSGI 入口，配合 gunicorn.conf.py 使用：
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn 以 preload_app 方式在主进程中导入本模块：应用只创建一次，pytorch 模型权重也只加载一次，
+fork 出的工作进程以写时复制方式共享；模型预热、任务工作线程等后台服务在各工作进程 fork 后启动。
+"""
+
+from app import create_app
+from app.pipeline import preload_model
+
+app = create_app(background=False)
+preload_model()
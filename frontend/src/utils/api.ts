@@ -24,6 +24,22 @@ export const getVideoInfo = async (videoId: string) => {
   return res.data
 }
 
+// 批量获取视频信息，返回 { videos: { [video_id]: 视频信息 }, errors: { [video_id]: 错误描述 } }
+export const getVideoInfoBatch = async (videoIds: string[]) => {
+  const res = await request.get('/video_info_batch', {
+    params: { video_ids: videoIds.join(',') },
+  })
+  return res.data
+}
+
+// 获取视频统计数据（播放、点赞、评论等）的历史快照
+export const getVideoStatsHistory = async (videoId: string) => {
+  const res = await request.get('/video_stats_history', {
+    params: { video_id: videoId },
+  })
+  return res.data
+}
+
 // 获取视频评论（返回 NDJSON 流数据），需要传递 video_id 参数
 export const fetchComments = async (videoId: string) => {
   const res = await request.get('/fetch_comments', {
@@ -42,13 +58,61 @@ export const fetchCommentsReplies = async (videoId: string) => {
   return res.data
 }
 
-// 情感分析管道（返回 NDJSON 流数据），需要传递 video_id 参数，start 参数默认为 0
+// 获取视频情绪统计：按时间桶（hour/day）的情绪计数和总体分布，align 为 publish 时按发布后经过的时间分桶
+export const getEmotionStats = async (
+  videoId: string,
+  bucket: 'hour' | 'day' = 'hour',
+  align: 'calendar' | 'publish' = 'calendar',
+) => {
+  const res = await request.get('/emotion_stats', {
+    params: { video_id: videoId, bucket, align },
+  })
+  return res.data
+}
+
+// 情感分析管道的列式帧：每个字段一个数组，predicted_emotion 为 labels 中的下标
+interface ColumnarFrame {
+  seq: number[]
+  cid: string[]
+  text: string[]
+  create_time: number[]
+  reply_comment_total: number[]
+  labels: string[]
+  predicted_emotion: (number | null)[]
+}
+
+// 将列式帧展开为逐条评论的结果，create_time 由 Unix 时间戳还原为 ISO 8601 字符串
+export function* expandColumnarFrame(frame: ColumnarFrame) {
+  for (let i = 0; i < frame.seq.length; i++) {
+    const label = frame.predicted_emotion[i]
+    yield {
+      seq: frame.seq[i],
+      cid: frame.cid[i],
+      text: frame.text[i],
+      create_time: new Date(frame.create_time[i] * 1000).toISOString(),
+      reply_comment_total: frame.reply_comment_total[i],
+      predicted_emotion: label === null ? null : frame.labels[label],
+    }
+  }
+}
+
+// 解析一行数据：列式帧展开为逐条结果，其他内容（如错误信息）原样返回
+function* parsePipelineLine(line: string) {
+  const data = JSON.parse(line)
+  if (Array.isArray(data.seq)) {
+    yield* expandColumnarFrame(data as ColumnarFrame)
+  } else {
+    yield data
+  }
+}
+
+// 情感分析管道（以列式帧格式流式返回，逐条 yield 展开后的结果），需要传递 video_id 参数，start 参数默认为 0
 export async function* sentimentPipeline(
   videoId: string,
   start: number = 0,
   signal?: AbortSignal,
 ): AsyncGenerator<unknown, void, unknown> {
-  const url = `/api/sentiment_pipeline?video_id=${videoId}&start=${start}`
+  const url = `/api/sentiment_pipeline?video_id=${videoId}&start=${start}&format=columnar`
   const response = await fetch(url, { signal })
   if (!response.ok || !response.body) {
     throw new Error('网络请求失败或响应体为空')
@@ -70,8 +134,7 @@ export async function* sentimentPipeline(
       for (const line of lines) {
         if (line.trim()) {
           try {
-            const data = JSON.parse(line)
-            yield data
+            yield* parsePipelineLine(line)
           } catch (e) {
             console.error('解析 JSON 出错：', e)
           }
@@ -81,7 +144,7 @@ export async function* sentimentPipeline(
 
     if (buffer.trim()) {
       try {
-        yield JSON.parse(buffer)
+        yield* parsePipelineLine(buffer)
       } catch (e) {
         console.error('解析最后 JSON 出错：', e)
       }
@@ -94,6 +157,25 @@ export async function* sentimentPipeline(
   }
 }
 
+// 按条件查询评论，按 seq 键集分页：将返回的 next_cursor 作为下一次请求的 after，为 null 时没有更多结果
+export const searchComments = async (
+  videoId: string,
+  filters: {
+    emotion?: string
+    since?: string | number
+    until?: string | number
+    min_replies?: number
+    keyword?: string
+    after?: number
+    limit?: number
+  } = {},
+) => {
+  const res = await request.get('/search_comments', {
+    params: { video_id: videoId, ...filters },
+  })
+  return res.data
+}
+
 // 文本推理接口，需要在请求体中传入 text 字段
 export const inferText = async (text: string) => {
   const res = await request.post('/infer_text', { text })
@@ -108,6 +190,60 @@ export const cancelFetchComments = async (videoId: string) => {
   return res.data
 }
 
+// 创建增量同步评论任务接口，需要传入 video_id 参数，只抓取新评论和有变化的评论
+export const syncComments = async (videoId: string) => {
+  const res = await request.get('/sync_comments', {
+    params: { video_id: videoId },
+  })
+  return res.data
+}
+
+// 取消增量同步评论任务接口，需要传入 video_id 参数
+export const cancelSyncComments = async (videoId: string) => {
+  const res = await request.get('/cancel_sync_comments', {
+    params: { video_id: videoId },
+  })
+  return res.data
+}
+
+// 将视频加入关注列表，由后端按新评论速度自动安排增量同步
+export const watchVideo = async (videoId: string) => {
+  const res = await request.get('/watch_video', {
+    params: { video_id: videoId },
+  })
+  return res.data
+}
+
+// 将视频移出关注列表
+export const unwatchVideo = async (videoId: string) => {
+  const res = await request.get('/unwatch_video', {
+    params: { video_id: videoId },
+  })
+  return res.data
+}
+
+// 获取关注列表及各视频的新评论速度、同步时间
+export const getWatchlist = async () => {
+  const res = await request.get('/watchlist')
+  return res.data
+}
+
+// 创建后台分析视频情绪任务接口，需要传入 video_id 参数，从上次分析进度继续
+export const analyzeVideo = async (videoId: string) => {
+  const res = await request.get('/analyze_video', {
+    params: { video_id: videoId },
+  })
+  return res.data
+}
+
+// 取消分析视频情绪任务接口，需要传入 video_id 参数
+export const cancelAnalyzeVideo = async (videoId: string) => {
+  const res = await request.get('/cancel_analyze_video', {
+    params: { video_id: videoId },
+  })
+  return res.data
+}
+
 // 查询任务进度接口，可选传入 video_id 参数
 export const getTaskProgress = async (videoId?: string) => {
   const res = await request.get('/task_progress', {